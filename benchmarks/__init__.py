@@ -0,0 +1,11 @@
+"""Performance benchmarks.
+
+Benchmarks are not a part of the bot and are run from the project root as modules:
+
+    python -m benchmarks.db_executor
+
+The end-to-end load test writes its results as JSON to compare the commits:
+
+    make bench
+    make bench BASELINE=benchmarks/results/<previous run>.json
+"""
@@ -0,0 +1,109 @@
+"""Size of the category button callback data and the cost of routing a tap.
+
+The previous data was JSON (`{"act_id":..,"cat_id":..}`), and a category
+tap went through the filters of all the callback handlers of the dispatcher
+in turn: two comparisons of the message text and a substring search, then
+`json.loads`. The current data is `callback_data.encode`-d, and the only
+handler routes it by the action character.
+
+    python -m benchmarks.callback_routing [--number 100000]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+
+from settings import constants  # noqa: E402
+from timesheetbot import callback_data  # noqa: E402
+
+ACTIVITY_IDS = (10 ** 3, 10 ** 9, 2 ** 63 - 1)
+CATEGORY_ID = 10 ** 6
+
+
+def previous_data(activity_id: int, category_id: int) -> str:
+    return json.dumps({'act_id': activity_id, 'cat_id': category_id}, separators=(',', ':'))
+
+
+def make_previous_dispatcher(bot: Bot) -> Dispatcher:
+    dp = Dispatcher(bot)
+
+    @dp.callback_query_handler(lambda c: c.message.text == constants.CHOOSE_INTERVAL_TEXT)
+    async def set_replied_interval(callback_query: types.CallbackQuery):
+        int(callback_query.data)
+
+    @dp.callback_query_handler(lambda c: c.message.text == constants.CHOOSE_STATS_TEXT)
+    async def get_requested_stats(callback_query: types.CallbackQuery):
+        json.loads(callback_query.data)
+
+    @dp.callback_query_handler(lambda c: 'act_id' in c.data)
+    async def finish_activity(callback_query: types.CallbackQuery):
+        data = json.loads(callback_query.data)
+        data['act_id'], data['cat_id']
+
+    return dp
+
+
+def make_current_dispatcher(bot: Bot) -> Dispatcher:
+    dp = Dispatcher(bot)
+
+    async def handle(callback_query: types.CallbackQuery, *fields: int):
+        pass
+
+    handlers = {action: handle for action in callback_data.ACTIONS}
+
+    @dp.callback_query_handler()
+    async def route_callback_query(callback_query: types.CallbackQuery):
+        action, fields = callback_data.decode(callback_query.data)
+        await handlers[action](callback_query, *fields)
+
+    return dp
+
+
+def make_update(data: str) -> types.Update:
+    return types.Update(update_id=1, callback_query={
+        'id': '1', 'chat_instance': '1', 'data': data,
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+        'message': {'message_id': 1, 'date': 1700000000, 'chat': {'id': 1, 'type': 'private'},
+                    'text': 'Что делал в этот период: 10:00:00 - 10:15:00'},
+    })
+
+
+async def route(dp: Dispatcher, update: types.Update, number: int) -> float:
+    """Return microseconds per routed tap."""
+    started_at = time.perf_counter()
+    for _ in range(number):
+        await dp.process_update(update)
+    return (time.perf_counter() - started_at) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f'{"activity id":>20}{"previous, bytes":>17}{"current, bytes":>16}')
+    for activity_id in ACTIVITY_IDS:
+        current = callback_data.encode(callback_data.FILL_ACTIVITY, activity_id, CATEGORY_ID)
+        print(f'{activity_id:>20}{len(previous_data(activity_id, CATEGORY_ID)):>17}{len(current):>16}')
+
+    activity_id = ACTIVITY_IDS[1]
+    bot = Bot(token='123456789:benchmark-token')
+    cases = {
+        'previous': (make_previous_dispatcher(bot), previous_data(activity_id, CATEGORY_ID)),
+        'current': (make_current_dispatcher(bot),
+                    callback_data.encode(callback_data.FILL_ACTIVITY, activity_id, CATEGORY_ID)),
+    }
+    print(f'\n{"route a tap":<12}{"us per call":>12}')
+    for name, (dp, data) in cases.items():
+        microseconds = asyncio.run(route(dp, make_update(data), args.number))
+        print(f'{name:<12}{microseconds:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
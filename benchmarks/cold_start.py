@@ -0,0 +1,114 @@
+"""Cold start: import time of the CLI, the database layer and the bot server.
+
+Every module is imported in a fresh interpreter with `python -X importtime`,
+the cumulative time of the module is taken from its report (the interpreter
+startup itself is not included). `manage` is what every management command
+pays before it runs; the heaviest imports of the bot server are listed to
+see where its time goes.
+
+The budgets in `BUDGETS` are relative to baselines measured on the same
+machine, so they hold on a slower one too: the imports of the interpreter
+startup (`python -c pass`) for the modules importing no aiogram, and
+`import aiogram` for the bot server, which is mostly aiogram. With `--check`
+the run fails if the median import time of a module exceeds its budget, see
+`make coldstart`.
+
+    python -m benchmarks.cold_start [--repeat 7] [--check]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from .common import PROJECT_DIR, setup_env
+
+setup_env()
+
+STARTUP = 'startup'
+# module: (baseline module or `STARTUP`, max ratio of the import time of the module to the one of the baseline)
+BUDGETS = {
+    'manage': (STARTUP, 2.0),
+    'timesheetbot.db_manager': (STARTUP, 3.5),
+    'timesheetbot.server': ('aiogram', 1.25),
+}
+TOP_IMPORTS = 10
+
+
+def import_time(module: Optional[str]) -> List[Tuple[int, str, float]]:
+    """Return (nesting level, module, cumulative ms) of every import made by importing `module`.
+
+    Without the module, the imports of the interpreter startup.
+    """
+    code = 'pass' if module is None else f'import {module}'
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=PROJECT_DIR,
+                             env=os.environ, capture_output=True, text=True, check=True)
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        level = (len(name) - len(name.lstrip())) // 2
+        imports.append((level, name.strip(), int(cumulative) / 1000))
+    return imports
+
+
+def measure_startup(repeat: int) -> float:
+    """Return the median time of the imports of the interpreter startup."""
+    return statistics.median(
+        sum(ms for level, _, ms in import_time(None) if level == 0)
+        for _ in range(repeat)
+    )
+
+
+def measure(module: str, repeat: int) -> Tuple[float, List[Tuple[str, float]]]:
+    """Return the median import time of the module and its heaviest direct imports of the last run."""
+    times = []
+    for _ in range(repeat):
+        imports = import_time(module)
+        times.append(imports[-1][2])
+
+    # an import is reported after the imports it made, the module is the last one
+    children = []
+    for level, name, ms in reversed(imports[:-1]):
+        if level == 0:
+            break
+        if level == 1:
+            children.append((name, ms))
+    return statistics.median(times), sorted(children, key=lambda item: -item[1])[:TOP_IMPORTS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--check', action='store_true', help='exit with 1 if a module exceeds its budget')
+    args = parser.parse_args()
+
+    baselines: Dict[str, float] = {STARTUP: measure_startup(args.repeat)}
+    for baseline, _ in BUDGETS.values():
+        if baseline not in baselines:
+            baselines[baseline], _ = measure(baseline, args.repeat)
+
+    print(f'{"baseline":<28}{"import, ms":>12}')
+    for baseline, ms in baselines.items():
+        print(f'{baseline:<28}{ms:>12.1f}')
+
+    ratios: Dict[str, float] = {}
+    print(f'\n{"module":<28}{"import, ms":>12}{"baseline":>12}{"ratio":>8}{"budget":>8}')
+    for module, (baseline, budget) in BUDGETS.items():
+        ms, top_imports = measure(module, args.repeat)
+        ratios[module] = ms / baselines[baseline]
+        print(f'{module:<28}{ms:>12.1f}{baseline:>12}{ratios[module]:>8.2f}{budget:>8.2f}')
+
+    print('\nheaviest imports of timesheetbot.server:')
+    for name, ms in top_imports:
+        print(f'  {name:<38}{ms:>8.1f} ms')
+
+    over_budget = [module for module, ratio in ratios.items() if ratio > BUDGETS[module][1]]
+    if args.check and over_budget:
+        sys.exit(f'\nCold start over budget: {", ".join(over_budget)}')
+
+
+if __name__ == '__main__':
+    main()
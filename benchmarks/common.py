@@ -0,0 +1,105 @@
+"""Helpers shared by the benchmarks.
+
+`setup_env` must be called before anything from `settings` or `timesheetbot`
+is imported: the settings are read from the environment at import.
+"""
+import contextlib
+import os
+import socket
+import statistics
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Sequence
+
+if TYPE_CHECKING:
+    from .fake_bot_api import FakeBotAPI
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+NO_LIMIT = 10 ** 9
+
+
+def setup_env() -> Path:
+    """Prepare a sandbox environment for the bot settings and return its directory."""
+    tmp_dir = Path(tempfile.mkdtemp(prefix='timesheetbot-bench-'))
+    access_ids_file = tmp_dir / 'allowed_accounts.json'
+    access_ids_file.write_text('[]', encoding='utf-8')
+
+    os.environ.setdefault('TELEGRAM_API_TOKEN', '123456789:benchmark-token')
+    os.environ.setdefault('ACCESS_IDS_FILE', str(access_ids_file))
+    os.environ.setdefault('DEBUG_MODE', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('DB_NAME', str(tmp_dir / 'timesheet.db'))
+    os.environ.setdefault('METRICS_PORT', '0')
+    os.environ.setdefault('DB_MIGRATIONS_DIR', str(PROJECT_DIR / 'migrations'))
+    return tmp_dir
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def setup_fake_bot_api_env() -> int:
+    """Point the bot at the fake Bot API and return its port.
+
+    The port is kept in the environment, so spawned worker processes use the same one.
+    """
+    port = int(os.environ.setdefault('FAKE_BOT_API_PORT', str(get_free_port())))
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{port}'
+    return port
+
+
+@contextlib.asynccontextmanager
+async def running_bot(port: int, limits: bool = True) -> AsyncIterator['FakeBotAPI']:
+    """Start the fake Bot API on the port and the bot app against it, stop both on exit.
+
+    Without `limits` neither the fake Bot API nor the outbox limit the rate of the calls.
+    """
+    # imported here: the settings are read at import, after `setup_env`
+    from aiogram import Bot, Dispatcher
+
+    from timesheetbot import server
+
+    from .fake_bot_api import FakeBotAPI
+
+    rate_options = {} if limits else dict(rate=NO_LIMIT, burst=NO_LIMIT, chat_rate=NO_LIMIT, chat_burst=NO_LIMIT)
+    fake_api = FakeBotAPI(**rate_options)
+    await fake_api.start(port=port)
+    try:
+        server.create_app(**rate_options)
+        Bot.set_current(server.bot)
+        Dispatcher.set_current(server.dp)
+        await server.on_startup(server.dp)
+        try:
+            yield fake_api
+        finally:
+            await server.on_shutdown(server.dp)
+            await (await server.bot.get_session()).close()
+    finally:
+        await fake_api.stop()
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(latencies: Sequence[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+    }
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]]) -> None:
+    print(f'\n{title}')
+    print(f'{"":<28}{"count":>8}{"p50, ms":>12}{"p99, ms":>12}{"max, ms":>12}')
+    for name, summary in rows.items():
+        print(f'{name:<28}{summary["count"]:>8}{summary["p50_ms"]:>12.2f}'
+              f'{summary["p99_ms"]:>12.2f}{summary["max_ms"]:>12.2f}')
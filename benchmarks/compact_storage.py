@@ -0,0 +1,87 @@
+"""Database size, stats cost and callback payload length: legacy vs. compact storage.
+
+Fills the database in the format preceding the 004 migration, measures it,
+converts it with `DBManager.compact_legacy_rows` (as `manage.py compact` does)
+and measures again.
+
+    python -m benchmarks.compact_storage [--users 200] [--activities 4000]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import timedelta
+from uuid import uuid4 as uuid
+
+from .common import setup_env
+
+setup_env()
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot import utils  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+LEGACY_FRAME_QUERY = '''
+    SELECT timesheet_legacy.start, timesheet_legacy.finish, category.name FROM timesheet_legacy
+    JOIN category ON category.id = timesheet_legacy.default_category_id
+    WHERE timesheet_legacy.session_id IN (SELECT id FROM session WHERE user_telegram_id = ?)
+'''
+FRAME_QUERY = '''
+    SELECT timesheet.finish - timesheet.start, category.name FROM timesheet
+    JOIN category ON category.id = timesheet.default_category_id
+    WHERE timesheet.session_id IN (SELECT id FROM session WHERE user_telegram_id = ?)
+'''
+
+
+def legacy_total_time(db: DBManager, user_id: int) -> timedelta:
+    total = timedelta()
+    for start, finish, _ in db._cursor.execute(LEGACY_FRAME_QUERY, (user_id,)):
+        total += utils.parse_datetime(finish) - utils.parse_datetime(start)
+    return total
+
+
+def total_time(db: DBManager, user_id: int) -> timedelta:
+    seconds = sum(duration for duration, _ in db._cursor.execute(FRAME_QUERY, (user_id,)))
+    return timedelta(seconds=seconds)
+
+
+def measure(title: str, db: DBManager, stats, users: int) -> None:
+    db.vacuum()
+    size_mb = os.path.getsize(DB_NAME) / 2 ** 20
+
+    started_at = time.perf_counter()
+    for user_id in range(1, users + 1):
+        stats(db, user_id)
+    stats_ms = (time.perf_counter() - started_at) / users * 1000
+    print(f'{title:<10}{size_mb:>12.1f}{stats_ms:>26.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--activities', type=int, default=4000, help='activities per user')
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.migrate()
+    populate(DB_NAME, args.users, args.activities, legacy=True)
+
+    print(f'{"":<10}{"size, MiB":>12}{"user all-time stats, ms":>26}')
+    measure('legacy', db, legacy_total_time, args.users)
+
+    started_at = time.perf_counter()
+    while db.compact_legacy_rows():
+        pass
+    compact_seconds = time.perf_counter() - started_at
+    measure('compact', db, total_time, args.users)
+    print(f'\nOnline conversion of {args.users * args.activities} activities: {compact_seconds:.1f} s')
+
+    legacy_payload = json.dumps({'act_id': str(uuid()), 'cat_id': 123456}, ensure_ascii=False)
+    payload = json.dumps({'act_id': 12345678, 'cat_id': 123456}, separators=(',', ':'))
+    print(f'Category button callback_data: {len(legacy_payload)} -> {len(payload)} bytes')
+
+
+if __name__ == '__main__':
+    main()
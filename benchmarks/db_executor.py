@@ -0,0 +1,109 @@
+"""Handler latency under concurrent load: blocking `DBManager` vs. `AsyncDBManager`.
+
+Handlers arrive on a fixed schedule (open loop); latency is measured from the
+planned arrival time, so stalls of the event loop are not hidden.
+
+    python -m benchmarks.db_executor [--users 50] [--activities 4000] [--seconds 5]
+"""
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from .common import print_table, setup_env, summarize
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot.db_manager import AsyncDBManager, DBManager, DoesNotExist  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+
+def make_handlers(call: Callable[..., Awaitable], users: int) -> Dict[str, Callable[[int], Awaitable]]:
+    async def no_db(user_id: int):
+        # e.g. /help: only talks to Telegram
+        await asyncio.sleep(0.001)
+
+    async def tick(user_id: int):
+        u = types.User(id=user_id)
+        session_id, _ = await call('get_new_or_existing_session_id', u)
+        await call('start_activity', session_id, 60)
+        await call('list_categories', u)
+
+    async def stats(user_id: int):
+        u = types.User(id=user_id)
+        try:
+            session = await call('get_last_started_session', u)
+            await call('get_session_category_durations', session[0])
+        except DoesNotExist:
+            pass
+
+    return {'no_db (/help)': no_db, 'tick prompt': tick, 'stats': stats}
+
+
+async def run_load(call: Callable[..., Awaitable], users: int, seconds: float, rps: float) -> Dict[str, List[float]]:
+    handlers = make_handlers(call, users)
+    kinds = ('no_db (/help)',) * 6 + ('tick prompt',) * 3 + ('stats',)
+    latencies = {kind: [] for kind in handlers}
+
+    async def timed(kind: str, user_id: int, planned_at: float):
+        await handlers[kind](user_id)
+        latencies[kind].append(time.perf_counter() - planned_at)
+
+    tasks = []
+    gap = 1 / rps
+    started_at = time.perf_counter()
+    for num in range(int(seconds * rps)):
+        planned_at = started_at + num * gap
+        delay = planned_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = kinds[num % len(kinds)]
+        tasks.append(asyncio.create_task(timed(kind, num % users + 1, planned_at)))
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def bench_blocking(args) -> Dict[str, List[float]]:
+    db = DBManager()
+
+    async def call(method: str, *call_args):
+        return getattr(db, method)(*call_args)
+
+    return await run_load(call, args.users, args.seconds, args.rps)
+
+
+async def bench_async(args) -> Dict[str, List[float]]:
+    db = AsyncDBManager()
+
+    async def call(method: str, *call_args):
+        return await getattr(db, method)(*call_args)
+
+    try:
+        return await run_load(call, args.users, args.seconds, args.rps)
+    finally:
+        db.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--activities', type=int, default=4000, help='activities per user')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rps', type=float, default=30, help='handler arrivals per second')
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    populate(DB_NAME, args.users, args.activities)
+
+    for title, bench in (('blocking DBManager', bench_blocking), ('AsyncDBManager', bench_async)):
+        latencies = asyncio.run(bench(args))
+        print_table(title, {kind: summarize(values) for kind, values in latencies.items()})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Bot API calls per interval: a message per prompt and per answer vs. the edit-in-place mode.
+
+Every user gets `--ticks` prompts and answers each of them before the next
+one. By default a prompt and the "filled" reply are new messages; with
+`EDIT_IN_PLACE_PROMPTS` the prompt message of the session is edited and the
+answer is acknowledged by the callback answer text.
+
+    python -m benchmarks.edit_in_place [--users 50] [--ticks 20]
+"""
+import argparse
+import asyncio
+import itertools
+from typing import Counter, Dict, List
+
+from .common import running_bot, setup_env, setup_fake_bot_api_env
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from aiogram import types  # noqa: E402
+
+import settings  # noqa: E402
+from timesheetbot import callback_data, server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+from .fill_all import (  # noqa: E402
+    INTERVAL_SECONDS, drain_outbox, list_unfilled_activity_ids, make_tap, open_sessions,
+)
+
+METHODS = ('sendMessage', 'editMessageText', 'answerCallbackQuery')
+
+
+async def answer_prompt(user_id: int, session_id: int):
+    category_id, _ = server.users.get(user_id).categories[0]
+    activity_id, = await server.db.run(list_unfilled_activity_ids, session_id)
+    await server.feed_update(make_tap(user_id, callback_data.encode(
+        callback_data.FILL_ACTIVITY, activity_id, category_id)))
+
+
+async def bench(fake_api: FakeBotAPI, user_ids: List[int], ticks: int) -> Counter:
+    sessions = await open_sessions(user_ids)
+    await drain_outbox()
+    fake_api.reset_stats()
+    for _ in range(ticks):
+        await asyncio.gather(*(server.send_choose_categories(types.User(id=user_id), session_id, INTERVAL_SECONDS)
+                               for user_id, session_id in sessions.items()))
+        await drain_outbox()
+        await asyncio.gather(*(answer_prompt(user_id, session_id) for user_id, session_id in sessions.items()))
+        await drain_outbox()
+    return fake_api.calls.copy()
+
+
+async def run(users_num: int, ticks: int) -> Dict[str, Counter]:
+    user_ids = itertools.count(1)
+    edit_in_place_prompts = settings.EDIT_IN_PLACE_PROMPTS
+    results = {}
+    async with running_bot(FAKE_API_PORT, limits=False) as fake_api:
+        try:
+            for mode, edit_in_place in (('messages', False), ('edit in place', True)):
+                settings.EDIT_IN_PLACE_PROMPTS = edit_in_place
+                results[mode] = await bench(fake_api, list(itertools.islice(user_ids, users_num)), ticks)
+            return results
+        finally:
+            settings.EDIT_IN_PLACE_PROMPTS = edit_in_place_prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=20)
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    results = asyncio.run(run(args.users, args.ticks))
+    intervals = args.users * args.ticks
+    print(f'{"per interval":<16}' + ''.join(f'{method:>22}' for method in METHODS) + f'{"total":>8}')
+    for mode, calls in results.items():
+        print(f'{mode:<16}' + ''.join(f'{calls[method] / intervals:>22.2f}' for method in METHODS)
+              + f'{sum(calls[method] for method in METHODS) / intervals:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Timesheet export: throughput and peak memory by the history size, and the `/export` command.
+
+The export streams the rows from the cursor through the generator pipeline
+of `timesheetbot.export`. The previous way to pull a raw timesheet was a
+`fetchall` of the rows and the file built in memory; it is replayed as the
+baseline. The peak is the
+memory allocated by Python during the export (`tracemalloc`), measured in a
+separate run as tracing slows the export down.
+
+The bot part sends `/export` of one user through the fake Bot API and
+reports the command latency and the documents sent; `--max-bytes` lowers
+the file size limit to show the split into several documents.
+
+    python -m benchmarks.export [--activities 10000,100000,400000] [--user-activities 35000] [--max-bytes 1000000]
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from .common import running_bot, setup_env, setup_fake_bot_api_env
+
+TMP_DIR = setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from settings import constants  # noqa: E402
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot import export, queries, server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+from .fill_all import drain_outbox  # noqa: E402
+from .fixtures import populate  # noqa: E402
+from .webhook import make_update  # noqa: E402
+
+USERS = 10
+USER_ID = 1
+
+
+def previous_export(db: DBManager, path: Path, compress: bool) -> List[Path]:
+    """Fetch all the rows and build the file in memory."""
+    rows = db.connection.execute(queries.EXPORT_TIMESHEET).fetchall()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export.COLUMNS)
+    writer.writerows(export.iter_records(rows))
+    data = buffer.getvalue().encode()
+    path = path.with_suffix('.csv.gz' if compress else '.csv')
+    path.write_bytes(gzip.compress(data) if compress else data)
+    return [path]
+
+
+def measure(run: Callable[[], List[Path]]) -> Tuple[float, int, int]:
+    """Return (seconds, peak KiB allocated, bytes written)."""
+    started_at = time.perf_counter()
+    paths = run()
+    seconds = time.perf_counter() - started_at
+    size = sum(path.stat().st_size for path in paths)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak // 1024, size
+
+
+def bench_pipeline(activities: List[int]) -> None:
+    print(f'{"activities":>10} {"variant":<20}{"rows/s":>12}{"peak, KiB":>12}{"size, KiB":>12}')
+    for total in activities:
+        db_name = str(TMP_DIR / f'export-{total}.db')
+        db = DBManager(db_name)
+        db.migrate()
+        populate(db_name, USERS, total // USERS)
+        out_dir = TMP_DIR / f'export-{total}'
+        out_dir.mkdir()
+        variants: Dict[str, Callable[[], List[Path]]] = {
+            'previous csv': lambda: previous_export(db, out_dir / 'previous', False),
+            'previous csv.gz': lambda: previous_export(db, out_dir / 'previous', True),
+            'csv': lambda: db.export_timesheet(out_dir / 'current'),
+            'csv.gz': lambda: db.export_timesheet(out_dir / 'current', compress=True),
+            'jsonl.gz': lambda: db.export_timesheet(out_dir / 'current', fmt='jsonl', compress=True),
+        }
+        for name, run in variants.items():
+            seconds, peak_kib, size = measure(run)
+            print(f'{total:>10} {name:<20}{total / seconds:>12.0f}{peak_kib:>12}{size // 1024:>12}')
+
+
+async def bench_command(fake_api: FakeBotAPI, text: str) -> Tuple[float, int]:
+    """Return (seconds till the documents are sent, documents)."""
+    fake_api.reset_stats()
+    started_at = time.perf_counter()
+    await server.feed_update(make_update(1, USER_ID, text))
+    await drain_outbox()
+    return time.perf_counter() - started_at, fake_api.calls['sendDocument']
+
+
+async def run_bot(max_bytes: int) -> Dict[str, Tuple[float, int]]:
+    results = {}
+    async with running_bot(FAKE_API_PORT, limits=False) as fake_api:
+        for text in ('/export', '/export csv gz', '/export jsonl gz'):
+            results[text] = await bench_command(fake_api, text)
+        # the limit is read by the command handler on every call
+        constants.EXPORT_MAX_FILE_BYTES, default_max_bytes = max_bytes, constants.EXPORT_MAX_FILE_BYTES
+        try:
+            results[f'/export, files of {max_bytes} bytes'] = await bench_command(fake_api, '/export')
+        finally:
+            constants.EXPORT_MAX_FILE_BYTES = default_max_bytes
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--activities', default='10000,100000,400000', help='history sizes, comma separated')
+    parser.add_argument('--user-activities', type=int, default=35000, help='history of the /export user')
+    parser.add_argument('--max-bytes', type=int, default=1000 * 1000)
+    args = parser.parse_args()
+
+    bench_pipeline([int(total) for total in args.activities.split(',')])
+
+    DBManager().migrate()
+    populate(DB_NAME, 1, args.user_activities)
+    print(f'\n{"command, " + str(args.user_activities) + " activities":<40}{"ms":>10}{"documents":>12}')
+    for text, (seconds, documents) in asyncio.run(run_bot(args.max_bytes)).items():
+        print(f'{text:<40}{seconds * 1000:>10.1f}{documents:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Local fake of the Telegram Bot API for the benchmarks.
+
+aiogram's `Bot` is pointed at it with `server=fake_api.server`. The fake
+enforces Telegram-like flood limits with token buckets (429 with
+`retry_after` on excess), serves long-polling `getUpdates` from an update
+queue and records what was called. Synthetic users can wait for the inline
+keyboards sent to them and tap their buttons, see `wait_keyboard`.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from settings import constants
+from timesheetbot.outbox import TokenBucket
+
+BOT_USER = {'id': 123456789, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+# methods which post messages to chats and are subject to the flood limits
+LIMITED_METHODS = frozenset(('sendMessage', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'))
+# documents of up to the Telegram limit with the multipart overhead
+MAX_REQUEST_BYTES = constants.EXPORT_MAX_FILE_BYTES + 1024 * 1024
+
+
+class FakeBotAPI:
+
+    def __init__(self, rate: float = 30, burst: float = 2, chat_rate: float = 1, chat_burst: float = 4,
+                 latency: float = 0.0):
+        # bursts are a bit bigger than the outbox ones to tolerate network jitter
+        self._rate = rate
+        self._burst = burst
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._latency = latency
+        self._global_bucket = TokenBucket(rate, burst, time.monotonic())
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates: 'asyncio.Queue[Dict[str, Any]]' = asyncio.Queue()
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ''
+        self.calls: Counter = Counter()
+        self.rejected = 0
+        # (monotonic time, method, chat_id) of the accepted limited calls
+        self.accepted: List[tuple] = []
+        # (text to expect in the message or None for any, future) by chat
+        self._message_waiters: Dict[int, List[Tuple[Optional[str], asyncio.Future]]] = defaultdict(list)
+        self._keyboard_waiters: Dict[int, List[asyncio.Future]] = defaultdict(list)
+
+    @property
+    def server(self) -> TelegramAPIServer:
+        return TelegramAPIServer.from_base(self.base_url)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa: WPS437
+        self.base_url = f'http://{host}:{port}'
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def put_update(self, update: Dict[str, Any]) -> int:
+        """Queue an update for `getUpdates`, return its update_id."""
+        update_id = next(self._update_ids)
+        self._updates.put_nowait(dict(update, update_id=update_id))
+        return update_id
+
+    def wait_message(self, chat_id: int, text: Optional[str] = None) -> asyncio.Future:
+        """Future of the monotonic time when the next message to the chat, containing `text` if given, is accepted."""
+        future = asyncio.get_running_loop().create_future()
+        self._message_waiters[chat_id].append((text, future))
+        return future
+
+    def wait_keyboard(self, chat_id: int) -> asyncio.Future:
+        """Future of the callback data of the buttons of the next inline keyboard sent to the chat."""
+        future = asyncio.get_running_loop().create_future()
+        self._keyboard_waiters[chat_id].append(future)
+        return future
+
+    def reset_stats(self) -> None:
+        self.calls.clear()
+        self.rejected = 0
+        self.accepted.clear()
+
+    def _is_flooding(self, chat_id: int, now: float) -> Optional[float]:
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, now)
+        delay = max(self._global_bucket.delay(now), chat_bucket.delay(now))
+        if delay:
+            return delay
+        self._global_bucket.consume(now)
+        chat_bucket.consume(now)
+        return None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+        if method in LIMITED_METHODS:
+            now = time.monotonic()
+            chat_id = int(data.get('chat_id', 0))
+            retry_after = self._is_flooding(chat_id, now)
+            if retry_after is not None:
+                self.rejected += 1
+                return web.json_response({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {max(1, round(retry_after))}',
+                    'parameters': {'retry_after': max(1, round(retry_after))},
+                }, status=429)
+            self.accepted.append((now, method, chat_id))
+            self._notify_message_waiters(chat_id, data.get('text', ''), now)
+
+        result = await self._get_result(method, data)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_result(self, method: str, data: Dict[str, Any]) -> Any:
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(float(data.get('timeout', 0)), int(data.get('offset', 0)))
+        if method in LIMITED_METHODS:
+            return self._make_message(data)
+        return True
+
+    async def _get_updates(self, timeout: float, offset: int) -> List[Dict[str, Any]]:
+        updates = []
+        if self._updates.empty() and timeout:
+            try:
+                updates.append(await asyncio.wait_for(self._updates.get(), timeout))
+            except asyncio.TimeoutError:
+                return updates
+        while not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return [update for update in updates if update['update_id'] >= offset]
+
+    def _make_message(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(data.get('chat_id', 0))
+        message = {
+            'message_id': int(data.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'user{chat_id}'},
+            'from': BOT_USER,
+            'text': data.get('text', ''),
+        }
+        if data.get('reply_markup'):
+            message['reply_markup'] = json.loads(data['reply_markup'])
+            self._notify_keyboard_waiters(chat_id, message['reply_markup'])
+        return message
+
+    def _notify_message_waiters(self, chat_id: int, text: str, now: float) -> None:
+        waiters = self._message_waiters.pop(chat_id, ())
+        for expected, future in waiters:
+            if expected is not None and expected not in text:
+                self._message_waiters[chat_id].append((expected, future))
+            elif not future.done():
+                future.set_result(now)
+
+    def _notify_keyboard_waiters(self, chat_id: int, reply_markup: Dict[str, Any]) -> None:
+        if 'inline_keyboard' not in reply_markup or chat_id not in self._keyboard_waiters:
+            return
+        buttons = [button['callback_data'] for row in reply_markup['inline_keyboard'] for button in row]
+        for future in self._keyboard_waiters.pop(chat_id):
+            if not future.done():
+                future.set_result(buttons)
@@ -0,0 +1,139 @@
+"""Outbound calls and DB writes for the users coming back after missing prompts.
+
+Every user misses `--missed` prompts in a row and then fills all of them with
+one category. Previously every prompt was sent and filled by its own tap: an
+UPDATE with a daily stats upsert and a reply per activity. Currently the
+prompts stop after `FILL_ALL_AFTER_UNANSWERED` unanswered ones, the user gets
+one offer to fill all of them, and one tap fills them with one UPDATE.
+
+    python -m benchmarks.fill_all [--users 50] [--missed 20]
+"""
+import argparse
+import asyncio
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .common import NO_LIMIT, running_bot, setup_env, setup_fake_bot_api_env
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from aiogram import types  # noqa: E402
+
+from settings import constants  # noqa: E402
+from timesheetbot import callback_data, server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+
+INTERVAL_SECONDS = 60 * 15
+READ_STATEMENTS = ('SELECT', 'BEGIN', 'COMMIT')
+
+
+def make_tap(user_id: int, data: str) -> dict:
+    return {
+        'callback_query': {
+            'id': str(user_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'data': data,
+        },
+    }
+
+
+async def drain_outbox():
+    while server.outbox.depth:
+        await asyncio.sleep(0.01)
+
+
+async def open_sessions(user_ids: List[int]) -> Dict[int, int]:
+    sessions = {}
+    for user_id in user_ids:
+        u = types.User(id=user_id)
+        await server.get_user(u)
+        sessions[user_id], _ = await server.db.get_new_or_existing_session_id(u)
+        server.user_sessions.open(user_id, sessions[user_id])
+    return sessions
+
+
+async def come_back(user_id: int, session_id: int, fill_all: bool):
+    category_id, _ = server.users.get(user_id).categories[0]
+    if fill_all:
+        await server.feed_update(make_tap(user_id, callback_data.encode(
+            callback_data.FILL_ALL_ACTIVITIES, session_id, category_id)))
+        return
+
+    activity_ids = await server.db.run(list_unfilled_activity_ids, session_id)
+    for activity_id in activity_ids:
+        await server.feed_update(make_tap(user_id, callback_data.encode(
+            callback_data.FILL_ACTIVITY, activity_id, category_id)))
+
+
+def count_writes(statements: List[str]) -> int:
+    return sum(not statement.lstrip().upper().startswith(READ_STATEMENTS) for statement in statements)
+
+
+async def bench(fake_api: FakeBotAPI, user_ids: List[int], missed: int, fill_all: bool) -> Tuple[int, ...]:
+    """Return the numbers of the messages, the callback answers and the DB writes of the prompts and the taps."""
+    sessions = await open_sessions(user_ids)
+    await drain_outbox()
+    fake_api.reset_stats()
+    statements = []
+    await server.db.run(trace_statements, statements.append)
+
+    for _ in range(missed):
+        await asyncio.gather(*(server.send_choose_categories(types.User(id=user_id), session_id, INTERVAL_SECONDS)
+                               for user_id, session_id in sessions.items()))
+    prompt_writes = count_writes(statements)
+    statements.clear()
+    await asyncio.gather(*(come_back(user_id, session_id, fill_all) for user_id, session_id in sessions.items()))
+    await drain_outbox()
+    await server.db.flush()
+
+    await server.db.run(trace_statements, None)
+    return (fake_api.calls['sendMessage'], fake_api.calls['answerCallbackQuery'],
+            prompt_writes, count_writes(statements))
+
+
+def trace_statements(db: DBManager, callback: Optional[Callable[[str], None]]) -> None:
+    db.connection.set_trace_callback(callback)
+
+
+def list_unfilled_activity_ids(db: DBManager, session_id: int) -> List[int]:
+    query = '''
+        select activity_id from timesheet
+        where session_id = ? and default_category_id is null and user_category_id is null
+    '''
+    return [activity_id for activity_id, in db.connection.execute(query, (session_id,))]
+
+
+async def run(users_num: int, missed: int) -> Dict[str, Tuple[int, ...]]:
+    user_ids = itertools.count(1)
+    fill_all_after_unanswered = constants.FILL_ALL_AFTER_UNANSWERED
+    async with running_bot(FAKE_API_PORT, limits=False) as fake_api:
+        try:
+            constants.FILL_ALL_AFTER_UNANSWERED = NO_LIMIT
+            previous = await bench(fake_api, list(itertools.islice(user_ids, users_num)), missed, fill_all=False)
+            constants.FILL_ALL_AFTER_UNANSWERED = fill_all_after_unanswered
+            current = await bench(fake_api, list(itertools.islice(user_ids, users_num)), missed, fill_all=True)
+            return {'previous': previous, 'current': current}
+        finally:
+            constants.FILL_ALL_AFTER_UNANSWERED = fill_all_after_unanswered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--missed', type=int, default=20, help='prompts missed by every user')
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    results = asyncio.run(run(args.users, args.missed))
+    print(f'{"per user":<12}{"messages":>10}{"answers":>10}{"prompt writes":>15}{"tap writes":>12}')
+    for path, counts in results.items():
+        messages, answers, prompt_writes, tap_writes = (count / args.users for count in counts)
+        print(f'{path:<12}{messages:>10.1f}{answers:>10.1f}{prompt_writes:>15.1f}{tap_writes:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
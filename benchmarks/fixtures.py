@@ -0,0 +1,75 @@
+"""Synthetic timesheet histories for the benchmarks."""
+import sqlite3
+import time
+from datetime import datetime
+from typing import Iterator, Tuple
+from uuid import uuid4 as uuid
+
+from settings import constants
+
+INTERVAL_SECONDS = 60 * 15
+
+
+def iter_activities(users: int, activities_per_user: int, sessions_per_user: int
+                    ) -> Iterator[Tuple[int, int, bool, int, int, int]]:
+    """Yield (user_id, session_num, is_session_last, category_num, start, finish) of consecutive activities."""
+    now = int(time.time())
+    activities_per_session = max(1, activities_per_user // sessions_per_user)
+    for user_id in range(1, users + 1):
+        start = now - INTERVAL_SECONDS * activities_per_session * sessions_per_user
+        for session_num in range(sessions_per_user):
+            is_last = session_num == sessions_per_user - 1
+            for activity_num in range(activities_per_session):
+                category_num = (user_id + activity_num) % len(constants.DEFAULT_CATEGORIES)
+                yield user_id, session_num, is_last, category_num, start, start + INTERVAL_SECONDS
+                start += INTERVAL_SECONDS
+
+
+def populate(db_name: str, users: int, activities_per_user: int, sessions_per_user: int = 10,
+             legacy: bool = False) -> None:
+    """Fill a migrated database with users, categories, sessions and filled activities.
+
+    `legacy` rows are stored in the format preceding the 004 migration: to `timesheet_legacy`,
+    with string datetimes and UUID keys.
+    """
+    def as_stored(timestamp: int):
+        return str(datetime.fromtimestamp(timestamp)) if legacy else timestamp
+
+    con = sqlite3.connect(db_name)
+    activities_per_session = max(1, activities_per_user // sessions_per_user)
+    session_ids = {}
+    session_stops = []
+    category_ids = {}
+    rows = []
+
+    for user_id, session_num, is_last, category_num, start, finish in iter_activities(
+            users, activities_per_user, sessions_per_user):
+        if user_id not in category_ids:
+            con.execute('insert into user values (?, ?, ?, ?, ?)',
+                        (user_id, INTERVAL_SECONDS, f'user{user_id}', None, str(datetime.fromtimestamp(start))))
+            con.executemany('insert into category (user_telegram_id, name) values (?, ?)',
+                            ((user_id, name) for name in constants.DEFAULT_CATEGORIES))
+            category_ids[user_id] = [row[0] for row in con.execute(
+                'select id from category where user_telegram_id = ? order by id', (user_id,))]
+
+        session_key = user_id, session_num
+        if session_key not in session_ids:
+            cursor = con.execute('insert into session (user_telegram_id, start_at) values (?, ?)',
+                                 (user_id, as_stored(start)))
+            session_ids[session_key] = cursor.lastrowid
+            if not is_last:
+                session_stops.append((as_stored(start + INTERVAL_SECONDS * activities_per_session),
+                                      session_ids[session_key]))
+
+        category_id = category_ids[user_id][category_num]
+        rows.append((session_ids[session_key], category_id, as_stored(start), as_stored(finish)))
+
+    con.executemany('update session set stop_at = ? where id = ?', session_stops)
+    if legacy:
+        con.executemany('insert into timesheet_legacy values (?, ?, null, ?, ?, ?)',
+                        ((str(uuid()), *row) for row in rows))
+    else:
+        con.executemany('insert into timesheet (session_id, default_category_id, start, finish)'
+                        ' values (?, ?, ?, ?)', rows)
+    con.commit()
+    con.close()
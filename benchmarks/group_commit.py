@@ -0,0 +1,91 @@
+"""Write throughput of the activity writes by journal mode, `synchronous` and group commit.
+
+Concurrent users do what a prompt and a button tap do: start an activity and
+stop it with a category, each a separate write, in a closed loop.
+
+    python -m benchmarks.group_commit [--users 100] [--seconds 3] [--dir /path/on/the/server/disk]
+
+The temporary directory may be in memory (tmpfs), where fsync is free: use
+--dir to measure on a real disk.
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from .common import print_table, setup_env, summarize
+
+TMP_DIR = setup_env()
+
+from aiogram import types  # noqa: E402
+
+from timesheetbot.db_manager import AsyncDBManager, DBManager  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+# name: (journal_mode, synchronous, commit window in seconds)
+CONFIGS = {
+    'DELETE, FULL, per write': ('DELETE', 'FULL', 0),
+    'WAL, FULL, per write': ('WAL', 'FULL', 0),
+    'WAL, NORMAL, per write': ('WAL', 'NORMAL', 0),
+    'WAL, FULL, group 50 ms': ('WAL', 'FULL', 0.05),
+    'WAL, NORMAL, group 50 ms': ('WAL', 'NORMAL', 0.05),
+}
+
+
+async def run_load(db: AsyncDBManager, db_name: str, users: int, seconds: float) -> List[float]:
+    latencies = []
+    con = sqlite3.connect(db_name)
+    category_ids = {user_id: category_id for category_id, user_id in con.execute(
+        'select min(id), user_telegram_id from category group by user_telegram_id')}
+    session_ids = dict(con.execute('select user_telegram_id, id from session where stop_at is null'))
+    con.close()
+    deadline = time.monotonic() + seconds
+
+    async def user_loop(user_id: int):
+        while time.monotonic() < deadline:
+            started_at = time.monotonic()
+            activity_id, _, _ = await db.start_activity(session_ids[user_id], 60)
+            await db.stop_activity(types.User(id=user_id), activity_id, category_ids[user_id])
+            latencies.append(time.monotonic() - started_at)
+
+    await asyncio.gather(*map(user_loop, session_ids))
+    return latencies
+
+
+async def bench(name: str, users: int, seconds: float, db_dir: Path) -> List[float]:
+    db_path = db_dir / f'{name.replace(", ", "-").replace(" ", "")}.db'
+    db_name = str(db_path)
+    journal_mode, synchronous, commit_window = CONFIGS[name]
+    DBManager(db_name, journal_mode=journal_mode).migrate()
+    populate(db_name, users, activities_per_user=1, sessions_per_user=1)
+
+    db = AsyncDBManager(db_name, commit_window, journal_mode=journal_mode, synchronous=synchronous)
+    try:
+        return await run_load(db, db_name, users, seconds)
+    finally:
+        db.shutdown()
+        for path in db_dir.glob(f'{db_path.name}*'):  # with the -wal and -shm files
+            path.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--dir', type=Path, default=TMP_DIR, help='directory for the database files')
+    args = parser.parse_args()
+
+    latencies: Dict[str, List[float]] = {}
+    print(f'{"":<28}{"writes/s":>12}')
+    for name in CONFIGS:
+        latencies[name] = asyncio.run(bench(name, args.users, args.seconds, args.dir))
+        print(f'{name:<28}{2 * len(latencies[name]) / args.seconds:>12.0f}')
+
+    print_table('start + stop activity latency', {name: summarize(values) for name, values in latencies.items()})
+
+
+if __name__ == '__main__':
+    main()
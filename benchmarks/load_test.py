@@ -0,0 +1,225 @@
+"""End-to-end load test: synthetic users driven through the bot with the fake Bot API.
+
+Every synthetic user starts a session and taps an interval button, answers
+`--ticks` prompts by tapping a category button of the prompt, asks for the
+stats with the navigation button and a period button, and stops the session.
+The prompts are dispatched by `send_due_prompts` in batches of
+`SCHEDULER_BATCH_SIZE`, as the scheduler does when they are due. The users
+only tap the buttons of the keyboards the fake Bot API received, so the
+whole path from the update to the Bot API call is exercised.
+
+The latency of a step is the time of handling its update; for `start` it is
+the time till the interval keyboard reaches the Bot API, as the handler
+itself waits for the interval. The peak RSS includes the fake Bot API, which
+runs in the same process.
+
+The results are written as JSON named by the commit; compare with a
+previous run by `--baseline`:
+
+    python -m benchmarks.load_test [--users 2000] [--ticks 5] [--output-dir benchmarks/results]
+    python -m benchmarks.load_test --baseline benchmarks/results/<previous run>.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .common import PROJECT_DIR, running_bot, setup_env, setup_fake_bot_api_env, summarize
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+import settings  # noqa: E402
+from settings import constants  # noqa: E402
+from timesheetbot import server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+from timesheetbot.scheduler import ScheduledSession  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+from .fill_all import drain_outbox, make_tap  # noqa: E402
+from .webhook import make_update  # noqa: E402
+
+STEPS = ('start', 'interval tap', 'prompt batch', 'category tap', 'stats menu', 'stats tap', 'stop')
+STATS_BUTTON = 'Статистика >>'
+
+
+class SyntheticUser:
+    """A user tapping the buttons of the keyboards the bot sends to them."""
+
+    def __init__(self, user_id: int, fake_api: FakeBotAPI, latencies: Dict[str, List[float]]):
+        self.user_id = user_id
+        self._fake_api = fake_api
+        self._latencies = latencies
+        self._message_ids = itertools.count(1)
+        self.updates = 0
+
+    def expect_keyboard(self) -> asyncio.Future:
+        return self._fake_api.wait_keyboard(self.user_id)
+
+    async def send(self, step: str, update: dict) -> None:
+        started_at = time.perf_counter()
+        await server.feed_update(update)
+        self._latencies[step].append(time.perf_counter() - started_at)
+        self.updates += 1
+
+    async def send_text(self, step: str, text: str) -> None:
+        await self.send(step, make_update(next(self._message_ids), self.user_id, text))
+
+    async def tap(self, step: str, keyboard: List[str], button_num: int = 0) -> None:
+        await self.send(step, make_tap(self.user_id, keyboard[button_num % len(keyboard)]))
+
+    async def start_session(self) -> None:
+        interval_keyboard = self.expect_keyboard()
+        started_at = time.perf_counter()
+        start = asyncio.create_task(server.feed_update(make_update(next(self._message_ids), self.user_id, '/start')))
+        keyboard = await interval_keyboard
+        self._latencies['start'].append(time.perf_counter() - started_at)
+        self.updates += 1
+        await self.tap('interval tap', keyboard)
+        await start
+
+    async def answer_prompt(self, prompt_keyboard: asyncio.Future) -> None:
+        await self.tap('category tap', await prompt_keyboard, self.user_id)
+
+    async def request_stats(self) -> None:
+        stats_keyboard = self.expect_keyboard()
+        await self.send_text('stats menu', STATS_BUTTON)
+        await self.tap('stats tap', await stats_keyboard, self.user_id)
+
+    async def stop_session(self) -> None:
+        await self.send_text('stop', '/stop')
+
+
+async def dispatch_prompts(users: List[SyntheticUser], latencies: Dict[str, List[float]]) -> None:
+    """Send a prompt to every user the way the scheduler sends the due ones."""
+    now = time.time()
+    sessions = []
+    for user in users:
+        state = server.user_sessions.get(user.user_id)
+        interval_seconds = server.users.get(user.user_id).interval_seconds
+        # the prompt asks about the last interval
+        sessions.append(ScheduledSession(user.user_id, state.session_id, interval_seconds,
+                                         now + interval_seconds, now - interval_seconds))
+
+    for start in range(0, len(sessions), constants.SCHEDULER_BATCH_SIZE):
+        started_at = time.perf_counter()
+        await server.send_due_prompts(sessions[start:start + constants.SCHEDULER_BATCH_SIZE])
+        latencies['prompt batch'].append(time.perf_counter() - started_at)
+
+
+async def run_scenario(fake_api: FakeBotAPI, users_num: int, ticks: int, concurrency: int) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    users = [SyntheticUser(user_id, fake_api, latencies) for user_id in range(1, users_num + 1)]
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(coro):
+        async with slots:
+            await coro
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(limited(user.start_session()) for user in users))
+    for _ in range(ticks):
+        prompts = [user.expect_keyboard() for user in users]
+        await dispatch_prompts(users, latencies)
+        await asyncio.gather(*(limited(user.answer_prompt(prompt)) for user, prompt in zip(users, prompts)))
+    await asyncio.gather(*(limited(user.request_stats()) for user in users))
+    await asyncio.gather(*(limited(user.stop_session()) for user in users))
+    await drain_outbox()
+    await server.db.flush()
+    elapsed = time.perf_counter() - started_at
+
+    updates = sum(user.updates for user in users)
+    return {
+        'seconds': elapsed,
+        'updates': updates,
+        'updates_per_second': updates / elapsed,
+        'prompts': users_num * ticks,
+        'bot_api_calls': sum(fake_api.calls.values()),
+        'latency': {step: summarize(latencies[step]) for step in STEPS if latencies[step]},
+    }
+
+
+async def run(users_num: int, ticks: int, concurrency: int) -> Dict[str, Any]:
+    async with running_bot(FAKE_API_PORT, limits=False) as fake_api:
+        return await run_scenario(fake_api, users_num, ticks, concurrency)
+
+
+def get_db_size() -> int:
+    db_path = Path(settings.config.DB_NAME)
+    return sum(path.stat().st_size for path in (db_path, db_path.with_name(db_path.name + '-wal')) if path.exists())
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f'{results["updates"]} updates of {results["params"]["users"]} users in {results["seconds"]:.1f} s:'
+          f' {results["updates_per_second"]:.0f} updates/s, {results["prompts"]} prompts')
+    print(f'\n{"":<16}{"count":>8}{"p50, ms":>10}{"p99, ms":>10}{"max, ms":>10}'
+          + (f'{"base p50":>10}{"base p99":>10}' if baseline else ''))
+    for step, summary in results['latency'].items():
+        line = (f'{step:<16}{summary["count"]:>8}{summary["p50_ms"]:>10.2f}{summary["p99_ms"]:>10.2f}'
+                f'{summary["max_ms"]:>10.2f}')
+        base = (baseline or {}).get('latency', {}).get(step)
+        if base:
+            line += f'{base["p50_ms"]:>10.2f}{base["p99_ms"]:>10.2f}'
+        print(line)
+
+    print()
+    for key, title in (('updates_per_second', 'updates/s'), ('db_bytes', 'db, bytes'), ('max_rss_kib', 'rss, KiB')):
+        line = f'{title:<16}{results[key]:>14.0f}'
+        if baseline:
+            line += f'   baseline {baseline[key]:.0f} ({(results[key] / baseline[key] - 1) * 100:+.1f}%)'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ticks', type=int, default=5, help='prompts answered by every user')
+    parser.add_argument('--concurrency', type=int, default=100, help='users acting at a time')
+    parser.add_argument('--output-dir', type=Path, help='write the results to a JSON file in this directory')
+    parser.add_argument('--baseline', type=Path, help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    results = {
+        'commit': get_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {'users': args.users, 'ticks': args.ticks, 'concurrency': args.concurrency},
+    }
+    results.update(asyncio.run(run(args.users, args.ticks, args.concurrency)))
+    results['db_bytes'] = get_db_size()
+    # kilobytes on Linux, bytes on macOS
+    results['max_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        results['max_rss_kib'] //= 1024
+
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8')) if args.baseline else None
+    if baseline and baseline['params'] != results['params']:
+        print(f'WARNING: the baseline was run with other parameters: {baseline["params"]}\n')
+    print_results(results, baseline)
+
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        path = args.output_dir / f'load_test-{datetime.now():%Y%m%d-%H%M%S}-{results["commit"] or "unknown"}.json'
+        path.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f'\nResults: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Latency of a log-heavy handler: a synchronous stream handler vs. the queue-backed one.
+
+A handler logs `--records` JSON records per update. Previously every record
+was formatted (with `strftime` per record) and written to the stream on the
+event loop; currently the record is only queued, and the listener thread
+formats and writes the records in batches. The slow stream case emulates a
+stdout piped to a slow consumer. The last table shows the records dropped by
+a small queue under a burst to the slow stream.
+
+    python -m benchmarks.logging_pipeline [--updates 2000] [--records 20]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, TextIO
+
+from .common import print_table, setup_env, summarize
+
+TMP_DIR = setup_env()
+
+from settings.log_formatter import JSONFormatter  # noqa: E402
+from settings.log_handlers import AsyncStreamHandler  # noqa: E402
+
+SLOW_WRITE_SECONDS = 0.0002
+
+
+class PreviousJSONFormatter(JSONFormatter):
+
+    def formatTime(self, record, *args) -> str:  # noqa: N802
+        ct = self.converter(record.created)  # type: ignore
+        formatted_ms = self.msec_format % record.msecs
+        time_format_with_msec = self.default_time_format.format(ms=formatted_ms)
+        return time.strftime(time_format_with_msec, ct)
+
+
+class SlowStream:
+    """File stream with every write taking at least `SLOW_WRITE_SECONDS`."""
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        time.sleep(SLOW_WRITE_SECONDS)
+        return self._stream.write(text)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
+def make_logger(name: str, handler: logging.Handler, formatter: logging.Formatter) -> logging.Logger:
+    handler.setFormatter(formatter)
+    logger = logging.getLogger(f'benchmark.{name}')
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+async def handle_update(log: logging.Logger, update_id: int, records: int):
+    for num in range(records):
+        log.info(f'Update {update_id}: step {num}, user {update_id % 1000}')
+    await asyncio.sleep(0)
+
+
+async def measure(log: logging.Logger, updates: int, records: int) -> List[float]:
+    latencies = []
+    for update_id in range(updates):
+        started_at = time.perf_counter()
+        await handle_update(log, update_id, records)
+        latencies.append(time.perf_counter() - started_at)
+    return latencies
+
+
+def bench_latency(updates: int, records: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for stream_name in ('file', 'slow stream'):
+        for mode in ('previous', 'current'):
+            stream = (TMP_DIR / f'{mode}-{stream_name}.log').open('w', encoding='utf-8')
+            target = SlowStream(stream) if stream_name == 'slow stream' else stream
+            if mode == 'previous':
+                log = make_logger(mode, logging.StreamHandler(target), PreviousJSONFormatter())
+            else:
+                log = make_logger(mode, AsyncStreamHandler(target), JSONFormatter())
+            results[f'{mode}, {stream_name}'] = summarize(asyncio.run(measure(log, updates, records)))
+            for handler in log.handlers:
+                handler.close()
+            stream.close()
+    return results
+
+
+def bench_drops(burst: int, maxsize: int) -> Dict[str, int]:
+    path = TMP_DIR / 'drops.log'
+    with path.open('w', encoding='utf-8') as stream:
+        handler = AsyncStreamHandler(SlowStream(stream), maxsize=maxsize)
+        log = make_logger('drops', handler, JSONFormatter())
+        for num in range(burst):
+            log.info(f'Record {num}')
+        handler.close()
+    return {'logged': burst, 'dropped': handler.dropped, 'written': len(Path(path).read_text().splitlines())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--records', type=int, default=20, help='records per update')
+    parser.add_argument('--burst', type=int, default=20000)
+    parser.add_argument('--maxsize', type=int, default=1000, help='queue size of the drops case')
+    args = parser.parse_args()
+
+    print_table(f'handler latency, {args.records} records per update', bench_latency(args.updates, args.records))
+    drops = bench_drops(args.burst, args.maxsize)
+    print(f'\nburst of {drops["logged"]} records to the slow stream, queue of {args.maxsize}:'
+          f' dropped {drops["dropped"]}, written {drops["written"]} (with the drop reports)')
+
+
+if __name__ == '__main__':
+    main()
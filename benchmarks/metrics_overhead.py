@@ -0,0 +1,96 @@
+"""Cost of the metrics: an observation and the handler timing of an update.
+
+Updates are processed with and without the metrics middleware: `/help`
+(the cheapest handler, only queues the reply) and a tap of the stats button
+(routed by `route_callback_query`, answered from the stats cache). The
+database methods are timed with the same `Histogram.observe`.
+
+    python -m benchmarks.metrics_overhead [--updates 20000]
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict
+
+from .common import running_bot, setup_env, setup_fake_bot_api_env
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from aiogram import types  # noqa: E402
+
+from settings import constants  # noqa: E402
+from timesheetbot import callback_data, metrics, server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+from timesheetbot.middlewares import MetricsMiddleware  # noqa: E402
+
+from .fill_all import drain_outbox, make_tap  # noqa: E402
+
+USER_ID = 1
+
+
+def bench_observe(number: int) -> float:
+    """Return nanoseconds per observation."""
+    histogram = metrics.Histogram(constants.METRICS_LATENCY_BUCKETS)
+    started_at = time.perf_counter()
+    for num in range(number):
+        histogram.observe(num % 1000 / 10000)
+    return (time.perf_counter() - started_at) / number * 1e9
+
+
+def make_message(text: str) -> dict:
+    return {'message': {
+        'message_id': 1, 'date': 1700000000, 'text': text,
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'user'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+    }}
+
+
+async def process(update: dict, number: int) -> float:
+    """Return microseconds per update."""
+    started_at = time.perf_counter()
+    for _ in range(number):
+        await server.feed_update(update)
+    elapsed = time.perf_counter() - started_at
+    await drain_outbox()
+    return elapsed / number * 1e6
+
+
+async def run(updates: int) -> Dict[str, Dict[str, float]]:
+    cases = {
+        '/help': make_message('/help'),
+        'stats tap': make_tap(USER_ID, callback_data.encode(callback_data.GET_STATS, 0)),
+    }
+    results = {}
+    async with running_bot(FAKE_API_PORT, limits=False):
+        middleware = next(m for m in server.dp.middleware.applications if isinstance(m, MetricsMiddleware))
+        await server.get_user(types.User(id=USER_ID))
+        for name, update in cases.items():
+            await process(update, 10)  # warm up the caches
+            server.dp.middleware.applications.remove(middleware)
+            without = await process(update, updates)
+            server.dp.middleware.applications.append(middleware)
+            results[name] = {'without': without, 'with': await process(update, updates)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--observations', type=int, default=10 ** 6)
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    print(f'Histogram.observe: {bench_observe(args.observations):.0f} ns')
+    results = asyncio.run(run(args.updates))
+    print(f'\n{"us per update":<16}{"without":>10}{"with":>10}{"overhead":>10}')
+    for name, result in results.items():
+        print(f'{name:<16}{result["without"]:>10.1f}{result["with"]:>10.1f}'
+              f'{result["with"] - result["without"]:>10.1f}')
+    for name, summary in metrics.handler_seconds.snapshot().items():
+        print(f'{name}: {summary["count"]} updates, p50 {summary["p50"] * 1e6:.0f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Burst of periodic prompts: direct `bot.send_message` calls vs. the `Outbox`.
+
+Every chat gets a periodic prompt at the same tick (as when many sessions
+share an interval) and a part of the chats send an interactive reply right
+after. The fake Bot API answers flooding calls with 429. The direct mode
+retries after `retry_after` like a naive handler would.
+
+    python -m benchmarks.outbox [--chats 300] [--interactive-share 0.1]
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from .common import print_table, setup_env, summarize
+
+setup_env()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.utils.exceptions import RetryAfter  # noqa: E402
+
+from settings.config import TELEGRAM_API_TOKEN  # noqa: E402
+from timesheetbot.outbox import PRIORITY_PERIODIC, Outbox  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+async def send_direct(bot: Bot, chat_id: int, text: str) -> None:
+    while True:
+        try:
+            await bot.send_message(chat_id, text)
+            return
+        except RetryAfter as exc:
+            await asyncio.sleep(exc.timeout)
+
+
+async def run_burst(mode: str, args) -> Dict[str, object]:
+    fake_api = FakeBotAPI()
+    await fake_api.start()
+    bot = Bot(TELEGRAM_API_TOKEN, server=fake_api.server)
+    outbox = Outbox(bot)
+    outbox.start()
+    interactive_latencies: List[float] = []
+    prompt_latencies: List[float] = []
+
+    async def prompt(chat_id: int):
+        started_at = time.perf_counter()
+        if mode == 'direct':
+            await send_direct(bot, chat_id, 'Чем вы занимались?')
+        else:
+            await await_future(await outbox.send_message(chat_id, 'Чем вы занимались?', priority=PRIORITY_PERIODIC))
+        prompt_latencies.append(time.perf_counter() - started_at)
+
+    async def reply(chat_id: int):
+        await asyncio.sleep(args.reply_delay)
+        started_at = time.perf_counter()
+        if mode == 'direct':
+            await send_direct(bot, chat_id, 'Записал')
+        else:
+            await await_future(await outbox.send_message(chat_id, 'Записал'))
+        interactive_latencies.append(time.perf_counter() - started_at)
+
+    async def await_future(future):
+        if future is not None:
+            await future
+
+    interactive_every = max(1, round(1 / args.interactive_share))
+    chat_ids = range(1, args.chats + 1)
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(prompt(chat_id) for chat_id in chat_ids),
+                             *(reply(chat_id) for chat_id in chat_ids[::interactive_every]))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await outbox.stop()
+        await (await bot.get_session()).close()
+        await fake_api.stop()
+
+    sent = len(fake_api.accepted)
+    print_table(f'{mode}: latency', {
+        'periodic prompt': summarize(prompt_latencies),
+        'interactive reply': summarize(interactive_latencies),
+    })
+    return {'sent': sent, 'rejected (429)': fake_api.rejected, 'elapsed, s': elapsed, 'msgs/s': sent / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--interactive-share', type=float, default=0.1, help='share of chats replying')
+    parser.add_argument('--reply-delay', type=float, default=1, help='seconds from the prompts to the replies')
+    args = parser.parse_args()
+
+    results = {mode: asyncio.run(run_burst(mode, args)) for mode in ('direct', 'outbox')}
+    print(f'\n{"":<12}' + ''.join(f'{column:>16}' for column in results['direct']))
+    for mode, result in results.items():
+        print(f'{mode:<12}' + ''.join(f'{value:>16.2f}' if isinstance(value, float) else f'{value:>16}'
+                                      for value in result.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Cost of building a prompt payload, serialization of the reply markup included.
+
+The previous path built a button with `json.dumps`-ed callback data for every
+category, chunked them into rows and let aiogram serialize the markup; the
+current one splices the activity id into the keyboard serialized once per
+category set.
+
+    python -m benchmarks.prompt_payload [--number 20000]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+from aiogram.utils.payload import prepare_arg  # noqa: E402
+
+from settings import constants  # noqa: E402
+from timesheetbot.keyboards import NAVIGATION_KEYBOARD, _make_navigation_keyboard, split_buttons_on_rows  # noqa: E402
+from timesheetbot.server import get_choose_categories_msg_payload  # noqa: E402
+
+CATEGORIES = tuple(enumerate(constants.DEFAULT_CATEGORIES, start=101))
+
+
+def previous_payload(activity: tuple, categories: tuple) -> dict:
+    activity_id, start, finish = activity
+    start = datetime.fromtimestamp(start)
+    finish = datetime.fromtimestamp(finish)
+
+    category_btns = []
+    for category_id, name in categories:
+        data = json.dumps({'act_id': activity_id, 'cat_id': category_id}, separators=(',', ':'))
+        category_btns.append(types.InlineKeyboardButton(name, callback_data=data))
+
+    buttons = split_buttons_on_rows(category_btns)
+    return {
+        'msg': 'Что делал в этот период: {event_interval}'.format(
+            event_interval=f'{start.strftime("%H:%M:%S")} - {finish.strftime("%H:%M:%S")}',
+        ),
+        'payload': {'reply_markup': buttons},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    activity_ids = iter(range(10 ** 9))
+
+    def activity() -> tuple:
+        return next(activity_ids), 1700000000, 1700000900
+
+    cases = {
+        'prompt, previous': lambda: prepare_arg(previous_payload(activity(), CATEGORIES)['payload']['reply_markup']),
+        'prompt, current': lambda: prepare_arg(
+            get_choose_categories_msg_payload(activity(), CATEGORIES)['payload']['reply_markup']),
+        'navigation, previous': lambda: prepare_arg(_make_navigation_keyboard()),
+        'navigation, current': lambda: prepare_arg(NAVIGATION_KEYBOARD),
+    }
+    print(f'{"":<24}{"us per call":>12}')
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3))
+        print(f'{name:<24}{seconds / args.number * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
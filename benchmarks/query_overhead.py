@@ -0,0 +1,160 @@
+"""Per-call overhead of the hot queries: PyPika built per call vs. the precompiled registry.
+
+The previous methods built a PyPika query on every call, and some of them
+inlined the user id into the SQL, so sqlite compiled a new statement for
+every user. They are replayed here as they were. The current methods run
+the statements of `timesheetbot.queries` with bound parameters; they are
+measured with the statement cache sized by `queries.CACHED_STATEMENTS` and
+with the cache disabled, which shows the cost of compiling the statement.
+The calls go round the users, as the bot's do.
+
+    python -m benchmarks.query_overhead [--users 1000] [--activities 100] [--calls 20000]
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+from pypika import Order, Parameter, SQLLiteQuery, functions as fn  # noqa: E402
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot import queries  # noqa: E402
+from timesheetbot.db_manager import DBManager, DoesNotExist  # noqa: E402
+from timesheetbot.queries import CATEGORY, DAILY_STATS, SESSION, USER  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+Call = Callable[[types.User, int], object]
+
+
+def previous_calls(db: DBManager) -> Dict[str, Call]:
+    cursor = db._cursor
+
+    def get_user(u: types.User, _: int):
+        query = SQLLiteQuery.from_(USER).select('*').where(USER.telegram_id.eq(u.id))
+        return cursor.execute(query.get_sql()).fetchone()
+
+    def list_categories(u: types.User, _: int):
+        query = SQLLiteQuery.from_(CATEGORY).select(CATEGORY.id, CATEGORY.name) \
+            .where(CATEGORY.user_telegram_id.eq(u.id)) \
+            .orderby(CATEGORY.id)
+        return tuple(cursor.execute(query.get_sql()))
+
+    def has_active_session(u: types.User, _: int):
+        query = SQLLiteQuery.from_(SESSION).select(SESSION.id) \
+            .where(SESSION.user_telegram_id.eq(u.id)) \
+            .where(SESSION.stop_at.isnull())
+        return cursor.execute(query.get_sql()).fetchone() is not None
+
+    def get_last_started_session(u: types.User, _: int):
+        query = SQLLiteQuery().from_(SESSION).select('*') \
+            .where(SESSION.user_telegram_id.eq(Parameter(':user_id'))) \
+            .orderby(SESSION.start_at, order=Order.desc) \
+            .limit(1).get_sql()
+        return cursor.execute(query, {'user_id': u.id}).fetchone()
+
+    def get_daily_category_durations(u: types.User, day: int):
+        query = SQLLiteQuery().from_(DAILY_STATS) \
+            .inner_join(CATEGORY).on(DAILY_STATS.category_id.eq(CATEGORY.id)) \
+            .select(CATEGORY.name, fn.Sum(DAILY_STATS.seconds)) \
+            .where(DAILY_STATS.user_telegram_id.eq(Parameter(':user_id'))) \
+            .where(DAILY_STATS.day >= Parameter(':day')) \
+            .groupby(CATEGORY.id) \
+            .orderby(CATEGORY.name)
+        return cursor.execute(query.get_sql(), {'user_id': u.id, 'day': day}).fetchall()
+
+    return {
+        'get_user': get_user,
+        'list_categories': list_categories,
+        'has_active_session': has_active_session,
+        'get_last_started_session': get_last_started_session,
+        'get_daily_category_durations': get_daily_category_durations,
+    }
+
+
+def current_calls(db: DBManager) -> Dict[str, Call]:
+    def has_active_session(u: types.User, _: int):
+        try:
+            db._get_active_session(u)
+        except DoesNotExist:
+            return False
+        return True
+
+    return {
+        'get_user': lambda u, _: db.get_user(u),
+        'list_categories': lambda u, _: db.list_categories(u),
+        'has_active_session': has_active_session,
+        'get_last_started_session': lambda u, _: db.get_last_started_session(u),
+        'get_daily_category_durations': lambda u, day: db.get_daily_category_durations(
+            u, datetime.fromtimestamp(day)),
+    }
+
+
+def connect(cached_statements: int) -> DBManager:
+    db = DBManager()
+    db._cursor.close()
+    db._con.close()
+    db._con = sqlite3.Connection(DB_NAME, check_same_thread=False, cached_statements=cached_statements)
+    db._cursor = db._con.cursor()
+    return db
+
+
+def measure(call: Call, users: int, calls: int) -> float:
+    """Return microseconds per call."""
+    day = int((datetime.now() - timedelta(days=7)).timestamp())
+    user_objects = [types.User(id=user_id) for user_id in range(1, users + 1)]
+    started_at = time.perf_counter()
+    for num in range(calls):
+        call(user_objects[num % users], day)
+    return (time.perf_counter() - started_at) / calls * 1e6
+
+
+def bench_render(calls: int) -> float:
+    """Return microseconds of building and rendering a PyPika query."""
+    started_at = time.perf_counter()
+    for user_id in range(calls):
+        SQLLiteQuery.from_(CATEGORY).select(CATEGORY.id, CATEGORY.name) \
+            .where(CATEGORY.user_telegram_id.eq(user_id)) \
+            .orderby(CATEGORY.id).get_sql()
+    return (time.perf_counter() - started_at) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--activities', type=int, default=100, help='activities per user')
+    parser.add_argument('--calls', type=int, default=20000, help='calls per query')
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.migrate()
+    populate(DB_NAME, args.users, args.activities)
+
+    # the managers are kept referenced: the connection is closed with its manager
+    previous_db, cached_db = connect(queries.CACHED_STATEMENTS), connect(queries.CACHED_STATEMENTS)
+    uncached_db = connect(0)
+    variants = {
+        'previous': previous_calls(previous_db),
+        'current, no cache': current_calls(uncached_db),
+        'current': current_calls(cached_db),
+    }
+    for calls in variants.values():
+        for call in calls.values():
+            measure(call, args.users, args.users)  # warm up the page cache
+
+    print(f'{len(queries.STATEMENTS)} registered statements, cached_statements={queries.CACHED_STATEMENTS}')
+    print(f'PyPika build and render of list_categories: {bench_render(args.calls):.1f} us')
+    print(f'\n{"us per call":<30}' + ''.join(f'{name:>20}' for name in variants))
+    for query_name in variants['current']:
+        costs = [measure(calls[query_name], args.users, args.calls) for calls in variants.values()]
+        print(f'{query_name:<30}' + ''.join(f'{cost:>20.1f}' for cost in costs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Query plans and timings of the hot queries without and with the secondary indexes.
+
+The indexes are added by the 003 migration (and recreated for the compact timesheet by 004).
+
+    python -m benchmarks.query_plans [--users 500] [--activities 4000]
+
+The defaults make a 2M-row timesheet.
+"""
+import argparse
+import time
+from typing import Callable, Dict
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+REPEAT = 20
+
+
+def hot_queries(db: DBManager, user_id: int) -> Dict[str, Callable[[], object]]:
+    u = types.User(id=user_id)
+    session_id = db.get_last_started_session(u)[0]
+    return {
+        '_get_active_session': lambda: db._get_active_session(u),
+        'list_categories': lambda: db.list_categories(u),
+        'get_last_started_session': lambda: db.get_last_started_session(u),
+        'get_session_category_durations': lambda: db.get_session_category_durations(session_id),
+        'list_open_sessions': db.list_open_sessions,
+    }
+
+
+def explain(db: DBManager, query_name: str, run: Callable[[], object]) -> str:
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    run()
+    db.connection.set_trace_callback(None)
+    plan = db.connection.execute(f'EXPLAIN QUERY PLAN {statements[-1]}').fetchall()
+    return '\n'.join(f'    {detail}' for *_, detail in plan)
+
+
+def report(db: DBManager, user_id: int) -> None:
+    for query_name, run in hot_queries(db, user_id).items():
+        started_at = time.perf_counter()
+        for _ in range(REPEAT):
+            run()
+        elapsed_ms = (time.perf_counter() - started_at) / REPEAT * 1000
+        print(f'  {query_name}: {elapsed_ms:.3f} ms')
+        print(explain(db, query_name, run))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--activities', type=int, default=4000, help='activities per user')
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.migrate()
+    db.compact_legacy_rows()
+    print(f'Populating {args.users * args.activities} activities...')
+    populate(DB_NAME, args.users, args.activities)
+    user_id = args.users // 2
+
+    indexes = db.connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for name, _ in indexes:
+        db.connection.execute(f'DROP INDEX {name}')
+    print('\nWithout indexes:')
+    report(db, user_id)
+
+    for _, sql in indexes:
+        db.connection.execute(sql)
+    db.connection.execute('ANALYZE')
+    print(f'\nWith indexes: {", ".join(name for name, _ in indexes)}')
+    report(db, user_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Memory and timer overhead of per-session prompt tasks vs. `PromptScheduler`.
+
+    python -m benchmarks.scheduler [--sessions 1000 10000 50000] [--interval 1] [--seconds 3]
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from typing import Dict, List
+
+from .common import setup_env
+
+setup_env()
+
+from timesheetbot.scheduler import PromptScheduler, ScheduledSession  # noqa: E402
+
+
+async def bench_tasks(sessions: int, interval: float, seconds: float) -> Dict[str, float]:
+    """The baseline: one `while True: sleep(); prompt()` task (plus a lock) per session."""
+    prompts = 0
+    locks = {}
+
+    async def send_events(user_id: int):
+        nonlocal prompts
+        while True:
+            async with locks[user_id]:
+                pass  # the interval was read from the database here
+            await asyncio.sleep(interval)
+            prompts += 1
+
+    gc.collect()
+    tracemalloc.start()
+    tasks = []
+    for user_id in range(sessions):
+        locks[user_id] = asyncio.Lock()
+        tasks.append(asyncio.create_task(send_events(user_id)))
+    await asyncio.sleep(0)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started_at = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - started_at
+    [task.cancel() for task in tasks]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {'memory_kb': memory / 1024, 'cpu_s': cpu, 'prompts': prompts}
+
+
+async def bench_scheduler(sessions: int, interval: float, seconds: float) -> Dict[str, float]:
+    prompts = 0
+
+    async def dispatch(due: List[ScheduledSession]):
+        nonlocal prompts
+        prompts += len(due)
+
+    gc.collect()
+    tracemalloc.start()
+    scheduler = PromptScheduler(dispatch)
+    scheduler.start()
+    for user_id in range(sessions):
+        scheduler.add(user_id, user_id, interval, delay=interval * user_id / sessions)
+    await asyncio.sleep(0)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started_at = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - started_at
+    await scheduler.stop()
+    return {'memory_kb': memory / 1024, 'cpu_s': cpu, 'prompts': prompts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--interval', type=float, default=1, help='prompt interval, seconds')
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    print(f'{"":<12}{"sessions":>10}{"memory, KiB":>14}{"KiB/session":>14}{"cpu, s":>10}{"prompts":>10}')
+    for sessions in args.sessions:
+        for title, bench in (('tasks', bench_tasks), ('scheduler', bench_scheduler)):
+            result = asyncio.run(bench(sessions, args.interval, args.seconds))
+            print(f'{title:<12}{sessions:>10}{result["memory_kb"]:>14.0f}'
+                  f'{result["memory_kb"] / sessions:>14.2f}{result["cpu_s"]:>10.2f}{result["prompts"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Memory of the bot over many session start/stop cycles of churned users.
+
+Every round new users start a session, choose the interval and stop the
+session through the bot's handlers. Python memory (tracemalloc, without the
+fake Bot API allocations) should stay flat once the bounded caches are full:
+`USER_CACHE_MAX_USERS` users and the outbox chat buckets of about
+`OUTBOX_MAXSIZE` chats. No session state should outlive its session.
+
+    python -m benchmarks.session_soak [--rounds 20] [--users 1000]
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import time
+import tracemalloc
+
+from .common import running_bot, setup_env, setup_fake_bot_api_env
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from timesheetbot import callback_data, server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from .webhook import make_update  # noqa: E402
+
+INTERVAL_SECONDS = 60 * 15
+EXCLUDE_FAKE_BOT_API = (tracemalloc.Filter(False, '*/fake_bot_api.py'),)
+
+
+def make_interval_tap(user_id: int) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    return {
+        'callback_query': {
+            'id': str(user_id),
+            'chat_instance': str(user_id),
+            'from': user,
+            'data': callback_data.encode(callback_data.SET_INTERVAL, INTERVAL_SECONDS),
+        },
+    }
+
+
+async def run_cycle(user_id: int, message_ids: 'itertools.count'):
+    start = asyncio.create_task(server.feed_update(make_update(next(message_ids), user_id, '/start')))
+    while True:
+        state = server.user_sessions.get(user_id)
+        if state is not None and state.interval_waiter is not None:
+            break
+        await asyncio.sleep(0.01)
+
+    await server.feed_update(make_interval_tap(user_id))
+    await start
+    await server.feed_update(make_update(next(message_ids), user_id, '/stop'))
+
+
+async def soak(rounds: int, users_num: int, concurrency: int):
+    user_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_limited_cycle(user_id: int):
+        async with slots:
+            await run_cycle(user_id, message_ids)
+
+    print(f'{"round":>6}{"users":>8}{"seconds":>9}{"memory, KiB":>13}{"sessions":>10}'
+          f'{"scheduled":>11}{"cached users":>14}')
+    async with running_bot(FAKE_API_PORT, limits=False):
+        tracemalloc.start()
+        try:
+            for round_num in range(1, rounds + 1):
+                started_at = time.monotonic()
+                await asyncio.gather(*(run_limited_cycle(next(user_ids)) for _ in range(users_num)))
+                while server.outbox.depth:
+                    await asyncio.sleep(0.01)
+                elapsed = time.monotonic() - started_at
+                gc.collect()
+                snapshot = tracemalloc.take_snapshot().filter_traces(EXCLUDE_FAKE_BOT_API)
+                memory = sum(stat.size for stat in snapshot.statistics('filename'))
+                print(f'{round_num:>6}{round_num * users_num:>8}{elapsed:>9.1f}{memory / 1024:>13.0f}'
+                      f'{len(server.user_sessions):>10}{len(server.scheduler):>11}{len(server.users):>14}')
+        finally:
+            tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--users', type=int, default=1000, help='new users per round')
+    parser.add_argument('--concurrency', type=int, default=50, help='users in a cycle at a time')
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    asyncio.run(soak(args.rounds, args.users, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
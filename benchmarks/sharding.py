@@ -0,0 +1,127 @@
+"""Throughput of the multi-process mode by the number of workers.
+
+Synthetic users are routed to the workers as fast as they accept the
+updates, in two scenarios:
+
+- read: a `/help` or `/list` of every user, no database writes;
+- write: every user starts a session, taps an interval button and stops the
+  session; the user, the categories and the session are written, and the
+  workers contend for the write lock of the shared database.
+
+Throughput is the number of the updates handled per second. The fake Bot
+API does not limit the rate here, and the outbox rates, overall and per
+chat, are lifted, so the workers' CPU and the database are the bottleneck. The speedup only shows
+CPU scaling on a machine with more cores than workers (plus one for the fake
+Bot API and the router); with fewer cores the workers share a CPU and the
+speedup is not a scaling result, a warning is printed then.
+
+    python -m benchmarks.sharding [--workers 1 2 4] [--users 1000] [--scenarios read write]
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from .common import NO_LIMIT, setup_env, setup_fake_bot_api_env
+
+TMP_DIR = setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+from settings import constants  # noqa: E402
+from timesheetbot import messages as msgs  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+from timesheetbot.sharding import ShardRouter, WorkerPool  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+from .fill_all import make_tap  # noqa: E402
+from .webhook import make_update  # noqa: E402
+
+READ_COMMANDS = ('/help', '/list')
+FIRST_PROMPT_TEXT = msgs.FIRST_BOT_MSG.split('{')[0]
+STOPPED_TEXT = 'Остановились'
+# updates sent by a user in a scenario
+SCENARIO_UPDATES = {'read': 1, 'write': 3}
+
+Scenario = Callable[[FakeBotAPI, ShardRouter, int], Awaitable]
+
+
+async def read(fake_api: FakeBotAPI, router: ShardRouter, user_id: int) -> None:
+    replied = fake_api.wait_message(user_id)
+    await router.route(make_update(1, user_id, READ_COMMANDS[user_id % len(READ_COMMANDS)]))
+    await replied
+
+
+async def write(fake_api: FakeBotAPI, router: ShardRouter, user_id: int) -> None:
+    interval_keyboard = fake_api.wait_keyboard(user_id)
+    await router.route(make_update(1, user_id, '/start'))
+    buttons = await interval_keyboard
+
+    opened = fake_api.wait_message(user_id, FIRST_PROMPT_TEXT)
+    await router.route(make_tap(user_id, buttons[0]))
+    await opened
+
+    stopped = fake_api.wait_message(user_id, STOPPED_TEXT)
+    await router.route(make_update(2, user_id, '/stop'))
+    await stopped
+
+
+SCENARIOS: Dict[str, Scenario] = {'read': read, 'write': write}
+
+
+async def bench(scenario: str, workers_num: int, users_num: int, concurrency: int) -> float:
+    """Return updates per second."""
+    fake_api = FakeBotAPI(rate=NO_LIMIT, burst=NO_LIMIT, chat_rate=NO_LIMIT, chat_burst=NO_LIMIT)
+    await fake_api.start(port=FAKE_API_PORT)
+    with WorkerPool(workers_num, outbox_rate=NO_LIMIT, outbox_chat_rate=NO_LIMIT) as pool:
+        router = ShardRouter(pool.urls, pool.secret)
+        await router.start()
+        slots = asyncio.Semaphore(concurrency)
+        run_user = SCENARIOS[scenario]
+
+        async def limited(user_id: int):
+            async with slots:
+                await run_user(fake_api, router, user_id)
+
+        started_at = time.monotonic()
+        await asyncio.wait_for(asyncio.gather(*map(limited, range(1, users_num + 1))), timeout=300)
+        elapsed = time.monotonic() - started_at
+        await router.close()
+
+    await fake_api.stop()
+    return users_num * SCENARIO_UPDATES[scenario] / elapsed
+
+
+def reset_database() -> None:
+    """Start every run without the users and the sessions of the previous one."""
+    db_path = TMP_DIR / 'timesheet.db'
+    for path in (db_path, db_path.with_name(db_path.name + '-wal'), db_path.with_name(db_path.name + '-shm')):
+        path.unlink(missing_ok=True)
+    DBManager().migrate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--scenarios', nargs='+', choices=tuple(SCENARIOS), default=list(SCENARIOS))
+    # more updates than a worker takes in at once are rejected and retried, capping the throughput of fewer workers
+    parser.add_argument('--concurrency', type=int, default=constants.WEBHOOK_MAX_IN_FLIGHT // 2, help='users in flight')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    print(f'CPUs: {cpus}')
+    if cpus < max(args.workers) + 1:
+        print(f'Warning: fewer CPUs than workers + 1, the speedup of more than {cpus - 1 or 1} workers'
+              ' is not CPU scaling')
+    print(f'{"scenario":<10}{"workers":>8}{"updates/s":>12}{"speedup":>10}')
+    for scenario in args.scenarios:
+        results: List[float] = []
+        for workers_num in args.workers:
+            reset_database()
+            results.append(asyncio.run(bench(scenario, workers_num, args.users, args.concurrency)))
+            print(f'{scenario:<10}{workers_num:>8}{results[-1]:>12.1f}{results[-1] / results[0]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
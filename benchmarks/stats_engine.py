@@ -0,0 +1,120 @@
+"""Stats of the previous Python aggregation vs. the SQL `GROUP BY category` engine.
+
+The Python path is the one `server.get_stats` used before: load the activity
+frame of the sessions, then sort, `groupby` and `reduce` it by categories.
+The SQL path sums up the raw timesheet, the rollups path reads `daily_stats`
+for the whole days of the period.
+
+    python -m benchmarks.stats_engine [--users 50] [--activities 8640]
+
+The defaults are a month of 5-minute intervals per user.
+"""
+import argparse
+import functools
+import itertools
+import json
+import time
+from datetime import datetime, timedelta
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot import stats  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+
+from . import fixtures  # noqa: E402
+
+REPEAT = 10
+PERIODS = {
+    'last day': {'days': 1},
+    'last week': {'weeks': 1},
+    'last month': {'months': 1},
+    'current month': stats.PERIOD_MONTH,
+}
+
+
+# the queries of the Python path
+FILTER_USER_SESSIONS_BY_START = 'select * from session where user_telegram_id = :user_id and :t0 <= start_at'
+GET_TIMESHEET_FRAME_BY_SESSIONS = '''
+    select timesheet.finish - timesheet.start as duration, category.name
+    from timesheet
+    join category on timesheet.default_category_id is not null and timesheet.default_category_id = category.id
+    where timesheet.session_id in (select value from json_each(:session_ids))
+'''
+
+
+def increment_activities_duration(acc: timedelta, activity: tuple) -> timedelta:
+    duration_seconds, _ = activity
+    return acc + timedelta(seconds=duration_seconds)
+
+
+def calc_category_stats(category: str, activities) -> dict:
+    time_ = functools.reduce(increment_activities_duration, tuple(activities), timedelta())
+    return dict(category=category, time=time_)
+
+
+def python_stats(db: DBManager, u: types.User, t0: datetime) -> tuple:
+    sessions = db._cursor.execute(FILTER_USER_SESSIONS_BY_START, {'user_id': u.id, 't0': int(t0.timestamp())})
+    session_ids = json.dumps([session[0] for session in sessions])
+    activities = db._cursor.execute(GET_TIMESHEET_FRAME_BY_SESSIONS, {'session_ids': session_ids}).fetchall()
+    if not activities:  # no session started in the period
+        return ()
+
+    category_filter = lambda activity: activity[-1]  # noqa: E731
+    groups_gen = itertools.groupby(sorted(activities, key=category_filter), key=category_filter)
+    category_stats = tuple(itertools.starmap(calc_category_stats, groups_gen))
+    all_activities_time = sum((s['time'] for s in category_stats), timedelta())
+    for category_stat in category_stats:
+        category_stat.update(percent=category_stat['time'] / all_activities_time * 100)
+    return category_stats
+
+
+def sql_stats(db: DBManager, u: types.User, t0: datetime) -> tuple:
+    return stats.calc_stats(db.get_category_durations(u, t0, datetime.now()))
+
+
+def rollups_stats(db: DBManager, u: types.User, t0: datetime) -> tuple:
+    whole_days_start = stats.get_first_whole_day_start(t0)
+    category_seconds = dict(db.get_daily_category_durations(u, whole_days_start))
+    if t0 < whole_days_start:
+        for category, seconds in db.get_category_durations(u, t0, whole_days_start):
+            category_seconds[category] = category_seconds.get(category, 0) + seconds
+    return stats.calc_stats(sorted(category_seconds.items()))
+
+
+def timeit(run, users: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(REPEAT):
+        for user_id in range(1, users + 1):
+            run(types.User(id=user_id))
+    return (time.perf_counter() - started_at) / REPEAT / users * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--activities', type=int, default=8640, help='activities per user')
+    args = parser.parse_args()
+
+    # 5-minute intervals in one session a day
+    fixtures.INTERVAL_SECONDS = 60 * 5
+    db = DBManager()
+    db.migrate()
+    fixtures.populate(DB_NAME, args.users, args.activities, sessions_per_user=args.activities * 5 // (60 * 24))
+    db.rebuild_daily_stats()
+
+    print(f'{"":<16}{"python, ms":>12}{"sql, ms":>12}{"rollups, ms":>14}')
+    for title, period in PERIODS.items():
+        t0, _ = stats.get_period_bounds(period, datetime.now())
+        python_ms = timeit(lambda u: python_stats(db, u, t0), args.users)
+        sql_ms = timeit(lambda u: sql_stats(db, u, t0), args.users)
+        rollups_ms = timeit(lambda u: rollups_stats(db, u, t0), args.users)
+        print(f'{title:<16}{python_ms:>12.2f}{sql_ms:>12.2f}{rollups_ms:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
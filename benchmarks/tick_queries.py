@@ -0,0 +1,123 @@
+"""DB cost of a periodic prompt (tick) and of a category button tap (callback).
+
+The previous paths are replayed statement by statement: the tick checked the
+open session, inserted the activity, selected it back and listed the
+categories; the callback selected the activity before updating it and the
+category after. The current paths are `DBManager.start_activity` and
+`stop_activity` (one `... RETURNING` statement each) with categories taken
+from memory. Every write is committed, as without group commit.
+
+    python -m benchmarks.tick_queries [--users 100] [--activities 1000] [--ticks 2000]
+"""
+import argparse
+import time
+from typing import Callable, Dict, List, Tuple
+
+from .common import setup_env
+
+setup_env()
+
+from aiogram import types  # noqa: E402
+
+from settings.config import DB_NAME  # noqa: E402
+from timesheetbot.db_manager import DBManager, DoesNotExist  # noqa: E402
+
+from .fixtures import populate  # noqa: E402
+
+
+def previous_tick(db: DBManager, u: types.User, session_id: int) -> Tuple[tuple, list]:
+    con = db.connection
+    if not con.execute('SELECT id FROM session WHERE user_telegram_id=? AND stop_at IS NULL', (u.id,)).fetchone():
+        raise DoesNotExist()
+    finish = int(time.time())
+    cursor = con.execute('INSERT INTO timesheet (session_id, start, finish) VALUES (?, ?, ?)',
+                         (session_id, finish - 60, finish))
+    con.commit()
+    activity = con.execute('SELECT * FROM timesheet WHERE activity_id=? AND default_category_id IS NULL'
+                           ' AND user_category_id IS NULL', (cursor.lastrowid,)).fetchone()
+    categories = con.execute('SELECT * FROM category WHERE user_telegram_id=?', (u.id,)).fetchall()
+    return activity, categories
+
+
+def previous_callback(db: DBManager, user_id: int, activity_id: int, category_id: int) -> str:
+    con = db.connection
+    activity = con.execute('SELECT * FROM timesheet WHERE activity_id=? AND default_category_id IS NULL'
+                           ' AND user_category_id IS NULL', (activity_id,)).fetchone()
+    if not activity:
+        raise DoesNotExist()
+    con.execute('UPDATE timesheet SET default_category_id=? WHERE activity_id=?', (category_id, activity_id))
+    db._add_to_daily_stats(user_id, category_id, [activity[-2:]])
+    con.commit()
+    _, _, name = con.execute('SELECT * FROM category WHERE id=?', (category_id,)).fetchone()
+    return name
+
+
+def current_tick(db: DBManager, categories: Dict[int, tuple], u: types.User, session_id: int):
+    return db.start_activity(session_id, 60), categories[u.id]
+
+
+def current_callback(db: DBManager, category_names: Dict[int, str], u: types.User, activity_id: int,
+                     category_id: int) -> str:
+    db.stop_activity(u, activity_id, category_id)
+    return category_names[category_id]
+
+
+def measure(db: DBManager, ticks: int, sessions: List[Tuple[int, int]],
+            tick: Callable, callback: Callable) -> Dict[str, Tuple[float, float]]:
+    """Return {path: (microseconds, statements) per call}."""
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    activities = []
+    started_at = time.perf_counter()
+    for num in range(ticks):
+        user_id, session_id = sessions[num % len(sessions)]
+        activity, _ = tick(types.User(id=user_id), session_id)
+        activities.append((activity[0], user_id))
+    tick_cost = (time.perf_counter() - started_at) / ticks * 1e6, len(statements) / ticks
+
+    statements.clear()
+    started_at = time.perf_counter()
+    for activity_id, user_id in activities:
+        callback(activity_id, user_id)
+    callback_cost = (time.perf_counter() - started_at) / ticks * 1e6, len(statements) / ticks
+    db.connection.set_trace_callback(None)
+    return {'tick': tick_cost, 'callback': callback_cost}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--activities', type=int, default=1000, help='activities per user')
+    parser.add_argument('--ticks', type=int, default=2000)
+    args = parser.parse_args()
+
+    db = DBManager()
+    db.migrate()
+    populate(DB_NAME, args.users, args.activities)
+    sessions = db.connection.execute('SELECT user_telegram_id, id FROM session WHERE stop_at IS NULL').fetchall()
+    categories = {user_id: db.list_categories(types.User(id=user_id)) for user_id, _ in sessions}
+    first_category_ids = {user_id: user_categories[0][0] for user_id, user_categories in categories.items()}
+    category_names = {category_id: name for user_categories in categories.values()
+                      for category_id, name in user_categories}
+
+    results = {
+        'previous': measure(
+            db, args.ticks, sessions,
+            tick=lambda u, session_id: previous_tick(db, u, session_id),
+            callback=lambda activity_id, user_id: previous_callback(
+                db, user_id, activity_id, first_category_ids[user_id])),
+        'current': measure(
+            db, args.ticks, sessions,
+            tick=lambda u, session_id: current_tick(db, categories, u, session_id),
+            callback=lambda activity_id, user_id: current_callback(
+                db, category_names, types.User(id=user_id), activity_id, first_category_ids[user_id])),
+    }
+
+    print(f'{"":<12}{"tick, us":>12}{"statements":>12}{"callback, us":>14}{"statements":>12}')
+    for path, costs in results.items():
+        (tick_us, tick_statements), (callback_us, callback_statements) = costs['tick'], costs['callback']
+        print(f'{path:<12}{tick_us:>12.1f}{tick_statements:>12.1f}{callback_us:>14.1f}{callback_statements:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""End-to-end update latency: long polling vs. the webhook receiver.
+
+Synthetic `/help` and `/list` updates arrive on a fixed schedule (open loop)
+either through the fake Bot API `getUpdates` or POSTed to the webhook
+receiver. Latency is measured from the arrival of the update till the bot's
+reply reaches the fake Bot API.
+
+    python -m benchmarks.webhook [--rps 20] [--seconds 5]
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from .common import get_free_port, print_table, running_bot, setup_env, setup_fake_bot_api_env, summarize
+
+setup_env()
+FAKE_API_PORT = setup_fake_bot_api_env()
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from timesheetbot import server  # noqa: E402
+from timesheetbot.db_manager import DBManager  # noqa: E402
+from timesheetbot.webhook import WebhookReceiver, make_app  # noqa: E402
+
+from .fake_bot_api import FakeBotAPI  # noqa: E402
+
+WEBHOOK_PATH = '/webhook'
+COMMANDS = ('/help', '/list')
+
+
+def make_update(message_id: int, user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    return {
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'from': user,
+            'chat': dict(user, type='private'),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+
+async def run_load(fake_api: FakeBotAPI, deliver: Callable[[dict], Awaitable], rps: float, seconds: float,
+                   user_ids: 'itertools.count') -> List[float]:
+    latencies = []
+
+    async def timed(update: dict, planned_at: float):
+        replied = fake_api.wait_message(update['message']['chat']['id'])
+        await deliver(update)
+        latencies.append(await replied - planned_at)
+
+    tasks = []
+    gap = 1 / rps
+    started_at = time.monotonic()
+    for num in range(int(seconds * rps)):
+        planned_at = started_at + num * gap
+        delay = planned_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # a new user each time not to hit the per chat limit of the outbox
+        update = make_update(num + 1, next(user_ids), COMMANDS[num % len(COMMANDS)])
+        tasks.append(asyncio.create_task(timed(update, planned_at)))
+
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=seconds + 30)
+    return latencies
+
+
+async def bench_polling(fake_api: FakeBotAPI, args, user_ids) -> List[float]:
+    polling = asyncio.create_task(server.dp.start_polling(reset_webhook=False, timeout=20, relax=0.1))
+
+    async def deliver(update: dict):
+        fake_api.put_update(update)
+
+    try:
+        return await run_load(fake_api, deliver, args.rps, args.seconds, user_ids)
+    finally:
+        server.dp.stop_polling()
+        fake_api.put_update({})  # wake up the pending getUpdates
+        await polling
+
+
+async def bench_webhook(fake_api: FakeBotAPI, args, user_ids) -> List[float]:
+    receiver = WebhookReceiver(server.feed_update)
+    runner = web.AppRunner(make_app(receiver, WEBHOOK_PATH), access_log=None)
+    await runner.setup()
+    port = get_free_port()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = f'http://127.0.0.1:{port}{WEBHOOK_PATH}'
+
+    async with aiohttp.ClientSession() as session:
+        async def deliver(update: dict):
+            async with session.post(url, json=update) as response:
+                response.raise_for_status()
+
+        try:
+            return await run_load(fake_api, deliver, args.rps, args.seconds, user_ids)
+        finally:
+            await runner.cleanup()
+
+
+async def bench(args) -> Dict[str, List[float]]:
+    user_ids = itertools.count(1)
+    async with running_bot(FAKE_API_PORT) as fake_api:
+        return {
+            'polling': await bench_polling(fake_api, args, user_ids),
+            'webhook': await bench_webhook(fake_api, args, user_ids),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rps', type=float, default=20, help='updates per second, keep below the outbox rate')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    DBManager().migrate()
+    latencies = asyncio.run(bench(args))
+    print_table('update -> reply latency', {mode: summarize(values) for mode, values in latencies.items()})
+
+
+if __name__ == '__main__':
+    main()
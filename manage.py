@@ -1,30 +1,194 @@
+"""Bot management commands.
+
+The bot and the database modules are imported by the commands which use them,
+so e.g. `stats` starts without importing aiogram or touching the database.
+"""
+import json
 import platform
+import time
+from datetime import datetime
 from logging import config as logging_config
+from pathlib import Path
 
 import click
-from aiogram.utils import executor
 
-from settings import LOG_CONFIG
-from timesheetbot.db_manager import DBManager
-from timesheetbot.server import dp
+import settings
+from settings import LOG_CONFIG, constants
 
 
 @click.group()
 def cli():
     logging_config.dictConfig(LOG_CONFIG)
 
+
+def install_event_loop():
     if platform.system() != 'Windows':
         import uvloop
         uvloop.install()
 
+
+def open_database():
+    """Connect to the database applying the new migrations."""
+    from timesheetbot.db_manager import DBManager
+
     database = DBManager()
     database.migrate()
+    return database
+
+
+@cli.command(short_help='apply database migrations')
+def migrate():
+    """Apply the new migrations; the commands using the database apply them too."""
+    open_database()
+    click.echo('Migrated')
 
 
 @cli.command(short_help='start bot')
-def start():
+@click.option('--workers', default=1, show_default=True, help='worker processes; users are split between them by id')
+def start(workers: int):
     """Start the bot."""
-    executor.start_polling(dp, skip_updates=True)
+    install_event_loop()
+    open_database()
+    if workers > 1:
+        from timesheetbot import sharding
+
+        sharding.run_polling_front(workers)
+    else:
+        import asyncio
+
+        from aiogram.utils import executor
+
+        from timesheetbot import server, utils
+
+        # the executor runs the current loop, which uvloop does not create on demand
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        # the executor shuts down on SystemExit only: commit the last writes on SIGTERM as well
+        utils.exit_on_sigterm()
+        executor.start_polling(server.create_app(), skip_updates=True, on_startup=server.on_startup,
+                               on_shutdown=server.on_shutdown)
+
+
+@cli.command(short_help='start bot receiving updates via webhook')
+@click.option('--host', default=settings.WEBHOOK_HOST, show_default=True)
+@click.option('--port', default=settings.WEBHOOK_PORT, show_default=True)
+@click.option('--path', default=settings.WEBHOOK_PATH, show_default=True)
+@click.option('--secret', default=settings.WEBHOOK_SECRET, help='secret token expected in the webhook requests')
+@click.option('--url', default=settings.WEBHOOK_URL, help='public URL to register as the webhook')
+@click.option('--workers', default=1, show_default=True, help='worker processes; users are split between them by id')
+def webhook(host: str, port: int, path: str, secret: str, url: str, workers: int):
+    """Start the bot with the webhook receiver.
+
+    Without --url the webhook is not registered, e.g. to be fed with synthetic updates locally.
+    """
+    install_event_loop()
+    open_database()
+    if workers > 1:
+        from timesheetbot import sharding
+
+        sharding.run_webhook_front(workers, host, port, path, secret, url)
+    else:
+        from aiohttp import web
+
+        from timesheetbot import server
+
+        server.create_app()
+        web.run_app(server.make_webhook_app(path, secret, url), host=host, port=port, access_log=None)
+
+
+@cli.command(short_help='convert old rows to the compact storage format')
+@click.option('--chunk-size', default=constants.COMPACT_CHUNK_SIZE, show_default=True, help='rows per transaction')
+@click.option('--pause', default=0.05, show_default=True, help='seconds between chunks to let the bot write')
+@click.option('--vacuum', is_flag=True, help='rebuild the database file to reclaim the freed space')
+def compact(chunk_size: int, pause: float, vacuum: bool):
+    """Convert timesheet rows and session datetimes left from before the 004 migration.
+
+    The bot can keep running: every chunk is converted in its own short transaction.
+    """
+    database = open_database()
+    total = 0
+    while converted := database.compact_legacy_rows(chunk_size):
+        total += converted
+        click.echo(f'Converted rows: {total}')
+        time.sleep(pause)
+
+    if vacuum:
+        database.vacuum()
+    click.echo('Done')
+
+
+@cli.command('backfill-stats', short_help='rebuild daily stats rollups')
+def backfill_stats():
+    """Rebuild the daily stats rollups from the raw timesheet, user by user."""
+    users_num = open_database().rebuild_daily_stats()
+    click.echo(f'Rebuilt daily stats of {users_num} users')
+
+
+@cli.command('check-stats', short_help='compare daily stats rollups with the raw timesheet')
+def check_stats():
+    """Compare the daily stats rollups with the raw timesheet, exit with 1 on mismatches."""
+    mismatches = open_database().check_daily_stats()
+    for user_id, day, category_id, expected, stored in mismatches:
+        click.echo(f'user={user_id} day={datetime.fromtimestamp(day):%Y-%m-%d} category={category_id}:'
+                   f' expected {expected}, stored {stored} seconds')
+
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} mismatches')
+    click.echo('Daily stats are consistent')
+
+
+@cli.command('export', short_help='export the raw timesheet to CSV or JSON Lines')
+@click.option('--user', 'user_id', type=int, help='export only the activities of the user')
+@click.option('--format', 'fmt', type=click.Choice(constants.EXPORT_FORMATS), default=constants.EXPORT_FORMATS[0],
+              show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='compress the files with gzip')
+@click.option('--output-dir', type=click.Path(file_okay=False, writable=True), default='.',
+              show_default=True)
+@click.option('--max-bytes', default=constants.EXPORT_MAX_FILE_BYTES, show_default=True,
+              help='split the export into files of at most this size')
+def export_timesheet(user_id: int, fmt: str, compress: bool, output_dir: str, max_bytes: int):
+    """Export the activities of all the users, or of the user, streaming them from the database.
+
+    The bot can keep running: the export reads the database without locking it for writes.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    name = f'timesheet-{user_id if user_id is not None else "all"}-{datetime.now():%Y%m%d-%H%M%S}'
+    paths = open_database().export_timesheet(Path(output_dir, name), user_id, fmt, compress, max_bytes)
+    for path in paths:
+        click.echo(f'{path} ({path.stat().st_size} bytes)')
+
+
+@cli.command(short_help='dump the metrics of the running bot')
+@click.option('--host', default=settings.METRICS_HOST, show_default=True)
+@click.option('--port', default=settings.METRICS_PORT, show_default=True,
+              help='metrics port of the bot; worker N of the multi-process mode serves it on port + 1 + N')
+@click.option('--raw', is_flag=True, help='print the metrics in the Prometheus text format')
+def stats(host: str, port: int, raw: bool):
+    """Dump the latency histograms and the gauges served by the running bot on its metrics endpoint."""
+    import urllib.error
+    import urllib.request
+
+    url = f'http://{host}:{port}/{"metrics" if raw else "stats"}'
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode()
+    except (urllib.error.URLError, OSError) as e:
+        raise click.ClickException(f'Failed to get {url}: {e}')
+
+    if raw:
+        click.echo(body, nl=False)
+        return
+
+    for name, metric in json.loads(body).items():
+        click.echo(f'{name} ({metric["help"]})')
+        if metric['type'] != 'histogram':
+            for label_value, value in metric['values'].items():
+                click.echo(f'  {label_value or "value":<28}{value:>12g}')
+            continue
+        click.echo(f'  {metric["label"] or "":<28}{"count":>10}{"mean, ms":>10}{"p50, ms":>10}'
+                   f'{"p90, ms":>10}{"p99, ms":>10}')
+        for label_value, summary in metric['values'].items():
+            click.echo(f'  {label_value or "value":<28}{summary["count"]:>10}'
+                       + ''.join(f'{summary[key] * 1000:>10.2f}' for key in ('mean', 'p50', 'p90', 'p99')))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,4 @@
+CREATE TABLE IF NOT EXISTS session_schedule (
+    session_id integer PRIMARY KEY,
+    next_prompt_at integer
+);
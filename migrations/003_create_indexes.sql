@@ -0,0 +1,15 @@
+-- list_categories
+CREATE INDEX IF NOT EXISTS category_user_idx ON category (user_telegram_id, name);
+
+-- get_last_started_session, filter_user_sessions_by_start
+CREATE INDEX IF NOT EXISTS session_user_start_at_idx ON session (user_telegram_id, start_at);
+
+-- _get_active_session, list_open_sessions: only open sessions
+CREATE INDEX IF NOT EXISTS session_open_user_idx ON session (user_telegram_id) WHERE stop_at IS NULL;
+
+-- get_timesheet_frame_by_sessions: covering
+CREATE INDEX IF NOT EXISTS timesheet_session_category_idx ON timesheet (session_id, default_category_id, start, finish);
+
+-- unfilled activities of a session
+CREATE INDEX IF NOT EXISTS timesheet_unfilled_session_idx ON timesheet (session_id)
+    WHERE default_category_id IS NULL AND user_category_id IS NULL;
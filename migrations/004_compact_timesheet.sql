@@ -0,0 +1,23 @@
+-- Activities get an integer rowid key, timestamps become UNIX epoch seconds.
+-- Rows in the previous format stay in `timesheet_legacy` until they are moved
+-- in chunks by `DBManager.compact_legacy_rows` (`manage.py compact`).
+DROP INDEX IF EXISTS timesheet_session_category_idx;
+DROP INDEX IF EXISTS timesheet_unfilled_session_idx;
+
+ALTER TABLE timesheet RENAME TO timesheet_legacy;
+
+CREATE TABLE timesheet (
+    activity_id integer PRIMARY KEY,
+    session_id integer,
+    user_category_id integer,
+    default_category_id integer,
+    start integer,
+    finish integer
+);
+
+-- get_timesheet_frame_by_sessions: covering
+CREATE INDEX IF NOT EXISTS timesheet_session_category_idx ON timesheet (session_id, default_category_id, start, finish);
+
+-- unfilled activities of a session
+CREATE INDEX IF NOT EXISTS timesheet_unfilled_session_idx ON timesheet (session_id)
+    WHERE default_category_id IS NULL AND user_category_id IS NULL;
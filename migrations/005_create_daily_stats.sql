@@ -0,0 +1,9 @@
+-- Seconds of filled activities per user, local day and category.
+-- Maintained by `DBManager.stop_activity`, (re)built by `manage.py backfill-stats`.
+CREATE TABLE IF NOT EXISTS daily_stats (
+    user_telegram_id integer,
+    day integer,  -- UNIX timestamp of the local midnight
+    category_id integer,
+    seconds integer,
+    PRIMARY KEY (user_telegram_id, day, category_id)
+) WITHOUT ROWID;
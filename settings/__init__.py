@@ -1,7 +1,19 @@
-from . import constants
+from . import config, constants
 from .config import (
-    ACCESS_IDS,
     DEBUG_MODE,
-    TELEGRAM_API_TOKEN,
+    EDIT_IN_PLACE_PROMPTS,
+    METRICS_HOST,
+    METRICS_PORT,
+    TELEGRAM_API_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
 )
 from .logs import LOG_CONFIG
+
+
+def __getattr__(name: str):
+    """`ACCESS_IDS` and `TELEGRAM_API_TOKEN` are read on the first access, see `config`."""
+    return getattr(config, name)
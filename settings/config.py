@@ -1,5 +1,6 @@
 import json
 from pathlib import Path
+from typing import Any, Callable, Dict, Set
 
 from envparse import Env
 
@@ -11,14 +12,64 @@ env.read_envfile()
 
 DEBUG_MODE = env.bool('DEBUG_MODE', default=True)
 LOG_LEVEL = env('LOG_LEVEL', default='INFO').upper()
-TELEGRAM_API_TOKEN = env.str('TELEGRAM_API_TOKEN')
 
-assert TELEGRAM_API_TOKEN, 'TELEGRAM_API_TOKEN not provided.'
 
-access_ids_file = Path(env.str('ACCESS_IDS_FILE', default=str(this_dir / 'allowed_accounts.json')))
-assert access_ids_file.exists(), f'No such file: {access_ids_file=}'
-with access_ids_file.open(encoding='utf-8') as f:
-    ACCESS_IDS = set(json.load(f))
+def _read_telegram_api_token() -> str:
+    token = env.str('TELEGRAM_API_TOKEN', default='')
+    assert token, 'TELEGRAM_API_TOKEN not provided.'
+    return token
 
-DB_NAME = 'database/timesheet.db'
-DB_MIGRATIONS_DIR = 'database/migrations'
+
+def _read_access_ids() -> Set[int]:
+    access_ids_file = Path(env.str('ACCESS_IDS_FILE', default=str(this_dir / 'allowed_accounts.json')))
+    assert access_ids_file.exists(), f'No such file: {access_ids_file=}'
+    with access_ids_file.open(encoding='utf-8') as f:
+        return set(json.load(f))
+
+
+# Settings only the bot needs are read and checked on the first access,
+#  so e.g. the maintenance commands run without them
+_LAZY_SETTINGS: Dict[str, Callable[[], Any]] = {
+    'TELEGRAM_API_TOKEN': _read_telegram_api_token,
+    'ACCESS_IDS': _read_access_ids,
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_SETTINGS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = _LAZY_SETTINGS[name]()
+    return value
+
+
+DB_NAME = env.str('DB_NAME', default='database/timesheet.db')
+DB_MIGRATIONS_DIR = env.str('DB_MIGRATIONS_DIR', default='database/migrations')
+# Durability: with WAL and synchronous=NORMAL a commit survives a crash of the bot, but not of the OS;
+#  FULL survives both at the cost of fsync per commit.
+DB_JOURNAL_MODE = env.str('DB_JOURNAL_MODE', default='WAL').upper()
+DB_SYNCHRONOUS = env.str('DB_SYNCHRONOUS', default='NORMAL').upper()
+assert DB_JOURNAL_MODE in ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST'), f'Bad {DB_JOURNAL_MODE=}'
+assert DB_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL', 'EXTRA'), f'Bad {DB_SYNCHRONOUS=}'
+# Group commit of the bot writes: a commit per window or per so many writes, whichever comes first;
+#  the writes of the last window are lost on a crash. 0 commits every write.
+#  The worker processes of the multi-process mode commit every write.
+DB_COMMIT_WINDOW_MS = env.int('DB_COMMIT_WINDOW_MS', default=50)
+DB_COMMIT_MAX_WRITES = env.int('DB_COMMIT_MAX_WRITES', default=100)
+
+# One prompt message per session edited on every tick; fillings are acknowledged by callback answers
+EDIT_IN_PLACE_PROMPTS = env.bool('EDIT_IN_PLACE_PROMPTS', default=False)
+
+# Bot API server, e.g. a local one (https://github.com/tdlib/telegram-bot-api)
+TELEGRAM_API_URL = env.str('TELEGRAM_API_URL', default='https://api.telegram.org')
+
+# Webhook mode: Telegram POSTs updates to WEBHOOK_URL, which must be proxied to WEBHOOK_HOST:WEBHOOK_PORT/WEBHOOK_PATH
+WEBHOOK_HOST = env.str('WEBHOOK_HOST', default='127.0.0.1')
+WEBHOOK_PORT = env.int('WEBHOOK_PORT', default=8080)
+WEBHOOK_PATH = env.str('WEBHOOK_PATH', default='/webhook')
+WEBHOOK_URL = env.str('WEBHOOK_URL', default='')
+WEBHOOK_SECRET = env.str('WEBHOOK_SECRET', default='')
+
+# Local metrics endpoint: /metrics in the Prometheus text format, /stats as JSON; 0 disables it.
+#  Worker N of the multi-process mode serves it on METRICS_PORT + 1 + N.
+METRICS_HOST = env.str('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = env.int('METRICS_PORT', default=9464)
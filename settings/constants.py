@@ -1,36 +1,92 @@
-from aiogram import types
-
 DEFAULT_CATEGORIES = 'Работа', 'TimeKiller', 'Еда', 'Прогулка', 'Тренировка', 'Сон',
 
 WAIT_INTERVAL_FROM_USER_BEFORE_START = 10
 
 DEFAULT_INTERVAL_SECONDS = 60 * 15
+SCHEDULER_BATCH_SIZE = 500
+SCHEDULER_RESOLUTION_SECONDS = 0.2
+RESTORED_PROMPTS_PER_SECOND = 25
+COMPACT_CHUNK_SIZE = 5000
+# statements run besides the registered ones in `queries`: pragmas, migrations, compaction
+DB_AD_HOC_CACHED_STATEMENTS = 16
+STATS_CACHE_MAX_USERS = 10000
+STATS_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_USERS = 10000
+
+# Telegram limits: ~30 messages per second overall, ~1 message per second to a chat
+OUTBOX_RATE = 30
+OUTBOX_BURST = 1
+OUTBOX_CHAT_RATE = 1
+OUTBOX_CHAT_BURST = 3
+OUTBOX_MAXSIZE = 10000
+OUTBOX_CONCURRENCY = 30
+OUTBOX_STOP_TIMEOUT_SECONDS = 5
+
+# Webhook backpressure: updates processed at once, and how long an update waits for a slot before 503
+WEBHOOK_MAX_IN_FLIGHT = 100
+WEBHOOK_QUEUE_TIMEOUT_SECONDS = 1
+# Telegram opens up to this many connections to the webhook
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Logging: records queued for the writer thread, records written at once
+LOG_QUEUE_MAXSIZE = 10000
+LOG_BATCH_SIZE = 100
+
+# Metrics histogram buckets, seconds: handler and query latencies, lag of the prompts past their planned time
+METRICS_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+METRICS_LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+# Timesheet export: Telegram accepts documents of up to 50 MB from bots, bigger exports are split into files
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_MAX_FILE_BYTES = 50 * 1000 * 1000
+EXPORT_WRITE_BUFFER_BYTES = 64 * 1024
+# gzip level 9 (the default) compresses the exports ~9 times slower than 6 for ~13% smaller files
+EXPORT_GZIP_LEVEL = 6
+# exports run at once by the bot, each on a database connection and a thread of its own
+EXPORT_WORKERS = 2
+# the bot stops waiting for the export documents to be sent, e.g. left in the stopped outbox, and removes the files
+EXPORT_SEND_TIMEOUT_SECONDS = 600
+
+# Multi-process mode
+WORKERS_START_TIMEOUT_SECONDS = 30
+WORKER_RETRY_DELAY_SECONDS = 0.05
+# a worker stops when its front process is gone, checked this often
+WORKER_PARENT_CHECK_SECONDS = 1
+
 MAX_ROW_BUTTONS = 3
 
+# with this many unanswered prompts the user is offered to fill all the activities at once
+#  instead of the next prompt, and the prompts stop till the user answers
+FILL_ALL_AFTER_UNANSWERED = 3
+FILL_ALL_TEXT = 'Накопилось несколько незаполненных промежутков. Чем занимался всё это время?'
+# in the edit-in-place mode the only prompt message offers to fill all the activities as soon as there are two
+FILL_ALL_PENDING_TEXT = 'Незаполненных промежутков: {unanswered}. Чем занимался всё это время?'
+
 START_SESSION_BEFOREHAND = 'Сперва стартуй сессию'
 CHOOSE_INTERVAL_TEXT = 'Выбери интервал'
-INTERVAL_BUTTONS = (
-    types.InlineKeyboardButton('15 минут', callback_data=str(60 * 15)),
-    types.InlineKeyboardButton('20 минут', callback_data=str(60 * 20)),
-    types.InlineKeyboardButton('30 минут', callback_data=str(60 * 30)),
+INTERVALS = (
+    ('15 минут', 60 * 15),
+    ('20 минут', 60 * 20),
+    ('30 минут', 60 * 30),
 )
 
-DEBUG_BUTTONS = (
-    types.InlineKeyboardButton('5 секунд (тест)', callback_data=str(5)),
-    types.InlineKeyboardButton('10 секунд (тест)', callback_data=str(10)),
-    types.InlineKeyboardButton('30 секунд (тест)', callback_data=str(30)),
+DEBUG_INTERVALS = (
+    ('5 секунд (тест)', 5),
+    ('10 секунд (тест)', 10),
+    ('30 секунд (тест)', 30),
 )
 
 CHOOSE_STATS_TEXT = 'Статистика за какой период?'
-STATS_BUTTONS = types.InlineKeyboardMarkup().row(
-    types.InlineKeyboardButton('За день', callback_data='{"days": 1}'),
-    types.InlineKeyboardButton('За неделю', callback_data='{"weeks": 1}'),
-    types.InlineKeyboardButton('За месяц', callback_data='{"months": 1}'),
-).row(
-    types.InlineKeyboardButton('За последнюю сессию', callback_data='session'),
-#     TODO:
-#     types.InlineKeyboardButton('За текущий день', callback_data='???'),
-# ).row(
-#     types.InlineKeyboardButton('За текущий месяц', callback_data='???'),
-#     types.InlineKeyboardButton('За текущую неделю', callback_data='???'),
+# the index of a period is its id in the callback data: only append new periods
+STATS_PERIODS = (
+    ('За день', {'days': 1}),
+    ('За неделю', {'weeks': 1}),
+    ('За месяц', {'months': 1}),
+    ('За последнюю сессию', 'session'),
+    ('За текущий день', 'today'),
+    ('За текущую неделю', 'week'),
+    ('За текущий месяц', 'month'),
 )
+STATS_KEYBOARD_ROWS = (3, 2, 2)
@@ -20,15 +20,21 @@ class JSONFormatter(logging.Formatter):
         """JSON format implementation of logging formatter."""
         super().__init__(*args, **kwargs)
         self._jsondumps_kwargs = jsondumps_kwargs.copy() if jsondumps_kwargs else {}
+        # (second, time string with a `{ms}` placeholder) of the last formatted record
+        self._second_time = (-1, '')
 
     def formatTime(self, record, *args) -> str:  # noqa: N802
-        """Format TZ-time with milliseconds as this: 2020-10-09 11:26:07,080 +0300."""
-        ct = self.converter(record.created)  # type: ignore
-        formatted_ms = self.msec_format % record.msecs
-        time_format_with_msec = self.default_time_format.format(ms=formatted_ms)
+        """Format TZ-time with milliseconds as this: 2020-10-09 11:26:07,080 +0300.
 
-        formatted_time = time.strftime(time_format_with_msec, ct)
-        return formatted_time
+        `strftime` is called once per second, the records of the same second only differ in milliseconds.
+        """
+        second, second_time = self._second_time
+        if second != int(record.created):
+            second = int(record.created)
+            second_time = time.strftime(self.default_time_format, self.converter(second))  # type: ignore
+            self._second_time = (second, second_time)
+
+        return second_time.format(ms=self.msec_format % record.msecs)
 
     def format(self, record: logging.LogRecord) -> str:
         r"""Serialize a log record to JSON.
@@ -0,0 +1,124 @@
+"""Queue-backed logging handlers.
+
+A logging call only puts the record into a bounded queue; the records are
+formatted and written on the thread of a queue listener, in batches: one
+write and one flush per batch. When the queue is full, e.g. the stream is
+slower than the bot, the records are dropped and counted rather than
+blocking the event loop.
+"""
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional, TextIO
+
+from . import constants
+
+
+class BatchStreamHandler(logging.StreamHandler):
+
+    def handle_batch(self, records: List[logging.LogRecord]) -> None:
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+
+        with self.lock:
+            try:
+                self.stream.write(''.join(lines))
+                self.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+
+class BatchQueueListener(QueueListener):
+    """Queue listener handing the records over to the handlers in batches of up to `batch_size`."""
+
+    def __init__(self, records: queue.Queue, *handlers: BatchStreamHandler,
+                 batch_size: int = constants.LOG_BATCH_SIZE):
+        super().__init__(records, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self) -> None:
+        # wait for room in a full queue instead of failing to stop
+        self.queue.put(self._sentinel)
+
+    def handle_batch(self, records: List[logging.LogRecord]) -> None:
+        for handler in self.handlers:
+            handler.handle_batch(records)
+
+    def _monitor(self) -> None:
+        has_task_done = hasattr(self.queue, 'task_done')
+        stopped = False
+        while not stopped:
+            batch = []
+            record = self.dequeue(True)
+            while True:
+                if has_task_done:
+                    self.queue.task_done()
+                if record is self._sentinel:
+                    stopped = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+            if batch:
+                self.handle_batch(batch)
+
+
+class AsyncStreamHandler(QueueHandler):
+    """Handler writing the records to the stream on a listener thread."""
+
+    def __init__(self, stream: Optional[TextIO] = None, maxsize: int = constants.LOG_QUEUE_MAXSIZE,
+                 batch_size: int = constants.LOG_BATCH_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = BatchStreamHandler(stream)
+        self.listener = BatchQueueListener(self.queue, self.target, batch_size=batch_size)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self.listener.start()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:  # noqa: N802
+        """Records are formatted on the listener thread by the formatter of the target."""
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the arguments may change till the record is formatted
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped != self._reported_dropped:
+            dropped = self.dropped - self._reported_dropped
+            report = logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'module': 'log_handlers', 'funcName': 'enqueue',
+                'msg': f'Dropped {dropped} log records, the log queue is full',
+            })
+            try:
+                self.queue.put_nowait(report)
+                self._reported_dropped += dropped
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Write the queued records and stop the listener."""
+        if self.listener._thread is not None:  # noqa: WPS437
+            self.listener.stop()
+        self.target.close()
+        super().close()
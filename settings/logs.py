@@ -1,5 +1,6 @@
 from .config import LOG_LEVEL
 from .log_formatter import JSONFormatter
+from .log_handlers import AsyncStreamHandler
 
 LOG_CONFIG = {
     'version': 1,
@@ -15,7 +16,7 @@ LOG_CONFIG = {
     },
     'handlers': {
         'json2console': {
-          'class': 'logging.StreamHandler',
+          '()': AsyncStreamHandler,
           'formatter': 'json',
           'stream': 'ext://sys.stdout'
         },
@@ -0,0 +1,171 @@
+"""In-process caches."""
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from settings import constants
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded mapping evicting the least recently used items, with hit/miss counters."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[K, V]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._items
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        return self._items.pop(key, None)
+
+
+class StatsCache:
+    """Rendered stats by (user, period) with TTL.
+
+    Users are evicted as a whole in the LRU order; all stats of a user are
+    dropped by `invalidate` when the user's timesheet changes.
+
+    The stats are put after being read from the database, and the timesheet
+    may change meanwhile: `get` returns the generation of the user's stats,
+    which `invalidate` changes, and `put` of an older generation is skipped.
+    """
+
+    def __init__(self, max_users: int = constants.STATS_CACHE_MAX_USERS,
+                 ttl: float = constants.STATS_CACHE_TTL_SECONDS):
+        self._ttl = ttl
+        self._users: LRUCache[int, Dict[Hashable, Tuple[float, str]]] = LRUCache(max_users)
+        # the generation of a user is the count of all the invalidations when it was first asked for or changed;
+        #  a user evicted from `_generations` gets the current count, so never an earlier generation back
+        self._invalidations = 0
+        self._generations: LRUCache[int, int] = LRUCache(max_users)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def get(self, user_id: int, period_key: Hashable) -> Tuple[Optional[str], int]:
+        """Return the stats, None if not cached, and the generation to `put` the stats with."""
+        generation = self._get_generation(user_id)
+        user_stats = self._users.get(user_id) or {}
+        expires_at, stats = user_stats.get(period_key, (0, None))
+        if stats is None or expires_at < time.monotonic():
+            self.misses += 1
+            return None, generation
+
+        self.hits += 1
+        return stats, generation
+
+    def put(self, user_id: int, period_key: Hashable, stats: str, generation: int) -> None:
+        """Cache the stats unless the user is invalidated since the `get` which returned the `generation`."""
+        if self._get_generation(user_id) != generation:
+            return
+
+        user_stats = self._users.get(user_id)
+        if user_stats is None:
+            user_stats = {}
+            self._users.put(user_id, user_stats)
+        user_stats[period_key] = time.monotonic() + self._ttl, stats
+
+    def _get_generation(self, user_id: int) -> int:
+        generation = self._generations.get(user_id)
+        if generation is None:
+            generation = self._invalidations
+            self._generations.put(user_id, generation)
+        return generation
+
+    def invalidate(self, user_id: int) -> None:
+        self._users.pop(user_id)
+        self._invalidations += 1
+        self._generations.put(user_id, self._invalidations)
+
+
+class CachedUser:
+    __slots__ = ('user_id', 'interval_seconds', 'categories')
+
+    def __init__(self, user_id: int, interval_seconds: int, categories: Tuple[Tuple[int, str], ...]):
+        self.user_id = user_id
+        self.interval_seconds = interval_seconds
+        # (id, name) pairs
+        self.categories = categories
+
+    def get_category_name(self, category_id: int) -> Optional[str]:
+        for cached_category_id, name in self.categories:
+            if cached_category_id == category_id:
+                return name
+        return None
+
+
+class UserCache:
+    """Users' settings and categories, rarely changed, by user id.
+
+    Changes are written through by the code writing them to the database,
+    inactive users are evicted in the LRU order.
+    """
+
+    def __init__(self, max_users: int = constants.USER_CACHE_MAX_USERS):
+        self._users: LRUCache[int, CachedUser] = LRUCache(max_users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def hits(self) -> int:
+        return self._users.hits
+
+    @property
+    def misses(self) -> int:
+        return self._users.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self._users.hit_rate
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        return self._users.get(user_id)
+
+    def put(self, user: CachedUser) -> None:
+        self._users.put(user.user_id, user)
+
+    def set_interval(self, user_id: int, interval_seconds: int) -> None:
+        user = self._users.pop(user_id)
+        if user is not None:
+            user.interval_seconds = interval_seconds
+            self._users.put(user_id, user)
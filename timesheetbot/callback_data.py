@@ -0,0 +1,108 @@
+"""Compact callback data of the inline buttons.
+
+The data is `<action><version><field>.<field>...`: one character of the
+action, one character of the format version and the non-negative integer
+fields as URL-safe base64 of their big-endian bytes without padding. A
+64-bit id takes 11 characters, so the data keeps well within the 64 bytes
+Telegram allows for any id SQLite can give.
+
+The data comes from the client and may be forged: `decode` checks the
+number of the fields of the action and the values of the fields which are
+not ids against the ones the keyboards offer.
+
+The buttons sent before this format carry JSON or plain strings; they are
+still decoded, see `_decode_legacy`.
+"""
+import base64
+import json
+from typing import Container, Dict, Optional, Tuple
+
+import settings
+from settings import constants as const
+
+
+FILL_ACTIVITY = 'a'
+FILL_ALL_ACTIVITIES = 'f'
+SET_INTERVAL = 'i'
+GET_STATS = 's'
+ACTIONS = frozenset((FILL_ACTIVITY, FILL_ALL_ACTIVITIES, SET_INTERVAL, GET_STATS))
+
+_INTERVALS = const.INTERVALS + const.DEBUG_INTERVALS if settings.DEBUG_MODE else const.INTERVALS
+# valid values of the fields of the actions, None for any id
+ACTION_FIELDS: Dict[str, Tuple[Optional[Container[int]], ...]] = {
+    FILL_ACTIVITY: (None, None),  # activity id, category id
+    FILL_ALL_ACTIVITIES: (None, None),  # session id, category id
+    SET_INTERVAL: (frozenset(seconds for _, seconds in _INTERVALS),),
+    GET_STATS: (range(len(const.STATS_PERIODS)),),  # period index
+}
+
+VERSION = '1'
+FIELDS_SEPARATOR = '.'
+MAX_LENGTH = 64
+
+_LEGACY_STATS_PERIODS = {
+    period if isinstance(period, str) else json.dumps(period): index
+    for index, (_, period) in enumerate(const.STATS_PERIODS)
+}
+
+
+def encode_int(value: int) -> str:
+    if value < 0:
+        raise ValueError(f'Negative callback data field: {value}')
+    raw = value.to_bytes((value.bit_length() + 7) // 8 or 1, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_int(field: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(field + '=' * (-len(field) % 4))
+    except ValueError as e:
+        raise ValueError(f'Bad callback data field: {field!r}') from e
+    return int.from_bytes(raw, 'big')
+
+
+def get_prefix(action: str) -> str:
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown callback action: {action!r}')
+    return action + VERSION
+
+
+def encode(action: str, *fields: int) -> str:
+    data = get_prefix(action) + FIELDS_SEPARATOR.join(map(encode_int, fields))
+    if len(data) > MAX_LENGTH:
+        raise ValueError(f'Callback data is longer than {MAX_LENGTH} bytes: {data!r}')
+    return data
+
+
+def decode(data: str) -> Tuple[str, Tuple[int, ...]]:
+    """Return the action and the fields; raise `ValueError` on unknown or invalid data."""
+    action, version = data[:1], data[1:2]
+    if action not in ACTIONS or version != VERSION:
+        action, fields = _decode_legacy(data)
+    else:
+        encoded_fields = data[2:]
+        fields = tuple(map(decode_int, encoded_fields.split(FIELDS_SEPARATOR))) if encoded_fields else ()
+
+    _check_fields(action, fields)
+    return action, fields
+
+
+def _check_fields(action: str, fields: Tuple[int, ...]) -> None:
+    valid_values = ACTION_FIELDS[action]
+    if len(fields) != len(valid_values):
+        raise ValueError(f'Callback action {action!r} takes {len(valid_values)} fields, got {len(fields)}')
+    for value, valid in zip(fields, valid_values):
+        if valid is not None and value not in valid:
+            raise ValueError(f'Invalid field of callback action {action!r}: {value}')
+
+
+def _decode_legacy(data: str) -> Tuple[str, Tuple[int, ...]]:
+    if data.isdigit():
+        return SET_INTERVAL, (int(data),)
+    if data in _LEGACY_STATS_PERIODS:
+        return GET_STATS, (_LEGACY_STATS_PERIODS[data],)
+    try:
+        fields = json.loads(data)
+        return FILL_ACTIVITY, (int(fields['act_id']), int(fields['cat_id']))
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f'Unknown callback data: {data!r}') from e
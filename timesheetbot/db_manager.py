@@ -1,24 +1,29 @@
+import asyncio
+import functools
 import sqlite3
-from datetime import datetime, timedelta
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from logging import getLogger
 from pathlib import Path
-from typing import Tuple, List
-from uuid import uuid4 as uuid
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar, List
 
-from aiogram import types
-from pypika import Table, SQLLiteQuery, Parameter, Order, Criterion
-
-from settings.config import DB_NAME, DB_MIGRATIONS_DIR, DEBUG_MODE
+from settings.config import (
+    DB_COMMIT_MAX_WRITES, DB_COMMIT_WINDOW_MS, DB_JOURNAL_MODE, DB_MIGRATIONS_DIR, DB_NAME, DB_SYNCHRONOUS,
+    DEBUG_MODE,
+)
 from settings import constants
+from . import export, metrics, queries, utils
 
+if TYPE_CHECKING:
+    # only annotations: the maintenance commands do not import aiogram
+    from aiogram import types
 
-log = getLogger(__name__)
 
-USER = Table('user')
-CATEGORY = Table('category')
-SESSION = Table('session')
-TIMESHEET = Table('timesheet')
+log = getLogger(__name__)
 
+T = TypeVar('T')
 
 # TODO: Dataclasses for rows
 
@@ -28,100 +33,159 @@ class DoesNotExist(Exception):
 
 
 class DBManager:
-
-    def __init__(self):
-        self._con = sqlite3.Connection(DB_NAME)
+    """Queries of the bot.
+
+    Writes may be group committed: with `commit_window` > 0 a write is left in
+    the open transaction, which is committed when `commit_max_writes` writes
+    pile up, on the first write after the window closes or by `flush`. Reads
+    of the same connection see the pending writes.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, commit_window: float = 0.0,
+                 commit_max_writes: int = DB_COMMIT_MAX_WRITES,
+                 journal_mode: str = DB_JOURNAL_MODE, synchronous: str = DB_SYNCHRONOUS):
+        # The connection may be handed over to a worker thread (see `AsyncDBManager`),
+        #  callers are responsible for serializing access to it.
+        # All the statements of `queries` stay compiled in the statement cache.
+        self._con = sqlite3.Connection(db_name, check_same_thread=False, cached_statements=queries.CACHED_STATEMENTS)
         if DEBUG_MODE:
             self._con.set_trace_callback(log.debug)
         self._cursor = self._con.cursor()
+        self._cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        self._cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        self.commit_window = commit_window
+        self._commit_max_writes = commit_max_writes
+        self._pending_writes = 0
+        self._window_closes_at = 0.0
 
     def __del__(self):
+        self.flush()
         self._cursor.close()
         self._con.close()
 
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The sqlite connection, e.g. for ad hoc queries and tracing; the same serialization rules apply."""
+        return self._con
+
+    @property
+    def has_pending_writes(self) -> bool:
+        return self._pending_writes > 0
+
+    def _commit(self) -> None:
+        """Commit the write now or leave it to the group commit."""
+        now = time.monotonic()
+        if not self._pending_writes:
+            self._window_closes_at = now + self.commit_window
+        self._pending_writes += 1
+        if self._pending_writes >= self._commit_max_writes or now >= self._window_closes_at:
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit the pending writes."""
+        self._con.commit()
+        self._pending_writes = 0
+
     def _get_migration_file_paths(self) -> List[Path]:
         migrations_dir = Path(DB_MIGRATIONS_DIR)
-        migrations = sorted(migrations_dir.glob('*'))
+        migrations = sorted(migrations_dir.glob('*.sql'))
         return migrations
 
-    def migrate(self) -> None:
-        migration_paths = self._get_migration_file_paths()
-        for migration_path in migration_paths:
+    @staticmethod
+    def _get_migration_version(migration_path: Path) -> int:
+        """Version of a migration is the number prefix of its file: `003_create_indexes.sql` -> 3."""
+        version, _ = migration_path.name.split('_', 1)
+        return int(version)
+
+    def get_schema_version(self) -> int:
+        self._cursor.execute(
+            'CREATE TABLE IF NOT EXISTS schema_version (version integer PRIMARY KEY, applied_at datetime)')
+        version, = self._cursor.execute('SELECT coalesce(max(version), 0) FROM schema_version').fetchone()
+        return version
+
+    def migrate(self, target_version: Optional[int] = None) -> List[int]:
+        """Apply pending migrations (up to `target_version`, if set) and return their versions.
+
+        Every migration is applied in its own transaction together with
+        its `schema_version` record.
+        """
+        self.flush()
+        current_version = self.get_schema_version()
+        applied = []
+        for migration_path in self._get_migration_file_paths():
+            version = self._get_migration_version(migration_path)
+            if version <= current_version or (target_version is not None and version > target_version):
+                continue
+
             with migration_path.open('r', encoding='utf-8') as f:
                 sql = f.read()
-            self._cursor.executescript(sql)
-            self._con.commit()
+            try:
+                self._cursor.executescript(
+                    f'BEGIN;\n{sql}\n'
+                    f"INSERT INTO schema_version VALUES ({version}, '{datetime.now()}');\n"
+                    f'COMMIT;')
+            except sqlite3.Error:
+                if self._con.in_transaction:
+                    self._con.rollback()
+                raise
 
-    def get_category(self, category_id: int) -> tuple:
-        query = SQLLiteQuery.from_(CATEGORY).select('*') \
-            .where(CATEGORY.id == Parameter(':category_id'))
+            log.info(f'Applied migration: {migration_path.name}')
+            applied.append(version)
+
+        return applied
 
-        category = self._cursor.execute(
-            query.get_sql(), {'category_id': category_id}).fetchone()
+    def get_category(self, category_id: int) -> tuple:
+        category = self._cursor.execute(queries.GET_CATEGORY, {'category_id': category_id}).fetchone()
 
         if not category:
             raise DoesNotExist()
 
         return category
 
-    def list_categories(self, u: types.User) -> Tuple[tuple]:
-        """Get categories for current user"""
-        query = SQLLiteQuery.from_(CATEGORY).select('*').where(CATEGORY.user_telegram_id.eq(u.id))
-        categories = self._cursor.execute(query.get_sql())
+    def list_categories(self, u: 'types.User') -> Tuple[Tuple[int, str], ...]:
+        """Get (id, name) of the user's categories."""
+        categories = self._cursor.execute(queries.LIST_CATEGORIES, {'user_id': u.id})
         return tuple(categories)
 
-    def get_user(self, u: types.User) -> tuple:
-        query = SQLLiteQuery.from_(USER).select('*').where(
-            USER.telegram_id.eq(u.id))
-
-        db_user = self._cursor.execute(query.get_sql()).fetchone()
+    def get_user(self, u: 'types.User') -> tuple:
+        db_user = self._cursor.execute(queries.GET_USER, {'user_id': u.id}).fetchone()
         if not db_user:
-            raise DoesNotExist(query.get_sql())
+            raise DoesNotExist(f'User {u.id}')
 
         return db_user
 
-    def register_user_if_not_exists(self, u: types.User) -> None:
+    def get_or_register_user(self, u: 'types.User') -> Tuple[int, Tuple[Tuple[int, str], ...]]:
+        """Get (interval_seconds, categories) of the user, registering the user with the default categories first."""
         try:
-            _ = self.get_user(u)
+            _, interval_seconds, *_ = self.get_user(u)
         except DoesNotExist:
             self.register_user(u)
             self.create_default_categories(u)
+            interval_seconds = constants.DEFAULT_INTERVAL_SECONDS
 
-    def register_user(self, u: types.User) -> None:
-        columns = 'telegram_id', 'interval_seconds', 'first_name', 'last_name', 'created_at'
-        values = u.id, constants.DEFAULT_INTERVAL_SECONDS, u.first_name, u.last_name, str(datetime.now())
-        column_value_map = dict(zip(columns, values))
-        params = map(lambda col: f':{col}', columns)
-        query = SQLLiteQuery.into(USER).columns(*columns).insert(
-            *map(Parameter, params))
+        return interval_seconds, self.list_categories(u)
 
-        _ = self._cursor.execute(query.get_sql(), column_value_map)
-        self._con.commit()
+    def register_user(self, u: 'types.User') -> None:
+        values = u.id, constants.DEFAULT_INTERVAL_SECONDS, u.first_name, u.last_name, str(datetime.now())
+        _ = self._cursor.execute(queries.REGISTER_USER, dict(zip(queries.REGISTER_USER_COLUMNS, values)))
+        self._commit()
 
-    def create_default_categories(self, u: types.User) -> Tuple[Tuple[int, str]]:
+    def create_default_categories(self, u: 'types.User') -> Tuple[Tuple[int, str]]:
         categories = tuple((u.id, category_name) for category_name in constants.DEFAULT_CATEGORIES)
-        query = SQLLiteQuery.into(CATEGORY).columns(CATEGORY.user_telegram_id, CATEGORY.name).insert(*categories)
-
-        _ = self._cursor.execute(query.get_sql())
-        self._con.commit()
+        self._cursor.executemany(
+            queries.CREATE_CATEGORY, ({'user_id': user_id, 'name': name} for user_id, name in categories))
+        self._commit()
 
         return categories
 
-    def create_session(self, u: types.User):
-        columns = 'user_telegram_id', 'start_at'
-        values = u.id, str(datetime.now())
-        column_value_map = dict(zip(columns, values))
-        params = map(lambda col: f':{col}', columns)
-        query = SQLLiteQuery.into(SESSION).columns(*columns).insert(
-            *map(Parameter, params))
-
-        _ = self._cursor.execute(query.get_sql(), column_value_map)
-        self._con.commit()
+    def create_session(self, u: 'types.User'):
+        _ = self._cursor.execute(queries.CREATE_SESSION, {'user_id': u.id, 'start_at': int(time.time())})
+        self._commit()
 
         created_session_id = self._cursor.lastrowid
         return created_session_id
 
-    def get_new_or_existing_session_id(self, u: types.User) -> Tuple[int, bool]:
+    def get_new_or_existing_session_id(self, u: 'types.User') -> Tuple[int, bool]:
         try:
             existing_session = self._get_active_session(u)
         except DoesNotExist:
@@ -130,20 +194,15 @@ class DBManager:
         else:
             return existing_session[0], False
 
-    def get_last_started_session(self, u: types.User) -> int:
-        query = SQLLiteQuery().from_(SESSION).select('*') \
-            .where(SESSION.user_telegram_id.eq(Parameter(':user_id'))) \
-            .orderby(SESSION.start_at, order=Order.desc) \
-            .limit(1).get_sql()
-
-        session = self._cursor.execute(query, {'user_id': u.id}).fetchone()
+    def get_last_started_session(self, u: 'types.User') -> int:
+        session = self._cursor.execute(queries.GET_LAST_STARTED_SESSION, {'user_id': u.id}).fetchone()
 
         if not session:
             raise DoesNotExist()
 
         return session
 
-    def try_stop_session(self, u: types.User) -> bool:
+    def try_stop_session(self, u: 'types.User') -> bool:
         """Return True if session stopped or False otherwise
         that means that there is no active session to stop"""
         try:
@@ -152,120 +211,335 @@ class DBManager:
             return False
         else:
             session_id, *_ = opened_session
-            query = SQLLiteQuery.update(SESSION) \
-                .set(SESSION.stop_at, datetime.now()) \
-                .where(SESSION.id.eq(session_id))
-            self._cursor.execute(query.get_sql())
-            self._con.commit()
+            self._cursor.execute(queries.STOP_SESSION, {'session_id': session_id, 'stop_at': int(time.time())})
+            self._cursor.execute(queries.UNSCHEDULE_SESSION, {'session_id': session_id})
+            self._commit()
             return True
 
-    def get_unstopped_activity(self, activity_id: str) -> tuple:
-        column_value_map = {'activity_id': activity_id}
-        query = SQLLiteQuery.from_(TIMESHEET).select('*').where(
-            (TIMESHEET.activity_id == Parameter(':activity_id')) &
-            (TIMESHEET.default_category_id.isnull()) &
-            (TIMESHEET.user_category_id.isnull())
-        )
-
-        activity = self._cursor.execute(query.get_sql(), column_value_map).fetchone()
-        if not activity:
-            raise DoesNotExist()
-
-        return activity
-
-    def stop_activity(self, activity_id: str, category_id: int):
-        _ = self.get_unstopped_activity(activity_id)  # check existing
+    def list_open_sessions(self) -> List[tuple]:
+        """Get (session_id, user_telegram_id, interval_seconds, next_prompt_at) of all not stopped sessions.
 
-        column_value_map = {'activity_id': activity_id}
-        query = SQLLiteQuery.update(TIMESHEET).set(TIMESHEET.default_category_id, category_id).where(
-            TIMESHEET.activity_id == Parameter(':activity_id'))
+        `next_prompt_at` is None if the session was not scheduled yet.
+        """
+        return self._cursor.execute(queries.LIST_OPEN_SESSIONS).fetchall()
 
-        self._cursor.execute(query.get_sql(), column_value_map)
-        self._con.commit()
+    def set_next_prompt_times(self, session_deadlines: Iterable[Tuple[int, float]]) -> None:
+        """Store (session_id, UNIX timestamp) pairs of the next session prompts; stopped sessions are skipped."""
+        rows = ({'session_id': session_id, 'next_prompt_at': round(deadline)}
+                for session_id, deadline in session_deadlines)
+        self._cursor.executemany(queries.SET_NEXT_PROMPT_TIME, rows)
+        self._commit()
 
-        if self._cursor.rowcount > 1:
-            raise RuntimeError()
+    def stop_activity(self, u: 'types.User', activity_id: int, category_id: int) -> None:
+        """Fill the user's activity with the user's category.
 
-    def start_activity(self, session_id: int, interval_seconds: int) -> str:
-        finish = datetime.now()
-        start = finish - timedelta(0, interval_seconds)
-        columns = 'activity_id', 'session_id', 'start', 'finish'
-        values = str(uuid()), session_id, str(start), str(finish)
-        column_value_map = dict(zip(columns, values))
-        params = map(lambda col: f':{col}', columns)
-        query = SQLLiteQuery.into(TIMESHEET).columns(*columns).insert(
-            *map(Parameter, params))
+        Raise DoesNotExist if the activity is already filled, or the activity or the category is not of the user.
+        """
+        params = {'activity_id': activity_id, 'user_id': u.id, 'category_id': category_id}
+        activity = self._cursor.execute(queries.STOP_ACTIVITY, params).fetchall()
+        if not activity:
+            raise DoesNotExist()
 
-        _ = self._cursor.execute(query.get_sql(), column_value_map)
-        self._con.commit()
+        self._add_to_daily_stats(u.id, category_id, activity)
+        self._commit()
+
+    def stop_unfilled_activities(self, u: 'types.User', session_id: int, category_id: int) -> int:
+        """Fill all the unfilled activities of the user's session with the category; return their number."""
+        params = {'session_id': session_id, 'user_id': u.id, 'category_id': category_id}
+        activities = self._cursor.execute(queries.STOP_UNFILLED_ACTIVITIES, params).fetchall()
+        if activities:
+            self._add_to_daily_stats(u.id, category_id, activities)
+            self._commit()
+        return len(activities)
+
+    def _add_to_daily_stats(self, user_id: int, category_id: int, activities: Iterable[Tuple[int, int]]) -> None:
+        """Add (start, finish) activities of the user's category to the daily stats."""
+        day_seconds = defaultdict(int)
+        for start, finish in activities:
+            for day, seconds in utils.split_by_days(start, finish):
+                day_seconds[day] += seconds
+        params = ({'user_id': user_id, 'category_id': category_id, 'day': day, 'seconds': seconds}
+                  for day, seconds in day_seconds.items())
+        self._cursor.executemany(queries.ADD_TO_DAILY_STATS, params)
+
+    def start_activity(self, session_id: int, interval_seconds: int) -> Tuple[int, int, int]:
+        """Start an activity of the last `interval_seconds` in the session.
+
+        Return (activity_id, start, finish); raise DoesNotExist if the session is stopped.
+        """
+        finish = int(time.time())
+        params = {'session_id': session_id, 'start': finish - interval_seconds, 'finish': finish}
+        activity = self._cursor.execute(queries.START_ACTIVITY, params).fetchall()
+        if not activity:
+            raise DoesNotExist()
 
-        return column_value_map['activity_id']
+        self._commit()
+        return activity[0]
 
-    def set_interval_seconds(self, u: types.User, interval_seconds: int) -> int:
-        query = SQLLiteQuery.update(USER) \
-            .set(USER.interval_seconds, interval_seconds) \
-            .where(USER.telegram_id.eq(u.id))
-
-        _ = self._cursor.execute(query.get_sql())
-        self._con.commit()
+    def set_interval_seconds(self, u: 'types.User', interval_seconds: int) -> int:
+        _ = self._cursor.execute(queries.SET_INTERVAL_SECONDS, {'user_id': u.id, 'interval_seconds': interval_seconds})
+        self._commit()
 
         return self._cursor.rowcount
 
-    def get_interval_seconds(self, u: types.User) -> int:
-        db_user = self.get_user(u)
-        # TODO dataclass?
-        interval = db_user[1]
-        return interval
-
-    def has_active_session(self, u: types.User) -> bool:
-        try:
-            self._get_active_session(u)
-            return True
-        except DoesNotExist:
-            return False
-
-    def _get_active_session(self, u: types.User) -> tuple:
-        query = SQLLiteQuery.from_(SESSION).select(SESSION.id) \
-            .where(SESSION.user_telegram_id.eq(u.id)) \
-            .where(SESSION.stop_at.isnull())
-
-        session = self._cursor.execute(query.get_sql()).fetchone()
+    def _get_active_session(self, u: 'types.User') -> tuple:
+        session = self._cursor.execute(queries.GET_ACTIVE_SESSION, {'user_id': u.id}).fetchone()
         if not session:
-            raise DoesNotExist(query.get_sql())
+            raise DoesNotExist(f'Active session of user {u.id}')
 
         return session
 
-    def get_timesheet_frame_by_sessions(self, session_ids: tuple) -> List[tuple]:
-        if not session_ids:
-            raise DoesNotExist()
+    def get_category_durations(self, u: 'types.User', start: datetime, finish: datetime) -> List[Tuple[str, int]]:
+        """Sum up seconds of the user's filled activities by categories within the [start, finish) period.
 
-        query = SQLLiteQuery().from_(TIMESHEET) \
-            .inner_join(CATEGORY).on(Criterion.all((
-                TIMESHEET.default_category_id.notnull(),
-                TIMESHEET.default_category_id.eq(CATEGORY.id),
-            ))) \
-            .select(
-                TIMESHEET.star,
-                # (TIMESHEET.finish - TIMESHEET.start).as_('activity_duration'),  # datetime in sqlite in str
-                CATEGORY.name) \
-            .where(TIMESHEET.session_id.isin(session_ids)).get_sql()
+        Activities crossing the period bounds are clipped.
+        """
+        params = {'user_id': u.id, 't0': int(start.timestamp()), 't1': int(finish.timestamp())}
+        return self._cursor.execute(queries.GET_CATEGORY_DURATIONS, params).fetchall()
 
-        timesheet_frame = self._cursor.execute(query).fetchall()
+    def get_session_category_durations(self, session_id: int) -> List[Tuple[str, int]]:
+        """Sum up seconds of the session's filled activities by categories."""
+        return self._cursor.execute(queries.GET_SESSION_CATEGORY_DURATIONS, {'session_id': session_id}).fetchall()
 
-        if not timesheet_frame:
-            raise DoesNotExist()
+    def get_daily_category_durations(self, u: 'types.User', day_start: datetime) -> List[Tuple[str, int]]:
+        """Sum up seconds of the user's filled activities by categories starting from the `day_start` day."""
+        params = {'user_id': u.id, 'day': int(day_start.timestamp())}
+        return self._cursor.execute(queries.GET_DAILY_CATEGORY_DURATIONS, params).fetchall()
 
-        return timesheet_frame
+    def iter_timesheet(self, user_id: Optional[int] = None) -> Iterator[export.Row]:
+        """Yield (activity_id, user_telegram_id, session_id, start, finish, category name) of all the activities.
 
-    def filter_user_sessions_by_start(self, u: types.User, start: datetime) -> List[tuple]:
-        params = {'t0': start, ':user_id': u.id}
-        query = '''
-            select * from session where :t0 <= start_at
-        '''
-
-        sessions_frame = self._cursor.execute(query, params).fetchall()
-
-        if not sessions_frame:
-            raise DoesNotExist()
+        Only the activities of the user, if given, ordered by session. The rows
+        are read from a cursor of their own as they are consumed, not fetched all at once.
+        """
+        if user_id is None:
+            cursor = self._con.execute(queries.EXPORT_TIMESHEET)
+        else:
+            cursor = self._con.execute(queries.EXPORT_USER_TIMESHEET, {'user_id': user_id})
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def export_timesheet(self, path: Path, user_id: Optional[int] = None, fmt: str = 'csv', compress: bool = False,
+                         max_bytes: int = constants.EXPORT_MAX_FILE_BYTES) -> List[Path]:
+        """Export the activities (of the user) to files, see `export.export_timesheet`; return their paths."""
+        return export.export_timesheet(self.iter_timesheet(user_id), path, fmt, compress, max_bytes)
+
+    def _calc_user_daily_stats(self, user_id: int) -> Dict[Tuple[int, int], int]:
+        """Calculate {(day, category_id): seconds} of the user from the raw timesheet."""
+        daily_stats = defaultdict(int)
+        for category_id, start, finish in self._con.execute(queries.CALC_USER_DAILY_STATS, {'user_id': user_id}):
+            for day, seconds in utils.split_by_days(start, finish):
+                daily_stats[day, category_id] += seconds
+        return daily_stats
+
+    def _list_user_ids(self) -> List[int]:
+        return [user_id for user_id, in self._cursor.execute(queries.LIST_USER_IDS)]
+
+    def rebuild_daily_stats(self) -> int:
+        """Rebuild `daily_stats` from the raw timesheet user by user, return the number of users.
+
+        Every user is rebuilt in its own transaction, so the bot can keep working.
+        """
+        self.flush()
+        user_ids = self._list_user_ids()
+        for user_id in user_ids:
+            # lock before reading not to miss activities stopped meanwhile
+            self._cursor.execute('begin immediate')
+            daily_stats = self._calc_user_daily_stats(user_id)
+            self._cursor.execute(queries.DELETE_USER_DAILY_STATS, {'user_id': user_id})
+            self._cursor.executemany(queries.INSERT_DAILY_STATS, (
+                {'user_id': user_id, 'day': day, 'category_id': category_id, 'seconds': seconds}
+                for (day, category_id), seconds in daily_stats.items()))
+            self._con.commit()
 
-        return sessions_frame
+        return len(user_ids)
+
+    def check_daily_stats(self) -> List[Tuple[int, int, int, int, int]]:
+        """Compare `daily_stats` with the raw timesheet.
+
+        Return mismatches: (user_telegram_id, day, category_id, expected seconds, stored seconds).
+        """
+        mismatches = []
+        for user_id in self._list_user_ids():
+            expected = self._calc_user_daily_stats(user_id)
+            stored = {
+                (day, category_id): seconds for day, category_id, seconds in self._con.execute(
+                    queries.LIST_USER_DAILY_STATS, {'user_id': user_id})
+            }
+            for day, category_id in sorted(expected.keys() | stored.keys()):
+                expected_seconds = expected.get((day, category_id), 0)
+                stored_seconds = stored.get((day, category_id), 0)
+                if expected_seconds != stored_seconds:
+                    mismatches.append((user_id, day, category_id, expected_seconds, stored_seconds))
+
+        return mismatches
+
+    def compact_legacy_rows(self, chunk_size: int = constants.COMPACT_CHUNK_SIZE) -> int:
+        """Convert a chunk of rows stored in the format preceding the 004 migration.
+
+        Activities are moved from `timesheet_legacy` to `timesheet` and session
+        datetimes are converted to UNIX timestamps. Each chunk is a short
+        transaction, so the bot can keep working in between. Return the number
+        of converted rows: 0 means the database is compacted and the legacy table
+        is dropped.
+        """
+        converted = 0
+        has_legacy_table = self._cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'timesheet_legacy'").fetchone()
+
+        if has_legacy_table:
+            last_rowid, = self._cursor.execute(
+                'SELECT max(rowid) FROM (SELECT rowid FROM timesheet_legacy ORDER BY rowid LIMIT ?)', (chunk_size,),
+            ).fetchone()
+            if last_rowid is None:
+                self._cursor.execute('DROP TABLE timesheet_legacy')
+            else:
+                # naive datetimes were stored in local time
+                self._cursor.execute("""
+                    INSERT INTO timesheet (session_id, user_category_id, default_category_id, start, finish)
+                    SELECT session_id, user_category_id, default_category_id,
+                           CAST(strftime('%s', start, 'utc') AS integer),
+                           CAST(strftime('%s', finish, 'utc') AS integer)
+                    FROM timesheet_legacy WHERE rowid <= ? ORDER BY rowid
+                """, (last_rowid,))
+                converted += self._cursor.rowcount
+                self._cursor.execute('DELETE FROM timesheet_legacy WHERE rowid <= ?', (last_rowid,))
+
+        self._cursor.execute("""
+            UPDATE session SET
+                start_at = CAST(strftime('%s', start_at, 'utc') AS integer),
+                stop_at = CASE typeof(stop_at)
+                    WHEN 'text' THEN CAST(strftime('%s', stop_at, 'utc') AS integer)
+                    ELSE stop_at END
+            WHERE id IN (
+                SELECT id FROM session WHERE typeof(start_at) = 'text' OR typeof(stop_at) = 'text' LIMIT ?)
+        """, (chunk_size,))
+        converted += self._cursor.rowcount
+        self.flush()
+
+        return converted
+
+    def vacuum(self) -> None:
+        self.flush()
+        self._cursor.execute('VACUUM')
+
+
+class AsyncDBManager:
+    """Asyncio variant of `DBManager` with the same methods as coroutines.
+
+    All queries are run on a single dedicated worker thread, so the event
+    loop never blocks on disk and the sqlite connection is never used
+    concurrently. The database is connected on the first query, not when
+    the manager is created.
+
+    Exports are the exception: an export of a long history would hold up
+    every query behind it, so it reads from a connection of its own on a
+    thread of its own, concurrently with the worker thread in the WAL mode.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, commit_window: float = DB_COMMIT_WINDOW_MS / 1000, **db_options):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self._export_executor = ThreadPoolExecutor(max_workers=constants.EXPORT_WORKERS,
+                                                   thread_name_prefix='db-export')
+        self._db_args = (db_name, commit_window)
+        self._db_options = db_options
+        self._connected_db: Optional[DBManager] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._is_shut_down = False
+
+    @property
+    def _db(self) -> DBManager:
+        if self._connected_db is None:
+            self._connected_db = DBManager(*self._db_args, **self._db_options)
+        return self._connected_db
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self._db, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        histogram = metrics.query_seconds.get(name)
+
+        def timed_call(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started_at)
+
+        @functools.wraps(method)
+        async def run_in_executor(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            call = functools.partial(timed_call, *args, **kwargs)
+            try:
+                return await loop.run_in_executor(self._executor, call)
+            finally:
+                self._schedule_flush(loop)
+
+        setattr(self, name, run_in_executor)
+        return run_in_executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Run `func(db, *args)` with the `DBManager` on the worker thread, e.g. for ad hoc queries."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, self._db, *args))
+        finally:
+            self._schedule_flush(loop)
+
+    async def export_timesheet(self, path: Path, user_id: Optional[int] = None, fmt: str = 'csv',
+                               compress: bool = False, max_bytes: int = constants.EXPORT_MAX_FILE_BYTES) -> List[Path]:
+        """`DBManager.export_timesheet` from a connection of its own, see the class docstring."""
+        # the export connection does not see the writes pending in the commit window
+        await self.flush()
+        call = functools.partial(self._export_timesheet, path, user_id, fmt, compress, max_bytes)
+        return await asyncio.get_running_loop().run_in_executor(self._export_executor, call)
+
+    def _export_timesheet(self, *args) -> List[Path]:
+        started_at = time.perf_counter()
+        try:
+            return DBManager(self._db_args[0], **self._db_options).export_timesheet(*args)
+        finally:
+            metrics.query_seconds.get('export_timesheet').observe(time.perf_counter() - started_at)
+
+    def set_commit_window(self, commit_window: float) -> None:
+        """Change the group commit window; 0 commits every write."""
+        self._db_args = (self._db_args[0], commit_window)
+        if self._connected_db is not None:
+            self._connected_db.commit_window = commit_window
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Make sure the pending writes are committed when the commit window closes."""
+        if self._flush_handle is None and not self._is_shut_down and self._db.has_pending_writes:
+            self._flush_handle = loop.call_later(self._db.commit_window, self._start_flush, loop)
+
+    def _start_flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._flush_handle = None
+        self._flush_task = loop.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            await self.flush()
+        except sqlite3.Error:
+            log.exception('Failed to commit the pending writes')
+
+    def shutdown(self) -> None:
+        """Wait for the queued queries, commit the pending writes and stop the worker thread."""
+        # the queries in flight do not schedule flushes to the stopped worker thread
+        self._is_shut_down = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._executor.shutdown(wait=True)
+        # the worker thread is stopped: the connection is free to use here
+        if self._connected_db is not None:
+            self._connected_db.flush()
+        self._export_executor.shutdown(wait=True, cancel_futures=True)
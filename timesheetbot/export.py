@@ -0,0 +1,177 @@
+"""Raw timesheet export to CSV or JSON Lines.
+
+The rows are streamed through a generator pipeline: the database cursor,
+records, encoded lines, files. Memory does not grow with the history. The
+lines are written in batches of `EXPORT_WRITE_BUFFER_BYTES`, optionally
+gzip-compressed. A new file is started before a batch would take the file
+past `max_bytes`, so every file can be sent to Telegram; every CSV file has
+its own header.
+"""
+import csv
+import gzip
+import json
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from settings import constants
+
+COLUMNS = ('activity_id', 'user_id', 'session_id', 'start', 'finish', 'seconds', 'category')
+
+# (activity_id, user_telegram_id, session_id, start, finish, category name), see `DBManager.iter_timesheet`
+Row = Tuple[int, int, int, int, int, Optional[str]]
+Record = Tuple[int, int, int, str, str, int, Optional[str]]
+
+
+def iter_records(rows: Iterable[Row]) -> Iterator[Record]:
+    """Convert the rows to records of `COLUMNS` with the times in ISO 8601, UTC."""
+    for activity_id, user_id, session_id, start, finish, category in rows:
+        yield (activity_id, user_id, session_id,
+               datetime.fromtimestamp(start, timezone.utc).isoformat(),
+               datetime.fromtimestamp(finish, timezone.utc).isoformat(),
+               finish - start, category)
+
+
+class _LineBuffer:
+    """Stream of one line for `csv.writer`."""
+
+    line = ''
+
+    def write(self, line: str) -> None:
+        self.line = line
+
+
+def iter_csv_lines(records: Iterable[Record]) -> Iterator[str]:
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow(record)
+        yield buffer.line
+
+
+def iter_jsonl_lines(records: Iterable[Record]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False) + '\n'
+
+
+LINE_FORMATTERS = {
+    'csv': iter_csv_lines,
+    'jsonl': iter_jsonl_lines,
+}
+
+
+def get_header(fmt: str) -> str:
+    """Header line to start every file of the format with."""
+    if fmt == 'csv':
+        return next(iter_csv_lines((COLUMNS,)))
+    return ''
+
+
+def iter_batches(lines: Iterable[str], batch_bytes: int = constants.EXPORT_WRITE_BUFFER_BYTES) -> Iterator[bytes]:
+    """Join the encoded lines into batches of about `batch_bytes`."""
+    batch: List[bytes] = []
+    size = 0
+    for line in lines:
+        encoded = line.encode()
+        batch.append(encoded)
+        size += len(encoded)
+        if size >= batch_bytes:
+            yield b''.join(batch)
+            batch.clear()
+            size = 0
+    if batch:
+        yield b''.join(batch)
+
+
+class _File:
+    """Export file starting with the header; `size` is exact after every write."""
+
+    # the gzip trailer and the deflate block headers of a batch
+    GZIP_OVERHEAD_BYTES = 1024
+
+    def __init__(self, path: Path, compress: bool, header: bytes):
+        self.path = path
+        self._raw: IO[bytes] = path.open('wb')
+        self._gzip = gzip.GzipFile(
+            filename='', mode='wb', compresslevel=constants.EXPORT_GZIP_LEVEL, fileobj=self._raw,
+        ) if compress else None
+        self.overhead = self.GZIP_OVERHEAD_BYTES if compress else 0
+        if header:
+            self._write(header)
+        self.empty = True
+
+    @property
+    def size(self) -> int:
+        return self._raw.tell()
+
+    def _write(self, data: bytes) -> None:
+        if self._gzip is None:
+            self._raw.write(data)
+        else:
+            self._gzip.write(data)
+            # push the compressed data out to the file to know its size
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def write(self, data: bytes) -> None:
+        self._write(data)
+        self.empty = False
+
+    def fits(self, data: bytes, max_bytes: int) -> bool:
+        # compressed, the data take less than their length
+        return self.size + len(data) + self.overhead <= max_bytes
+
+    def close(self) -> None:
+        if self._gzip is not None:
+            self._gzip.close()
+        self._raw.close()
+
+
+def write_files(lines: Iterable[str], path: Path, header: str = '', compress: bool = False,
+                max_bytes: int = constants.EXPORT_MAX_FILE_BYTES) -> List[Path]:
+    """Write the lines to `path`, split into files of at most `max_bytes`; return the paths of the files.
+
+    With `compress` ".gz" is appended to the names. If the lines take more
+    than one file, the files are named `<stem>.part<N><suffix>`.
+    """
+    suffix = path.suffix + ('.gz' if compress else '')
+    header_bytes = header.encode()
+    parts = [_File(path.with_name(f'{path.stem}.part1{suffix}'), compress, header_bytes)]
+    try:
+        for batch in iter_batches(lines):
+            part = parts[-1]
+            # a batch bigger than `max_bytes` still gets a file of its own
+            if not part.empty and not part.fits(batch, max_bytes):
+                part.close()
+                part = _File(path.with_name(f'{path.stem}.part{len(parts) + 1}{suffix}'), compress, header_bytes)
+                parts.append(part)
+            part.write(batch)
+    finally:
+        parts[-1].close()
+
+    if len(parts) == 1:
+        return [parts[0].path.rename(path.with_name(path.stem + suffix))]
+    return [part.path for part in parts]
+
+
+def export_timesheet(rows: Iterable[Row], path: Path, fmt: str = 'csv', compress: bool = False,
+                     max_bytes: int = constants.EXPORT_MAX_FILE_BYTES) -> List[Path]:
+    """Write the timesheet rows in the format to `path` without a suffix; return the paths of the files.
+
+    See `write_files`.
+    """
+    lines = LINE_FORMATTERS[fmt](iter_records(rows))
+    return write_files(lines, path.with_suffix(f'.{fmt}'), get_header(fmt), compress, max_bytes)
+
+
+def parse_options(args: str) -> Tuple[str, bool]:
+    """Parse "[csv|jsonl] [gz]" arguments of the bot command into (format, compress); raise ValueError."""
+    fmt, compress = constants.EXPORT_FORMATS[0], False
+    for arg in args.lower().split():
+        if arg in constants.EXPORT_FORMATS:
+            fmt = arg
+        elif arg in ('gz', 'gzip'):
+            compress = True
+        else:
+            raise ValueError(f'Unknown export option: {arg!r}')
+    return fmt, compress
@@ -0,0 +1,105 @@
+"""Reply markups of the bot.
+
+Static markups are built once. The categories keyboard of a prompt differs
+from the previous prompt of the user only in the activity id, so it is
+serialized once per category set and the activity id is spliced into the
+serialized JSON.
+
+Callback data of the buttons is encoded by `callback_data`.
+"""
+import functools
+import json
+from typing import Iterable, Tuple
+
+from aiogram import types
+import more_itertools
+
+import settings
+from settings import constants as const
+from . import callback_data
+
+
+# a character which is never a part of a category name
+_ACTIVITY_ID_PLACEHOLDER = '\x1a'
+_SERIALIZED_PLACEHOLDER = json.dumps(_ACTIVITY_ID_PLACEHOLDER)[1:-1]
+CATEGORY_CALLBACK_TEMPLATE = '{prefix}{activity_id}{separator}{category_id}'
+
+
+def split_buttons_on_rows(btns: Iterable[types.InlineKeyboardButton]
+                          ) -> types.InlineKeyboardMarkup:
+    btns_by_rows = more_itertools.chunked(btns, const.MAX_ROW_BUTTONS)
+    buttons = types.InlineKeyboardMarkup()
+    for btns in btns_by_rows:
+        buttons.row(*btns)
+    return buttons
+
+
+def _make_navigation_keyboard() -> types.ReplyKeyboardMarkup:
+    btn_start = types.KeyboardButton('Старт')
+    btn_stop = types.KeyboardButton('Стоп')
+    btn_change_step = types.KeyboardButton('Изменить интервал')
+    btn_statistic = types.KeyboardButton('Статистика >>')
+
+    navigation_kb = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    navigation_kb.row(btn_start, btn_stop).row(btn_change_step, btn_statistic)
+    return navigation_kb
+
+
+def _make_interval_buttons(intervals: Iterable[Tuple[str, int]]) -> Tuple[types.InlineKeyboardButton, ...]:
+    return tuple(
+        types.InlineKeyboardButton(name, callback_data=callback_data.encode(callback_data.SET_INTERVAL, seconds))
+        for name, seconds in intervals
+    )
+
+
+def _make_interval_keyboard() -> types.InlineKeyboardMarkup:
+    buttons = types.InlineKeyboardMarkup().row(*_make_interval_buttons(const.INTERVALS))
+    if settings.DEBUG_MODE:
+        buttons.row(*_make_interval_buttons(const.DEBUG_INTERVALS))
+    return buttons
+
+
+def _make_stats_keyboard() -> types.InlineKeyboardMarkup:
+    btns = iter([
+        types.InlineKeyboardButton(name, callback_data=callback_data.encode(callback_data.GET_STATS, index))
+        for index, (name, _) in enumerate(const.STATS_PERIODS)
+    ])
+    buttons = types.InlineKeyboardMarkup()
+    for row_size in const.STATS_KEYBOARD_ROWS:
+        buttons.row(*more_itertools.take(row_size, btns))
+    return buttons
+
+
+NAVIGATION_KEYBOARD = _make_navigation_keyboard()
+INTERVAL_KEYBOARD = _make_interval_keyboard()
+STATS_KEYBOARD = _make_stats_keyboard()
+
+
+@functools.lru_cache(maxsize=const.USER_CACHE_MAX_USERS)
+def _get_categories_keyboard_parts(categories: Tuple[Tuple[int, str], ...]) -> Tuple[str, ...]:
+    """Serialized keyboard of the categories split by the activity id placeholders.
+
+    The categories tuple is the key: any change of the user's categories makes a new keyboard.
+    """
+    category_btns = (
+        types.InlineKeyboardButton(name, callback_data=CATEGORY_CALLBACK_TEMPLATE.format(
+            prefix=callback_data.get_prefix(callback_data.FILL_ACTIVITY), activity_id=_ACTIVITY_ID_PLACEHOLDER,
+            separator=callback_data.FIELDS_SEPARATOR, category_id=callback_data.encode_int(category_id)))
+        for category_id, name in categories
+    )
+    keyboard = json.dumps(split_buttons_on_rows(category_btns).to_python())
+    return tuple(keyboard.split(_SERIALIZED_PLACEHOLDER))
+
+
+def get_categories_keyboard(categories: Tuple[Tuple[int, str], ...], activity_id: int) -> str:
+    """Serialized inline keyboard to fill the activity with one of the categories."""
+    return callback_data.encode_int(activity_id).join(_get_categories_keyboard_parts(categories))
+
+
+def get_fill_all_keyboard(categories: Tuple[Tuple[int, str], ...], session_id: int) -> types.InlineKeyboardMarkup:
+    """Inline keyboard to fill all the unfilled activities of the session with one of the categories."""
+    return split_buttons_on_rows(
+        types.InlineKeyboardButton(
+            name, callback_data=callback_data.encode(callback_data.FILL_ALL_ACTIVITIES, session_id, category_id))
+        for category_id, name in categories
+    )
@@ -4,6 +4,7 @@ _base_cmds = {
     'help': 'вывести это сообщение',
     'list': 'список текущих категорий',
     'buttons': 'вывести кнопки управления ботом',
+    'export': 'выгрузить таймшит файлом: /export [csv|jsonl] [gz]',
     # TODO: DELETE or not DELETE category
     # 'add': ('добавить категорию. Ввести название новой категории,'
     #         ' например: "Проект X". При следующем ответе боту'
@@ -45,6 +46,8 @@ WELCOME = (
     f'{_base_cmds_s}\n\n'
 )
 
+EXPORT_USAGE = 'Формат выгрузки: /export [csv|jsonl] [gz], например: /export jsonl gz'
+
 FIRST_BOT_MSG = 'Бот пришлет первое сообщение в {time}.'
 
 CLOSE_SESSION_PLS = 'Обнаружена незавершенная сессия.' \
@@ -0,0 +1,231 @@
+"""In-process metrics served in the Prometheus text format.
+
+Histograms have fixed buckets: an observation is a bisect and a few
+additions, cheap enough to time every handler and every query in
+production. Gauges and counters kept by other objects (outbox depth, cache
+hits) are not copied here: they are read by callbacks on a scrape.
+
+The metrics are served on a local HTTP endpoint: `/metrics` in the
+Prometheus text format and `/stats` as JSON with the latency quantiles
+estimated from the buckets, see `manage.py stats`.
+"""
+import bisect
+import math
+from logging import getLogger
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Union
+
+from settings import constants
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+log = getLogger(__name__)
+
+Value = Union[float, Dict[str, float]]
+
+QUANTILES = (0.5, 0.9, 0.99)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(**labels: str) -> str:
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items() if value is not None)
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        # the last bucket is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate the quantile interpolating within its bucket, as Prometheus `histogram_quantile` does."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                if index == len(self.bounds):  # beyond the last bound
+                    return lower
+                return lower + (self.bounds[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def summary(self) -> Dict[str, float]:
+        summary = {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0}
+        summary.update((f'p{round(q * 100)}', self.quantile(q)) for q in QUANTILES)
+        return summary
+
+
+class HistogramFamily:
+    """Histograms of a metric by the value of its label."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None,
+                 buckets: Sequence[float] = constants.METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._buckets = tuple(buckets)
+        self._histograms: Dict[str, Histogram] = {}
+
+    def get(self, label_value: str = '') -> Histogram:
+        histogram = self._histograms.get(label_value)
+        if histogram is None:
+            histogram = self._histograms[label_value] = Histogram(self._buckets)
+        return histogram
+
+    def observe(self, value: float) -> None:
+        """Observe the value of the metric without a label."""
+        self.get().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for label_value, histogram in sorted(self._histograms.items()):
+            labels = {self.label: label_value} if self.label else {}
+            cumulative = 0
+            for bound, count in zip(self._buckets + (math.inf,), histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(**labels, le=_format_value(bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(**labels)} {_format_value(histogram.sum)}')
+            lines.append(f'{self.name}_count{_format_labels(**labels)} {histogram.count}')
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {label_value: histogram.summary() for label_value, histogram in sorted(self._histograms.items())}
+
+
+class Sampled:
+    """Gauge or counter read by `read` on a scrape; `read` returns a value or values by the label value."""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Value], label: Optional[str] = None,
+                 type_: str = 'gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.type = type_
+        self._read = read
+
+    def _values(self) -> Dict[str, float]:
+        value = self._read()
+        return value if isinstance(value, dict) else {'': value}
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(**({self.label: key} if self.label else {}))} {_format_value(value)}'
+                for key, value in sorted(self._values().items())]
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(sorted(self._values().items()))
+
+
+Metric = Union[HistogramFamily, Sampled]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def histogram(self, name: str, help_text: str, label: Optional[str] = None,
+                  buckets: Sequence[float] = constants.METRICS_LATENCY_BUCKETS) -> HistogramFamily:
+        family = self._metrics[name] = HistogramFamily(name, help_text, label, buckets)
+        return family
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Value], label: Optional[str] = None) -> None:
+        """Register the gauge, replacing the one with the same name."""
+        self._metrics[name] = Sampled(name, help_text, read, label)
+
+    def counter(self, name: str, help_text: str, read: Callable[[], Value], label: Optional[str] = None) -> None:
+        """Register the counter, replacing the one with the same name."""
+        self._metrics[name] = Sampled(name, help_text, read, label, type_='counter')
+
+    def render(self) -> str:
+        """All the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                rendered = metric.render()
+            except Exception:
+                log.exception(f'Failed to read metric {metric.name}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(rendered)
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, dict]:
+        snapshot = {}
+        for name, metric in self._metrics.items():
+            try:
+                values = metric.snapshot()
+            except Exception:
+                log.exception(f'Failed to read metric {name}')
+                continue
+            snapshot[name] = {'type': metric.type, 'help': metric.help_text, 'label': metric.label, 'values': values}
+        return snapshot
+
+
+registry = MetricsRegistry()
+
+handler_seconds = registry.histogram(
+    'timesheetbot_handler_seconds', 'Time of handling an update by the handler', label='handler')
+query_seconds = registry.histogram(
+    'timesheetbot_query_seconds', 'Time of a database method on the database thread', label='query')
+scheduler_lag_seconds = registry.histogram(
+    'timesheetbot_scheduler_lag_seconds', 'Delay of the prompt dispatch past its planned time',
+    buckets=constants.METRICS_LAG_BUCKETS)
+
+
+def make_app(metrics: MetricsRegistry = registry) -> 'web.Application':
+    # imported here: the histograms are used by the modules which do not serve HTTP, e.g. `db_manager`
+    from aiohttp import web
+
+    async def get_metrics(_: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def get_stats(_: web.Request) -> web.Response:
+        return web.json_response(metrics.snapshot())
+
+    app = web.Application()
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+async def start_server(host: str, port: int, metrics: MetricsRegistry = registry) -> Optional['web.AppRunner']:
+    """Serve the metrics on `host:port` in the background; return None if the port is not available."""
+    from aiohttp import web
+
+    runner = web.AppRunner(make_app(metrics), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        log.exception(f'Failed to serve metrics on {host}:{port}')
+        await runner.cleanup()
+        return None
+    log.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return runner
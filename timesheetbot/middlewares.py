@@ -1,13 +1,21 @@
 """Аутентификация — пропускаем сообщения только от определенных Telegram аккаунтов.
 
 Любой пользователь имеет доступ, если белый список не задан.
+
+Метрики — время обработки обновлений по обработчикам.
 """
-from typing import Iterable
+import time
+from typing import Any, Dict, Iterable, List
 
 from aiogram import types
-from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.handler import CancelHandler, ctx_data, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
+from . import metrics
+
+HANDLER_KEY = 'metrics_handler'
+STARTED_AT_KEY = 'metrics_started_at'
+
 
 class AccessMiddleware(BaseMiddleware):
     def __init__(self, user_id_white_list: Iterable[int]):
@@ -21,3 +29,39 @@ class AccessMiddleware(BaseMiddleware):
         if access_denied:
             await message.answer("Access Denied")
             raise CancelHandler()
+
+
+def set_handler_name(name: str) -> None:
+    """Account the update to the handler `name`, e.g. a handler a router handler passes the update to."""
+    data = ctx_data.get()
+    if data is not None and HANDLER_KEY in data:
+        data[HANDLER_KEY] = name
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Observes the time of the handlers of messages and callback queries; updates cancelled before are not timed."""
+
+    @staticmethod
+    def _start(data: Dict[str, Any]) -> None:
+        data[HANDLER_KEY] = current_handler.get().__name__
+        data[STARTED_AT_KEY] = time.perf_counter()
+
+    @staticmethod
+    def _observe(data: Dict[str, Any]) -> None:
+        started_at = data.get(STARTED_AT_KEY)
+        if started_at is not None:
+            metrics.handler_seconds.get(data[HANDLER_KEY]).observe(time.perf_counter() - started_at)
+
+    async def on_process_message(self, message: types.Message, data: Dict[str, Any]) -> None:
+        self._start(data)
+
+    async def on_post_process_message(self, message: types.Message, results: List[Any],
+                                      data: Dict[str, Any]) -> None:
+        self._observe(data)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: Dict[str, Any]) -> None:
+        self._start(data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results: List[Any],
+                                             data: Dict[str, Any]) -> None:
+        self._observe(data)
@@ -0,0 +1,276 @@
+"""Outbound queue of Bot API calls paced to Telegram rate limits.
+
+All messages go through one `Outbox`. The calls are paced by token buckets:
+a global one and one per chat. Chats with pending messages wait either in
+the ready heap (ordered by priority, so interactive replies go before periodic
+prompts) or in the delayed heap until their chat bucket refills. The messages
+of a chat are sent in the order they were queued: a chat has at most one call
+in flight and is scheduled again when the call is done.
+
+A "retry after" response pauses both the chat bucket and the global one:
+Telegram answers it when the bot as a whole is over the limit too, and the
+calls to the other chats would only get more of them.
+
+The number of pending calls is bounded: when the queue is full, periodic
+prompts are dropped (and counted), interactive replies wait for a free slot.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from logging import getLogger
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from settings import constants
+
+
+log = getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PERIODIC = 1
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait for a token."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        """Take all tokens for the next `seconds`, e.g. on a "retry after" response.
+
+        Overlapping pauses do not add up.
+        """
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundCall:
+    __slots__ = ('priority', 'chat_id', 'method', 'kwargs', 'future')
+
+    def __init__(self, priority: int, chat_id: int, method: str, kwargs: Dict[str, Any], future: asyncio.Future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+
+
+def _log_exception(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        log.error('Outbound call failed', exc_info=future.exception())
+
+
+class Outbox:
+
+    def __init__(self, bot: Bot,
+                 rate: float = constants.OUTBOX_RATE,
+                 burst: float = constants.OUTBOX_BURST,
+                 chat_rate: float = constants.OUTBOX_CHAT_RATE,
+                 chat_burst: float = constants.OUTBOX_CHAT_BURST,
+                 maxsize: int = constants.OUTBOX_MAXSIZE,
+                 concurrency: int = constants.OUTBOX_CONCURRENCY):
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._global_bucket = TokenBucket(rate, burst, time.monotonic())
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chats: Dict[int, Deque[OutboundCall]] = {}
+        # every chat with pending calls is in one of the heaps or has its call in flight
+        self._ready: List[Tuple[int, int, int]] = []  # (priority, seq, chat_id)
+        self._delayed: List[Tuple[float, int, int]] = []  # (ready at, seq, chat_id)
+        self._counter = itertools.count()
+        self._maxsize = maxsize
+        self._pending = 0
+        self._free_slot = asyncio.Condition()
+        self._in_flight: Set[asyncio.Task] = set()
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.retried = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of pending calls."""
+        return self._pending
+
+    def set_rate(self, rate: float, chat_rate: Optional[float] = None) -> None:
+        """Change the overall rate of the calls per second, and the rate per chat if given."""
+        self._global_bucket.rate = rate
+        if chat_rate is not None:
+            self._chat_rate = chat_rate
+            for bucket in self._chat_buckets.values():
+                bucket.rate = chat_rate
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = constants.OUTBOX_STOP_TIMEOUT_SECONDS) -> None:
+        """Try to send the pending calls within `timeout` and stop."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=max(0.0, deadline - time.monotonic()))
+
+    async def call(self, method: str, chat_id: int, priority: int = PRIORITY_INTERACTIVE,
+                   **kwargs) -> Optional[asyncio.Future]:
+        """Queue `bot.<method>(chat_id=chat_id, **kwargs)`.
+
+        Return a future of the call result, or None if the periodic call was dropped.
+        """
+        if self._pending >= self._maxsize:
+            if priority != PRIORITY_INTERACTIVE:
+                self.dropped += 1
+                log.warning(f'Outbox is full, dropped {method} to {chat_id}')
+                return None
+            async with self._free_slot:
+                await self._free_slot.wait_for(lambda: self._pending < self._maxsize)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_log_exception)
+        outbound_call = OutboundCall(priority, chat_id, method, kwargs, future)
+        self._pending += 1
+
+        chat_calls = self._chats.get(chat_id)
+        if chat_calls is None:
+            self._chats[chat_id] = deque((outbound_call,))
+            self._schedule_chat(chat_id, time.monotonic())
+        else:
+            chat_calls.append(outbound_call)
+        return future
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE,
+                           **kwargs) -> Optional[asyncio.Future]:
+        return await self.call('send_message', chat_id, priority, text=text, **kwargs)
+
+    def _get_chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, now)
+        return bucket
+
+    def _schedule_chat(self, chat_id: int, now: float) -> None:
+        delay = self._get_chat_bucket(chat_id, now).delay(now)
+        if delay:
+            heapq.heappush(self._delayed, (now + delay, next(self._counter), chat_id))
+        else:
+            priority = self._chats[chat_id][0].priority
+            heapq.heappush(self._ready, (priority, next(self._counter), chat_id))
+        self._wakeup.set()
+
+    def _promote_delayed(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            self._schedule_chat(chat_id, now)
+
+    def _prune_chat_buckets(self, now: float) -> None:
+        idle_chats = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                      if chat_id not in self._chats and bucket.is_full(now)]
+        for chat_id in idle_chats:
+            del self._chat_buckets[chat_id]
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._promote_delayed(now)
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global_bucket.delay(now)
+            if global_delay:
+                await asyncio.sleep(global_delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            outbound_call = self._chats[chat_id].popleft()
+            self._global_bucket.consume(now)
+            self._get_chat_bucket(chat_id, now).consume(now)
+
+            await self._concurrency.acquire()
+            task = asyncio.create_task(self._send(outbound_call))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _schedule_next(self, chat_id: int) -> None:
+        """Schedule the next call of the chat once its call in flight is done."""
+        now = time.monotonic()
+        if self._chats[chat_id]:
+            self._schedule_chat(chat_id, now)
+        else:
+            del self._chats[chat_id]
+            if len(self._chat_buckets) > 2 * len(self._chats) + self._maxsize:
+                self._prune_chat_buckets(now)
+
+    async def _send(self, outbound_call: OutboundCall) -> None:
+        try:
+            method = getattr(self._bot, outbound_call.method)
+            result = await method(chat_id=outbound_call.chat_id, **outbound_call.kwargs)
+        except RetryAfter as exc:
+            self.retried += 1
+            log.warning(f'Flood control, retry {outbound_call.method} to {outbound_call.chat_id}'
+                        f' in {exc.timeout} seconds')
+            self._retry(outbound_call, exc.timeout)
+            return
+        except Exception as exc:
+            outbound_call.future.set_exception(exc)
+        else:
+            self.sent += 1
+            outbound_call.future.set_result(result)
+        finally:
+            self._concurrency.release()
+            self._schedule_next(outbound_call.chat_id)
+
+        await self._release_slot()
+
+    def _retry(self, outbound_call: OutboundCall, retry_after: float) -> None:
+        now = time.monotonic()
+        self._get_chat_bucket(outbound_call.chat_id, now).pause(retry_after, now)
+        self._global_bucket.pause(retry_after, now)
+        # the chat is kept while its call is in flight, and is scheduled after the pause
+        self._chats[outbound_call.chat_id].appendleft(outbound_call)
+
+    async def _release_slot(self) -> None:
+        self._pending -= 1
+        async with self._free_slot:
+            self._free_slot.notify()
@@ -0,0 +1,199 @@
+"""SQL statements of `DBManager`, rendered once at import.
+
+Every statement takes its values as bound parameters (`:name`), so its
+text is the same on every call: it is compiled by sqlite once and then
+reused from the statement cache of the connection instead of being built
+by PyPika and compiled again per call. `CACHED_STATEMENTS` sizes the cache
+to hold all of them.
+"""
+from typing import List, Union
+
+from pypika import Order, Parameter, SQLLiteQuery, Table, functions as fn
+from pypika.queries import QueryBuilder
+
+from settings import constants
+
+
+USER = Table('user')
+CATEGORY = Table('category')
+SESSION = Table('session')
+TIMESHEET = Table('timesheet')
+SESSION_SCHEDULE = Table('session_schedule')
+DAILY_STATS = Table('daily_stats')
+
+STATEMENTS: List[str] = []
+
+
+def _register(query: Union[str, QueryBuilder]) -> str:
+    sql = query if isinstance(query, str) else query.get_sql()
+    STATEMENTS.append(sql)
+    return sql
+
+
+def _params(*names: str) -> List[Parameter]:
+    return [Parameter(f':{name}') for name in names]
+
+
+GET_CATEGORY = _register(
+    SQLLiteQuery.from_(CATEGORY).select('*')
+    .where(CATEGORY.id == Parameter(':category_id')))
+
+LIST_CATEGORIES = _register(
+    SQLLiteQuery.from_(CATEGORY).select(CATEGORY.id, CATEGORY.name)
+    .where(CATEGORY.user_telegram_id.eq(Parameter(':user_id')))
+    .orderby(CATEGORY.id))
+
+GET_USER = _register(
+    SQLLiteQuery.from_(USER).select('*')
+    .where(USER.telegram_id.eq(Parameter(':user_id'))))
+
+REGISTER_USER_COLUMNS = 'telegram_id', 'interval_seconds', 'first_name', 'last_name', 'created_at'
+REGISTER_USER = _register(
+    SQLLiteQuery.into(USER).columns(*REGISTER_USER_COLUMNS)
+    .insert(*_params(*REGISTER_USER_COLUMNS)))
+
+CREATE_CATEGORY = _register(
+    SQLLiteQuery.into(CATEGORY).columns(CATEGORY.user_telegram_id, CATEGORY.name)
+    .insert(*_params('user_id', 'name')))
+
+CREATE_SESSION = _register(
+    SQLLiteQuery.into(SESSION).columns(SESSION.user_telegram_id, SESSION.start_at)
+    .insert(*_params('user_id', 'start_at')))
+
+GET_LAST_STARTED_SESSION = _register(
+    SQLLiteQuery.from_(SESSION).select('*')
+    .where(SESSION.user_telegram_id.eq(Parameter(':user_id')))
+    .orderby(SESSION.start_at, order=Order.desc)
+    .limit(1))
+
+GET_ACTIVE_SESSION = _register(
+    SQLLiteQuery.from_(SESSION).select(SESSION.id)
+    .where(SESSION.user_telegram_id.eq(Parameter(':user_id')))
+    .where(SESSION.stop_at.isnull()))
+
+STOP_SESSION = _register(
+    SQLLiteQuery.update(SESSION)
+    .set(SESSION.stop_at, Parameter(':stop_at'))
+    .where(SESSION.id.eq(Parameter(':session_id'))))
+
+UNSCHEDULE_SESSION = _register(
+    SQLLiteQuery.from_(SESSION_SCHEDULE).delete()
+    .where(SESSION_SCHEDULE.session_id.eq(Parameter(':session_id'))))
+
+LIST_OPEN_SESSIONS = _register(
+    SQLLiteQuery.from_(SESSION)
+    .inner_join(USER).on(USER.telegram_id.eq(SESSION.user_telegram_id))
+    .left_join(SESSION_SCHEDULE).on(SESSION_SCHEDULE.session_id.eq(SESSION.id))
+    .select(SESSION.id, SESSION.user_telegram_id, USER.interval_seconds, SESSION_SCHEDULE.next_prompt_at)
+    .where(SESSION.stop_at.isnull()))
+
+# a stopped session is not scheduled again, whatever the order of the writes
+SET_NEXT_PROMPT_TIME = _register('''
+    insert or replace into session_schedule (session_id, next_prompt_at)
+    select id, :next_prompt_at from session where id = :session_id and stop_at is null
+''')
+
+SET_INTERVAL_SECONDS = _register(
+    SQLLiteQuery.update(USER)
+    .set(USER.interval_seconds, Parameter(':interval_seconds'))
+    .where(USER.telegram_id.eq(Parameter(':user_id'))))
+
+START_ACTIVITY = _register('''
+    insert into timesheet (session_id, start, finish)
+    select id, :start, :finish from session where id = :session_id and stop_at is null
+    returning activity_id, start, finish
+''')
+
+# the activity and the category are of the user: the ids in the callback data may be forged
+STOP_ACTIVITY = _register('''
+    update timesheet set default_category_id = :category_id
+    where activity_id = :activity_id and default_category_id is null and user_category_id is null
+        and exists (
+            select 1 from session where session.id = timesheet.session_id and session.user_telegram_id = :user_id)
+        and exists (select 1 from category where id = :category_id and user_telegram_id = :user_id)
+    returning start, finish
+''')
+
+STOP_UNFILLED_ACTIVITIES = _register('''
+    update timesheet set default_category_id = :category_id
+    where session_id = (select id from session where id = :session_id and user_telegram_id = :user_id)
+        and default_category_id is null and user_category_id is null
+        and exists (select 1 from category where id = :category_id and user_telegram_id = :user_id)
+    returning start, finish
+''')
+
+ADD_TO_DAILY_STATS = _register('''
+    insert into daily_stats (user_telegram_id, day, category_id, seconds)
+    select user_telegram_id, :day, id, :seconds from category where id = :category_id and user_telegram_id = :user_id
+    on conflict (user_telegram_id, day, category_id) do update set seconds = seconds + excluded.seconds
+''')
+
+GET_CATEGORY_DURATIONS = _register('''
+    select category.name, sum(min(timesheet.finish, :t1) - max(timesheet.start, :t0))
+    from session
+    join timesheet on timesheet.session_id = session.id
+    join category on category.id = timesheet.default_category_id
+    where session.user_telegram_id = :user_id
+        and session.start_at < :t1 and (session.stop_at is null or session.stop_at > :t0)
+        and timesheet.finish > :t0 and timesheet.start < :t1
+    group by category.id
+    order by category.name
+''')
+
+GET_SESSION_CATEGORY_DURATIONS = _register(
+    SQLLiteQuery.from_(TIMESHEET)
+    .inner_join(CATEGORY).on(TIMESHEET.default_category_id.eq(CATEGORY.id))
+    .select(CATEGORY.name, fn.Sum(TIMESHEET.finish - TIMESHEET.start))
+    .where(TIMESHEET.session_id.eq(Parameter(':session_id')))
+    .groupby(CATEGORY.id)
+    .orderby(CATEGORY.name))
+
+GET_DAILY_CATEGORY_DURATIONS = _register(
+    SQLLiteQuery.from_(DAILY_STATS)
+    .inner_join(CATEGORY).on(DAILY_STATS.category_id.eq(CATEGORY.id))
+    .select(CATEGORY.name, fn.Sum(DAILY_STATS.seconds))
+    .where(DAILY_STATS.user_telegram_id.eq(Parameter(':user_id')))
+    .where(DAILY_STATS.day >= Parameter(':day'))
+    .groupby(CATEGORY.id)
+    .orderby(CATEGORY.name))
+
+CALC_USER_DAILY_STATS = _register('''
+    select timesheet.default_category_id, timesheet.start, timesheet.finish
+    from session
+    join timesheet on timesheet.session_id = session.id
+    where session.user_telegram_id = :user_id and timesheet.default_category_id is not null
+''')
+
+# the export is streamed in the order of the indexes: by activity, or by session of the user
+#  with only the activities of one session sorted at a time
+EXPORT_TIMESHEET = _register('''
+    select timesheet.activity_id, session.user_telegram_id, timesheet.session_id, timesheet.start, timesheet.finish,
+        category.name
+    from timesheet
+    join session on session.id = timesheet.session_id
+    left join category on category.id = coalesce(timesheet.user_category_id, timesheet.default_category_id)
+    order by timesheet.activity_id
+''')
+
+EXPORT_USER_TIMESHEET = _register('''
+    select timesheet.activity_id, session.user_telegram_id, timesheet.session_id, timesheet.start, timesheet.finish,
+        category.name
+    from session
+    join timesheet on timesheet.session_id = session.id
+    left join category on category.id = coalesce(timesheet.user_category_id, timesheet.default_category_id)
+    where session.user_telegram_id = :user_id
+    order by session.start_at, timesheet.activity_id
+''')
+
+LIST_USER_IDS = _register('select telegram_id from user order by telegram_id')
+
+DELETE_USER_DAILY_STATS = _register('delete from daily_stats where user_telegram_id = :user_id')
+
+INSERT_DAILY_STATS = _register('''
+    insert into daily_stats (user_telegram_id, day, category_id, seconds)
+    values (:user_id, :day, :category_id, :seconds)
+''')
+
+LIST_USER_DAILY_STATS = _register('select day, category_id, seconds from daily_stats where user_telegram_id = :user_id')
+
+CACHED_STATEMENTS = len(STATEMENTS) + constants.DB_AD_HOC_CACHED_STATEMENTS
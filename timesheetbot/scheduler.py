@@ -0,0 +1,187 @@
+"""Central scheduler of the periodic "what did you do" prompts.
+
+One asyncio task serves all active sessions: the next prompt deadline of
+every session lives in a heap, due sessions are handed over to the dispatch
+coroutine in batches: deadlines are served with `resolution` precision, so
+the task wakes up at most 1/resolution times per second. Adding, rescheduling and removing a session are
+O(log n) / O(1) operations; outdated heap items are dropped lazily and the
+heap is compacted when they start to dominate, so memory follows the number
+of active sessions.
+
+Deadlines are UNIX timestamps, so they can be stored in the database and
+restored after a restart.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from settings import constants
+from . import metrics
+
+
+log = getLogger(__name__)
+
+
+class ScheduledSession:
+    __slots__ = ('user_id', 'session_id', 'interval_seconds', 'deadline', 'prompted_at', 'heap_seq')
+
+    def __init__(self, user_id: int, session_id: int, interval_seconds: int, deadline: float, prompted_at: float):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.interval_seconds = interval_seconds
+        self.deadline = deadline
+        # time of the previous prompt (or of the session start):
+        #  the next prompt asks about the period since then
+        self.prompted_at = prompted_at
+        # sequence number of the only actual heap item of the session
+        self.heap_seq = -1
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}(user_id={self.user_id}, session_id={self.session_id},'
+                f' interval_seconds={self.interval_seconds}, deadline={self.deadline:.3f})')
+
+
+Dispatch = Callable[[List[ScheduledSession]], Awaitable[None]]
+
+
+class PromptScheduler:
+
+    def __init__(self, dispatch: Dispatch,
+                 batch_size: int = constants.SCHEDULER_BATCH_SIZE,
+                 resolution: float = constants.SCHEDULER_RESOLUTION_SECONDS):
+        self._dispatch = dispatch
+        self._batch_size = batch_size
+        self._resolution = resolution
+        # heap items: (deadline, sequence number, session); an item is outdated
+        #  if its session was removed or got another deadline
+        self._heap: List[Tuple[float, int, ScheduledSession]] = []
+        self._sessions: Dict[int, ScheduledSession] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    @staticmethod
+    def _now() -> float:
+        return time.time()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, user_id: int, session_id: int, interval_seconds: int,
+            delay: Optional[float] = None) -> ScheduledSession:
+        """Schedule prompts of the session, the first one in `delay` (by default, `interval_seconds`) seconds."""
+        now = self._now()
+        delay = interval_seconds if delay is None else delay
+        session = ScheduledSession(user_id, session_id, interval_seconds, now + delay, prompted_at=now)
+        self._sessions[user_id] = session
+        self._push(session)
+        return session
+
+    def extend(self, sessions: Iterable[ScheduledSession]) -> None:
+        """Bulk `add` of the restored sessions in O(n)."""
+        for session in sessions:
+            session.heap_seq = next(self._counter)
+            self._sessions[session.user_id] = session
+            self._heap.append((session.deadline, session.heap_seq, session))
+        self._compact()
+        self._wakeup.set()
+
+    def is_scheduled(self, session: ScheduledSession) -> bool:
+        """Return False if the session was removed, e.g. stopped while its prompt was dispatched."""
+        return self._sessions.get(session.user_id) is session
+
+    def remove(self, user_id: int, session_id: Optional[int] = None) -> bool:
+        """Stop prompting the user, only in the session if given. Return False if there was nothing to stop."""
+        session = self._sessions.get(user_id)
+        if session is None or (session_id is not None and session.session_id != session_id):
+            return False
+        del self._sessions[user_id]
+        return True
+
+    def set_interval(self, user_id: int, interval_seconds: int) -> Optional[ScheduledSession]:
+        """Apply the new interval counting from the last prompt of the session.
+
+        Return the rescheduled session or None if the user has no scheduled session.
+        """
+        session = self._sessions.get(user_id)
+        if session is None or session.interval_seconds == interval_seconds:
+            return None
+        session.interval_seconds = interval_seconds
+        session.deadline = session.prompted_at + interval_seconds
+        self._push(session)
+        return session
+
+    def _push(self, session: ScheduledSession) -> None:
+        is_earliest = not self._heap or session.deadline < self._heap[0][0]
+        session.heap_seq = next(self._counter)
+        heapq.heappush(self._heap, (session.deadline, session.heap_seq, session))
+        if len(self._heap) > 2 * len(self._sessions) + self._batch_size:
+            self._compact()
+        if is_earliest:
+            self._wakeup.set()
+
+    def _is_actual(self, heap_seq: int, session: ScheduledSession) -> bool:
+        return session.heap_seq == heap_seq and self._sessions.get(session.user_id) is session
+
+    def _compact(self) -> None:
+        self._heap = [item for item in self._heap if self._is_actual(item[1], item[2])]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> List[ScheduledSession]:
+        """Pop the sessions due within the resolution from `now` and reschedule them."""
+        due = []
+        horizon = now + self._resolution
+        while self._heap and self._heap[0][0] <= horizon and len(due) < self._batch_size:
+            deadline, heap_seq, session = heapq.heappop(self._heap)
+            if not self._is_actual(heap_seq, session):
+                continue
+            due.append(session)
+            metrics.scheduler_lag_seconds.observe(max(0.0, now - deadline))
+            session.deadline = deadline + session.interval_seconds
+            if session.deadline <= horizon:
+                # a late scheduler does not catch up with a burst of prompts
+                session.deadline = horizon + session.interval_seconds
+            session.heap_seq = next(self._counter)
+            heapq.heappush(self._heap, (session.deadline, session.heap_seq, session))
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - self._now() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = self._now()
+            due = self._pop_due(now)
+            if not due:
+                continue
+            try:
+                await self._dispatch(due)
+            except Exception:
+                log.exception(f'Failed to dispatch {len(due)} prompts')
+            for session in due:
+                session.prompted_at = now
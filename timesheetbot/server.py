@@ -1,262 +1,283 @@
 """Telegram bot server."""
-import functools
-import itertools
-import json
 import asyncio
-import operator
-from collections import defaultdict
+import contextlib
+import tempfile
+import time
 from datetime import datetime, timedelta
 from logging import getLogger
-from typing import Dict, Union, Tuple, Iterable, List
+from pathlib import Path
+from typing import Dict, Union, Tuple, List, Optional, Set
 
 from aiogram import Bot, Dispatcher
 from aiogram import types
-from dateutil.relativedelta import relativedelta
-import more_itertools
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
 
 import settings
-from . import utils, messages as msgs
-from .db_manager import DBManager, DoesNotExist
-from .middlewares import AccessMiddleware
+from . import callback_data, export, metrics
+from . import messages as msgs
+from .cache import CachedUser, StatsCache, UserCache
+from .db_manager import AsyncDBManager, DBManager, DoesNotExist
+from .keyboards import (
+    INTERVAL_KEYBOARD, NAVIGATION_KEYBOARD, STATS_KEYBOARD, get_categories_keyboard, get_fill_all_keyboard,
+)
+from .middlewares import AccessMiddleware, MetricsMiddleware, set_handler_name
+from .outbox import PRIORITY_PERIODIC, Outbox
+from .scheduler import PromptScheduler, ScheduledSession
+from .sessions import SessionRegistry, UserSessionState
+from .stats import get_stats
+from .webhook import WebhookReceiver, make_app
 
 
 log = getLogger(__name__)
 
 const = settings.constants
 
-db = DBManager()
+# built by `create_app`: importing the module builds nothing
+db: AsyncDBManager
+bot: Bot
+dp: Dispatcher
+outbox: Outbox
+scheduler: PromptScheduler
+
+user_sessions: SessionRegistry
+stats_cache: StatsCache
+users: UserCache
+# sessions waiting for the user to choose the interval, see `start_session`
+opening_sessions: Set[asyncio.Task]
+
+# in the multi-process mode the process serves the users with `user_id % shards_num == shard_index`
+shard_index, shards_num = 0, 1
+
+metrics_port = settings.METRICS_PORT
+metrics_runner: Optional[web.AppRunner] = None
+
+
+def setup_shard(index: int, count: int, outbox_rate: Optional[float] = None, outbox_chat_rate: Optional[float] = None):
+    """Serve only the users of the shard `index` of `count`; call after `create_app`."""
+    global shard_index, shards_num, metrics_port
+    shard_index, shards_num = index, count
+    if metrics_port:
+        metrics_port = settings.METRICS_PORT + 1 + index
+    # Telegram limits the bot as a whole, so the shards share the rate
+    outbox.set_rate(outbox_rate or const.OUTBOX_RATE / count, outbox_chat_rate)
+    # the open transaction of a commit window holds the write lock of the database shared by the shards
+    db.set_commit_window(0.0)
+
+
+async def send_due_prompts(sessions: List[ScheduledSession]):
+    now = time.time()
+    # a prompt asks about all the time since the previous one,
+    #  so the prompts missed while the bot was down are coalesced into one
+    prompts = (send_choose_categories(types.User(id=s.user_id), s.session_id, round(now - s.prompted_at))
+               for s in sessions)
+    results = await asyncio.gather(*prompts, return_exceptions=True)
+    for session, result in zip(sessions, results):
+        if isinstance(result, Exception):
+            log.error(f'Prompt failed: {session}', exc_info=result)
+
+    # the sessions stopped during the dispatch are unscheduled already
+    scheduled = [(s.session_id, s.deadline) for s in sessions if scheduler.is_scheduled(s)]
+    if scheduled:
+        await db.set_next_prompt_times(scheduled)
+
+
+async def restore_sessions():
+    """Resume prompting of the sessions which were open when the bot stopped."""
+    now = time.time()
+    scheduled, overdue = [], []
+    for session_id, user_id, interval_seconds, next_prompt_at in await db.list_open_sessions():
+        if user_id % shards_num != shard_index:
+            continue
+        if next_prompt_at is None:  # the bot stopped while the user was choosing the interval
+            session = ScheduledSession(user_id, session_id, interval_seconds, now + interval_seconds, now)
+        else:
+            session = ScheduledSession(user_id, session_id, interval_seconds,
+                                       next_prompt_at, next_prompt_at - interval_seconds)
+        (overdue if session.deadline <= now else scheduled).append(session)
+        user_sessions.open(user_id, session_id)
 
-bot = Bot(token=settings.TELEGRAM_API_TOKEN)
-dp = Dispatcher(bot)
-dp.middleware.setup(AccessMiddleware(settings.ACCESS_IDS))
+    # spread the overdue prompts out not to flood Telegram
+    for num, session in enumerate(overdue):
+        session.deadline = now + num / const.RESTORED_PROMPTS_PER_SECOND
 
-stop_sending_events = defaultdict(lambda: [])
-user_start_interval_waiters = defaultdict(lambda: [])
-locks = {}
+    scheduler.extend(scheduled + overdue)
+    log.info(f'Restored {len(scheduled) + len(overdue)} sessions, {len(overdue)} of them are overdue')
 
 
-async def get_interval(u: types.User):
-    async with locks[u.id]:
-        interval_seconds = db.get_interval_seconds(u)
-    return interval_seconds
+async def get_user(u: types.User) -> CachedUser:
+    """Get the user's settings and categories from the cache, registering the user if needed."""
+    user = users.get(u.id)
+    if user is None:
+        interval_seconds, categories = await db.get_or_register_user(u)
+        user = CachedUser(u.id, interval_seconds, categories)
+        users.put(user)
+    return user
 
 
 async def set_interval(u: types.User, interval_seconds):
-    if u.id in locks:
-        async with locks[u.id]:
-            rows_num = db.set_interval_seconds(u, interval_seconds)
-    else:
-        db.register_user_if_not_exists(u)
-        rows_num = db.set_interval_seconds(u, interval_seconds)
+    await get_user(u)
+    rows_num = await db.set_interval_seconds(u, interval_seconds)
+    users.set_interval(u.id, interval_seconds)
+
+    session = scheduler.set_interval(u.id, interval_seconds)
+    if session is not None:
+        await db.set_next_prompt_times([(session.session_id, session.deadline)])
 
     return rows_num
 
 
-@dp.message_handler(commands=('help',))
 async def send_welcome(message: types.Message):
-    await message.answer(msgs.WELCOME)
-
-
-async def send_events_coro(user, session_id):
-    while True:
-        interval_seconds = await get_interval(user)
-        await asyncio.sleep(interval_seconds)
-        await send_choose_categories(user, session_id, interval_seconds)
+    await outbox.send_message(message.chat.id, msgs.WELCOME)
 
 
-def get_ts_btns() -> types.ReplyKeyboardMarkup:
-    btn_start = types.KeyboardButton('Старт')
-    btn_stop = types.KeyboardButton('Стоп')
-    btn_change_step = types.KeyboardButton('Изменить интервал')
-    btn_statistic = types.KeyboardButton('Статистика >>')
-
-    navigation_kb = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    navigation_kb.row(btn_start, btn_stop).row(btn_change_step, btn_statistic)
-    return navigation_kb
-
-
-@dp.message_handler(commands=('start',))
 async def start_session(message: types.Message):
     user = message.from_user
 
-    db.register_user_if_not_exists(user)
+    await get_user(user)
 
-    session_id, is_new_session = db.get_new_or_existing_session_id(user)
+    session_id, is_new_session = await db.get_new_or_existing_session_id(user)
 
     if not is_new_session:
-        await message.answer(msgs.CLOSE_SESSION_PLS)
+        await outbox.send_message(message.chat.id, msgs.CLOSE_SESSION_PLS)
         return
 
-    await message.answer('У вас есть {wait_for_sec} секунд, чтобы выбрать интервал на эту сессию.'.format(
+    reply = 'У вас есть {wait_for_sec} секунд, чтобы выбрать интервал на эту сессию.'.format(
         wait_for_sec=const.WAIT_INTERVAL_FROM_USER_BEFORE_START
-    ))
+    )
+    await outbox.send_message(message.chat.id, reply)
     await change_interval_cmd(message)
 
-    sleep = asyncio.create_task(asyncio.sleep(const.WAIT_INTERVAL_FROM_USER_BEFORE_START))
-    user_start_interval_waiters[user.id].append(sleep)
+    state = user_sessions.open(user.id, session_id)
+    # the stats of the last session are of the new one now
+    stats_cache.invalidate(user.id)
+    # the wait goes on in the background, so the update does not hold a webhook slot for it
+    task = asyncio.create_task(open_session(user, message.chat.id, state))
+    opening_sessions.add(task)
+    task.add_done_callback(opening_sessions.discard)
+
+
+async def open_session(user: types.User, chat_id: int, state: UserSessionState):
+    """Start prompting when the user has chosen the interval or the wait is over."""
     try:
-        await sleep
-    except asyncio.CancelledError as exc:
-        pass
+        await state.wait_interval(const.WAIT_INTERVAL_FROM_USER_BEFORE_START)
+        if not user_sessions.is_open(state):  # stopped while the user was choosing the interval
+            return
 
-    locks[user.id] = asyncio.Lock()
-    interval_seconds = await get_interval(user)
-    # TODO: seconds to minutes (via datetime?)
-    first_bot_msg_time = datetime.now() + timedelta(0, interval_seconds)
-    reply = msgs.FIRST_BOT_MSG.format(
-        time=first_bot_msg_time.strftime("%H:%M:%S"))
+        interval_seconds = (await get_user(user)).interval_seconds
+        # TODO: seconds to minutes (via datetime?)
+        first_bot_msg_time = datetime.now() + timedelta(0, interval_seconds)
+        reply = msgs.FIRST_BOT_MSG.format(
+            time=first_bot_msg_time.strftime("%H:%M:%S"))
 
-    navigation_kb = get_ts_btns()
-    await message.answer(reply, reply_markup=navigation_kb)
+        await outbox.send_message(chat_id, reply, reply_markup=NAVIGATION_KEYBOARD)
 
-    log.info('Opened session. User: ' + user.get_mention())
+        log.info('Opened session. User: ' + user.get_mention())
 
-    task = asyncio.create_task(send_events_coro(user, session_id))
-    stop_sending_events[user.id].append(task)
-    await task
+        session = scheduler.add(user.id, state.session_id, interval_seconds)
+        await db.set_next_prompt_times([(state.session_id, session.deadline)])
+    except Exception:
+        log.exception(f'Failed to open session {state.session_id} of user {user.id}')
 
 
-@dp.message_handler(commands=('stop',))
 async def stop_session(message: types.Message):
     user = message.from_user
 
-    stopped = db.try_stop_session(user)
+    stopped = await db.try_stop_session(user)
     reply = 'Остановились' if stopped else 'Нечего останавливать'
 
-    await message.answer(reply)
+    await outbox.send_message(message.chat.id, reply)
 
-    if stopped and user.id in stop_sending_events:
-        [task.cancel() for task in stop_sending_events[user.id]]
+    if stopped:
+        scheduler.remove(user.id)
+        user_sessions.close(user.id)
+        stats_cache.invalidate(user.id)
         msg = 'Closed session. User: ' + message.from_user.get_mention()
         log.info(msg)
 
 
-@dp.message_handler(commands=('list',))
 async def list_categories_cmd(message: types.Message):
     user = message.from_user
-    categories = db.list_categories(user)
+    categories = (await get_user(user)).categories
     msg = 'Категории:\n\n{}'.format(
             '\n'.join(name for _, name in categories))
-    await message.answer(msg)
+    await outbox.send_message(message.chat.id, msg)
+
+
+async def export_cmd(message: types.Message):
+    """Send the user's raw timesheet as documents: `/export [csv|jsonl] [gz]`."""
+    try:
+        fmt, compress = export.parse_options(message.get_args() or '')
+    except ValueError:
+        await outbox.send_message(message.chat.id, msgs.EXPORT_USAGE)
+        return
+
+    user = message.from_user
+    with tempfile.TemporaryDirectory(prefix='timesheetbot-export-') as export_dir:
+        # written on an export thread, streamed from the cursor
+        paths = await db.export_timesheet(Path(export_dir, f'timesheet-{user.id}-{datetime.now():%Y%m%d}'),
+                                          user.id, fmt, compress, const.EXPORT_MAX_FILE_BYTES)
+        # the files are read on sending and closed before their directory is removed
+        with contextlib.ExitStack() as files:
+            sent = []
+            for num, path in enumerate(paths, 1):
+                caption = f'Часть {num} из {len(paths)}' if len(paths) > 1 else None
+                document = types.InputFile(files.enter_context(path.open('rb')), filename=path.name)
+                sent.append(await outbox.call('send_document', message.chat.id, document=document, caption=caption))
+            # the calls left in a stopped outbox never finish
+            _, unsent = await asyncio.wait(sent, timeout=const.EXPORT_SEND_TIMEOUT_SECONDS)
+            if unsent:
+                log.warning(f'Gave up waiting for {len(unsent)} of {len(sent)} export documents.'
+                            f' User: {user.get_mention()}')
+
+    log.info(f'Exported timesheet to {len(paths)} files. User: {user.get_mention()}')
 
 
-@dp.message_handler(commands=('buttons',))
 async def control_buttons_cmd(message: types.Message):
-    await bot.send_message(message.from_user.id, "Отображаем кнопки", reply_markup=get_ts_btns())
+    await outbox.send_message(message.from_user.id, "Отображаем кнопки", reply_markup=NAVIGATION_KEYBOARD)
 
 
 async def change_interval_cmd(message: types.Message):
-    buttons = types.InlineKeyboardMarkup().row(*const.INTERVAL_BUTTONS)
-    if settings.DEBUG_MODE:
-        buttons.row(*const.DEBUG_BUTTONS)
-
-    await bot.send_message(message.from_user.id, const.CHOOSE_INTERVAL_TEXT, reply_markup=buttons)
+    await outbox.send_message(message.from_user.id, const.CHOOSE_INTERVAL_TEXT, reply_markup=INTERVAL_KEYBOARD)
 
 
-@dp.callback_query_handler(lambda c: c.message.text == const.CHOOSE_INTERVAL_TEXT)
-async def set_replied_interval(callback_query: types.CallbackQuery):
+async def set_replied_interval(callback_query: types.CallbackQuery, interval_seconds: int):
     await bot.answer_callback_query(callback_query.id)
     user = callback_query.from_user
-    interval_seconds = int(callback_query.data)
 
     _ = await set_interval(user, interval_seconds)
-    [task.cancel() for task in user_start_interval_waiters[user.id]]
+    user_sessions.cancel_interval_waiter(user.id)
 
     # TODO: seconds to minutes (via datetime?)
     interval_representation = f'{interval_seconds} секунд'
     reply = 'Установлен интервал: {}'.format(interval_representation)
-    await bot.send_message(user.id, reply)
+    await outbox.send_message(user.id, reply)
 
 
 async def stats_cmd(message: types.Message):
-    await bot.send_message(message.from_user.id,
-                           const.CHOOSE_STATS_TEXT,
-                           reply_markup=const.STATS_BUTTONS)
+    await outbox.send_message(message.from_user.id,
+                              const.CHOOSE_STATS_TEXT,
+                              reply_markup=STATS_KEYBOARD)
 
 
-def increment_activities_duration(acc: datetime, activity: tuple) -> datetime:
-    start, finish = map(utils.parse_datetime, activity[-3:-1])
-    duration = finish - start
-    acc += duration
-    return acc
-
-
-def calc_category_stats(category: str, activities: itertools._grouper
-                        ) -> Dict[str, Union[timedelta, str, int]]:
-    time_ = functools.reduce(increment_activities_duration,
-                             tuple(activities), timedelta())
-    stat_repr = dict(category=category, time=time_)
-    return stat_repr
-
-
-def represent_stats(category_stats: Tuple[Dict[str, Union[timedelta, str, int]]],) -> str:
-    category_stat_template = '{category:<15} {time} ({percent:.2f}%)'
-    stats_repr = '\n'.join(category_stat_template.format(**stats)
-                           for stats in category_stats)
-    return stats_repr
-
-
-def calc_stats(activities: List[tuple]
-               ) -> Tuple[Dict[str, Union[str, int, float, timedelta]], ...]:
-    category_filter = lambda activity: activity[-1]
-    groups_gen = itertools.groupby(sorted(activities, key=category_filter),
-                                   key=category_filter)
-    category_stats = tuple(itertools.starmap(calc_category_stats, groups_gen))
-
-    all_activities_time = sum((stats.get('time', timedelta())
-                               for stats in category_stats), timedelta())
-    for stats in category_stats:
-        percent = stats.get('time', timedelta()) / all_activities_time * 100
-        stats.update(percent=percent)
-
-    return category_stats
-
-
-def get_stats(u: types.User, period: Union[Dict[str, int], str]) -> str:
-    t1 = datetime.now()
-    msg_title = 'За {stat_period} ваша статистика следующая:'
-
-    if isinstance(period, dict):
-        if 'months' in period:
-            t0 = t1 - relativedelta(**period)
-        else:
-            t0 = t1 - timedelta(**period)
-        sessions = db.filter_user_sessions_by_start(u, t0)
-        stat_period = f'{utils.parse_datetime(str(t0))} - {utils.parse_datetime(str(t1))}'
-    else:  # period == 'session':
-        sessions = (db.get_last_started_session(u),)
-        stat_period = f'последнюю сессию'
-
-    session_ids = tuple(session[0] for session in sessions)
-    activities = db.get_timesheet_frame_by_sessions(session_ids)
-
-    # TODO: other representations
-    stats = calc_stats(activities)
-    stats_repr = represent_stats(stats)
-    stats_repr = f'{msg_title}\n`{stats_repr}`'
-    stats_repr = stats_repr.format(stat_period=stat_period)
-
-    return stats_repr
-
-
-@dp.callback_query_handler(lambda c: c.message.text == const.CHOOSE_STATS_TEXT)
-async def get_requested_stats(callback_query: types.CallbackQuery):
+async def get_requested_stats(callback_query: types.CallbackQuery, period_index: int):
     await bot.answer_callback_query(callback_query.id)
     user = callback_query.from_user
-    try:
-        stats_period = json.loads(callback_query.data)
-    except ValueError:
-        stats_period = callback_query.data
+    reply, generation = stats_cache.get(user.id, period_index)
+    if reply is None:
+        try:
+            _, stats_period = const.STATS_PERIODS[period_index]
+            stats = await get_stats(db, user, stats_period)
+        except DoesNotExist:
+            reply = 'За данный период ничего не найдено!'
 
-    try:
-        stats = get_stats(user, stats_period)
-    except DoesNotExist:
-        reply = 'За данный период ничего не найдено!'
+        else:
+            reply = stats
 
-    else:
-        reply = stats
+        # not cached if the timesheet changed while the stats were read
+        stats_cache.put(user.id, period_index, reply, generation)
 
-    await bot.send_message(user.id, reply, parse_mode="Markdown")
+    await outbox.send_message(user.id, reply, parse_mode="Markdown")
 
 
 BTNNAME_HANDLER_MAP = {
@@ -267,82 +288,254 @@ BTNNAME_HANDLER_MAP = {
 }
 
 
-@dp.message_handler(content_types=types.ContentTypes.ANY)
 async def reply_admin_btns(message: types.Message):
     btn_name = message.text
 
     if btn_name not in BTNNAME_HANDLER_MAP:
-        await message.answer(f'`{btn_name}` не реализован')
+        await outbox.send_message(message.chat.id, f'`{btn_name}` не реализован')
     else:
 
         handler = BTNNAME_HANDLER_MAP[btn_name]
+        set_handler_name(handler.__name__)
         await handler(message)
 
 
-def split_buttons_on_rows(btns: Iterable[types.InlineKeyboardButton]
-                          ) -> types.InlineKeyboardMarkup:
-    btns_by_rows = more_itertools.chunked(btns, const.MAX_ROW_BUTTONS)
-    buttons = types.InlineKeyboardMarkup()
-    for btns in btns_by_rows:
-        buttons.row(*btns)
-    return buttons
-
-
 def get_choose_categories_msg_payload(activity: tuple, categories: Tuple[tuple]) -> Dict[str, Union[str, dict]]:
-    activity_id, _, _, _, start, finish = activity
-    start = utils.parse_datetime(start)
-    finish = utils.parse_datetime(finish)
-
-    category_btns = []
-    for category_id, _, name in categories:
-        data = json.dumps({'act_id': activity_id, 'cat_id': category_id}, ensure_ascii=False)
-        category_btns.append(types.InlineKeyboardButton(name, callback_data=data))
-
-    buttons = split_buttons_on_rows(category_btns)
+    activity_id, start, finish = activity
+    start = datetime.fromtimestamp(start)
+    finish = datetime.fromtimestamp(finish)
 
     msg_payload = {
-        'msg': 'Что делал в этот период: {event_interval}'.format(
-            event_interval=f'{start.strftime("%H:%M:%S")} - {finish.strftime("%H:%M:%S")}',
-        ),
-        'payload': {'reply_markup': buttons},
+        'msg': f'Что делал в этот период: {start:%H:%M:%S} - {finish:%H:%M:%S}',
+        'payload': {'reply_markup': get_categories_keyboard(categories, activity_id)},
     }
     return msg_payload
 
 
 async def send_choose_categories(u: types.User, session_id: int, interval_seconds: int):
-    if not db.has_active_session(u):
+    try:
+        activity = await db.start_activity(session_id, interval_seconds)
+    except DoesNotExist:  # the session is stopped; the user may have started a new one meanwhile
+        scheduler.remove(u.id, session_id)
+        user_sessions.close(u.id, session_id)
         return
 
-    activity_id = db.start_activity(session_id, interval_seconds)
-    activity = db.get_unstopped_activity(activity_id)
-    categories = db.list_categories(u)
+    categories = (await get_user(u)).categories
+
+    state = user_sessions.get(u.id)
+    if state is not None:
+        state.unanswered += 1
+        if state.unanswered > const.FILL_ALL_AFTER_UNANSWERED:
+            # the user is away: one offer to fill all the activities instead of a prompt per activity
+            if not state.fill_all_prompted:
+                state.fill_all_prompted = True
+                await show_prompt(u, state, const.FILL_ALL_TEXT,
+                                  reply_markup=get_fill_all_keyboard(categories, session_id))
+            return
+        if settings.EDIT_IN_PLACE_PROMPTS and state.unanswered > 1:
+            # a prompt of the new activity would replace the buttons of the unfilled ones
+            await show_prompt(u, state, const.FILL_ALL_PENDING_TEXT.format(unanswered=state.unanswered),
+                              reply_markup=get_fill_all_keyboard(categories, session_id))
+            return
 
     msg_payload = get_choose_categories_msg_payload(activity, categories)
-    await bot.send_message(u.id, msg_payload['msg'], **msg_payload['payload'])
+    await show_prompt(u, state, msg_payload['msg'], **msg_payload['payload'])
 
 
-@dp.callback_query_handler(lambda c: 'act_id' in c.data)
-async def finish_activity(callback_query: types.CallbackQuery):
+async def show_prompt(u: types.User, state: Optional[UserSessionState], text: str, **kwargs):
+    """Send the prompt, or edit the prompt message of the session in the edit-in-place mode."""
+    if not settings.EDIT_IN_PLACE_PROMPTS or state is None:
+        await outbox.send_message(u.id, text, priority=PRIORITY_PERIODIC, **kwargs)
+        return
+
+    message_id = state.prompt_message_id
+    if message_id is None:
+        state.prompt_message = await outbox.send_message(u.id, text, priority=PRIORITY_PERIODIC, **kwargs)
+        return
+
+    edited = await outbox.call('edit_message_text', u.id, PRIORITY_PERIODIC, message_id=message_id, text=text,
+                               **kwargs)
+    if edited is not None:
+        edited.add_done_callback(state.on_prompt_edited)
+
+
+async def acknowledge_filling(callback_query: types.CallbackQuery, reply: str):
+    """Reply to a filling: by the callback answer in the edit-in-place mode, by a message otherwise."""
+    if settings.EDIT_IN_PLACE_PROMPTS:
+        await bot.answer_callback_query(callback_query.id, text=reply.replace('`', ''))
+        return
+
     await bot.answer_callback_query(callback_query.id)
-    data = json.loads(callback_query.data)
+    await outbox.send_message(callback_query.from_user.id, reply, parse_mode='Markdown')
+
+
+async def get_category_name(u: types.User, category_id: int) -> str:
+    category_name = (await get_user(u)).get_category_name(category_id)
+    if category_name is None:  # not a category of the user
+        _, _, category_name = await db.get_category(category_id)
+    return category_name
+
+
+async def finish_activity(callback_query: types.CallbackQuery, activity_id: int, category_id: int):
     user = callback_query.from_user
 
     try:
-        activity_id, category_id = data['act_id'], data['cat_id']
-        db.stop_activity(activity_id, category_id)
+        await db.stop_activity(user, activity_id, category_id)
     except DoesNotExist:
         reply = 'Промежуток уже был заполнен'
-    except RuntimeError:
-        reply = 'Ошибка на сервере! Как сказал инженер Чернобыльской АЭС: "...Упс"'
     else:
-        _, _, category_name = db.get_category(category_id)
-        reply = f'Заполнено: `{category_name}`'
+        stats_cache.invalidate(user.id)
+        state = user_sessions.get(user.id)
+        if state is not None:
+            state.answer()
+        reply = f'Заполнено: `{await get_category_name(user, category_id)}`'
+
+    await acknowledge_filling(callback_query, reply)
+
+
+async def finish_all_activities(callback_query: types.CallbackQuery, session_id: int, category_id: int):
+    user = callback_query.from_user
+
+    activities_num = await db.stop_unfilled_activities(user, session_id, category_id)
+    if not activities_num:
+        reply = 'Промежутки уже были заполнены'
+    else:
+        stats_cache.invalidate(user.id)
+        state = user_sessions.get(user.id)
+        if state is not None and state.session_id == session_id:
+            state.answer(activities_num)
+        reply = f'Заполнено промежутков: {activities_num}, `{await get_category_name(user, category_id)}`'
+
+    await acknowledge_filling(callback_query, reply)
+
+
+CALLBACK_ACTION_HANDLER_MAP = {
+    callback_data.SET_INTERVAL: set_replied_interval,
+    callback_data.GET_STATS: get_requested_stats,
+    callback_data.FILL_ACTIVITY: finish_activity,
+    callback_data.FILL_ALL_ACTIVITIES: finish_all_activities,
+}
+
+
+async def route_callback_query(callback_query: types.CallbackQuery):
+    """The only callback query handler: routes by the action of the callback data."""
+    try:
+        action, fields = callback_data.decode(callback_query.data)
+    except ValueError:
+        log.warning('Invalid callback data %r from %s', callback_query.data, callback_query.from_user.id)
+        await bot.answer_callback_query(callback_query.id)
+        return
 
-    await bot.send_message(user.id, reply, parse_mode='Markdown')
+    handler = CALLBACK_ACTION_HANDLER_MAP[action]
+    set_handler_name(handler.__name__)
+    await handler(callback_query, *fields)
+
+
+def create_bot() -> Bot:
+    """Bot API client of the bot; reads and checks `TELEGRAM_API_TOKEN`."""
+    return Bot(token=settings.TELEGRAM_API_TOKEN, server=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
+
+
+def create_app(**outbox_options) -> Dispatcher:
+    """Build the bot, its state and the dispatcher with the handlers; return the dispatcher.
+
+    `outbox_options` override the limits of the outbox, e.g. to lift them in the benchmarks.
+    """
+    global db, bot, dp, outbox, scheduler, user_sessions, stats_cache, users, opening_sessions
+    db = AsyncDBManager()
+    bot = create_bot()
+    outbox = Outbox(bot, **outbox_options)
+    scheduler = PromptScheduler(send_due_prompts)
+    user_sessions = SessionRegistry()
+    stats_cache = StatsCache()
+    users = UserCache()
+    opening_sessions = set()
+
+    dp = Dispatcher(bot)
+    dp.middleware.setup(AccessMiddleware(settings.ACCESS_IDS))
+    dp.middleware.setup(MetricsMiddleware())
+    dp.register_message_handler(send_welcome, commands=('help',))
+    dp.register_message_handler(start_session, commands=('start',))
+    dp.register_message_handler(stop_session, commands=('stop',))
+    dp.register_message_handler(list_categories_cmd, commands=('list',))
+    dp.register_message_handler(export_cmd, commands=('export',))
+    dp.register_message_handler(control_buttons_cmd, commands=('buttons',))
+    # the buttons and everything else: after the commands
+    dp.register_message_handler(reply_admin_btns, content_types=types.ContentTypes.ANY)
+    dp.register_callback_query_handler(route_callback_query)
+
+    # read on a scrape: the globals may be replaced, e.g. by the benchmarks
+    metrics.registry.gauge('timesheetbot_outbox_depth', 'Messages waiting in the outbox', lambda: outbox.depth)
+    metrics.registry.counter('timesheetbot_outbox_messages_total', 'Outbound Bot API calls by the result',
+                             lambda: {'sent': outbox.sent, 'dropped': outbox.dropped, 'retried': outbox.retried},
+                             label='result')
+    metrics.registry.gauge('timesheetbot_cache_hit_ratio', 'Hit ratio of the in-process caches',
+                           lambda: {'users': users.hit_rate, 'stats': stats_cache.hit_rate}, label='cache')
+    metrics.registry.gauge('timesheetbot_scheduled_sessions', 'Sessions with the prompts scheduled',
+                           lambda: len(scheduler))
+    metrics.registry.gauge('timesheetbot_open_sessions', 'Sessions with the in-memory state',
+                           lambda: len(user_sessions))
+    return dp
+
+
+async def on_startup(dispatcher: Dispatcher):
+    global metrics_runner
+    outbox.start()
+    await restore_sessions()
+    scheduler.start()
+    if metrics_port:
+        metrics_runner = await metrics.start_server(settings.METRICS_HOST, metrics_port)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+    # a cancelled wait for the interval ends early: the session is scheduled with the interval chosen so far
+    for task in opening_sessions:
+        task.cancel()
+    if opening_sessions:
+        await asyncio.wait(opening_sessions)
+    await scheduler.stop()
+    await outbox.stop()
+    db.shutdown()
+
+
+async def feed_update(update: dict):
+    await dp.process_update(types.Update(**update))
+
+
+def make_webhook_app(path: str = settings.WEBHOOK_PATH, secret: str = settings.WEBHOOK_SECRET,
+                     url: str = settings.WEBHOOK_URL) -> web.Application:
+    """Build the webhook receiver app of the app built by `create_app`; register `url` as the bot webhook if given."""
+    receiver = WebhookReceiver(feed_update, secret)
+    app = make_app(receiver, path)
+    metrics.registry.counter('timesheetbot_webhook_updates_total', 'Webhook updates by the result',
+                             lambda: {'received': receiver.received, 'rejected': receiver.rejected}, label='result')
+    metrics.registry.gauge('timesheetbot_webhook_in_flight', 'Webhook updates being processed',
+                           lambda: receiver.in_flight)
+
+    async def startup(_: web.Application):
+        Bot.set_current(bot)
+        Dispatcher.set_current(dp)
+        await on_startup(dp)
+        if url:
+            await bot.set_webhook(url, secret_token=secret or None, drop_pending_updates=True,
+                                  max_connections=const.WEBHOOK_MAX_CONNECTIONS)
+
+    async def shutdown(_: web.Application):
+        await receiver.drain(const.OUTBOX_STOP_TIMEOUT_SECONDS)
+        await on_shutdown(dp)
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
 
 
 if __name__ == '__main__':
     from aiogram.utils import executor
 
-    db.migrate()
-    executor.start_polling(dp, skip_updates=True)
+    DBManager().migrate()
+    executor.start_polling(create_app(), skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
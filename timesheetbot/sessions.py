@@ -0,0 +1,109 @@
+"""Runtime state of the open sessions of the users.
+
+The state of a user lives in the registry from the start of a session till
+its stop, so the registry holds no more entries than there are open
+sessions, however many users come and go.
+"""
+import asyncio
+from typing import Dict, Optional
+
+
+class UserSessionState:
+    __slots__ = ('user_id', 'session_id', 'interval_waiter', 'unanswered', 'fill_all_prompted', 'prompt_message')
+
+    def __init__(self, user_id: int, session_id: int):
+        self.user_id = user_id
+        self.session_id = session_id
+        # sleep task of the session start, while the user is choosing the interval
+        self.interval_waiter: Optional[asyncio.Task] = None
+        # prompts of the session sent since the bot started and not answered yet
+        self.unanswered = 0
+        # the user is offered to fill all the unanswered activities at once
+        self.fill_all_prompted = False
+        # future of the sent prompt message, which is edited by the next prompts in the edit-in-place mode
+        self.prompt_message: Optional[asyncio.Future] = None
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(user_id={self.user_id}, session_id={self.session_id})'
+
+    def cancel_interval_waiter(self) -> None:
+        if self.interval_waiter is not None:
+            self.interval_waiter.cancel()
+
+    @property
+    def prompt_message_id(self) -> Optional[int]:
+        """Id of the prompt message to edit, None if there is no sent one."""
+        sent = self.prompt_message
+        if sent is None or not sent.done() or sent.cancelled() or sent.exception() is not None:
+            return None
+        return sent.result().message_id
+
+    def on_prompt_edited(self, edited: asyncio.Future) -> None:
+        if edited.cancelled() or edited.exception() is not None:  # e.g. the user deleted the message
+            self.prompt_message = None
+
+    def answer(self, activities_num: int = 1) -> None:
+        self.unanswered = max(0, self.unanswered - activities_num)
+        if not self.unanswered:
+            self.fill_all_prompted = False
+
+    async def wait_interval(self, timeout: float) -> None:
+        """Wait `timeout` seconds for the user to choose the interval, or less if they chose it."""
+        self.cancel_interval_waiter()
+        self.interval_waiter = asyncio.create_task(asyncio.sleep(timeout))
+        try:
+            await self.interval_waiter
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.interval_waiter = None
+
+
+class SessionRegistry:
+
+    def __init__(self):
+        self._states: Dict[int, UserSessionState] = {}
+        self.opened = 0
+        self.closed = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._states
+
+    @property
+    def waiting_interval(self) -> int:
+        """Number of the users choosing the interval of the started session."""
+        return sum(state.interval_waiter is not None for state in self._states.values())
+
+    def get(self, user_id: int) -> Optional[UserSessionState]:
+        return self._states.get(user_id)
+
+    def open(self, user_id: int, session_id: int) -> UserSessionState:
+        """Register the state of the started session, replacing the state of the previous one."""
+        self.close(user_id)
+        state = self._states[user_id] = UserSessionState(user_id, session_id)
+        self.opened += 1
+        return state
+
+    def close(self, user_id: int, session_id: Optional[int] = None) -> bool:
+        """Free the state of the stopped session, only of the session if given.
+
+        Return False if there was nothing to free.
+        """
+        state = self._states.get(user_id)
+        if state is None or (session_id is not None and state.session_id != session_id):
+            return False
+        del self._states[user_id]
+        state.cancel_interval_waiter()
+        self.closed += 1
+        return True
+
+    def is_open(self, state: UserSessionState) -> bool:
+        return self._states.get(state.user_id) is state
+
+    def cancel_interval_waiter(self, user_id: int) -> None:
+        state = self._states.get(user_id)
+        if state is not None:
+            state.cancel_interval_waiter()
@@ -0,0 +1,262 @@
+"""Multi-process mode.
+
+A front process receives the updates (long polling or webhook) and routes
+them by the user id to N worker processes. The worker `index` serves the
+users with `user_id % N == index`: it processes their updates, schedules their
+prompts and writes their data, so the in-memory state of a user lives in one
+process. Workers receive the updates from the front over HTTP on localhost
+with the webhook receiver.
+"""
+import asyncio
+import multiprocessing
+import os
+import platform
+import secrets
+import signal
+import socket
+import time
+from collections import defaultdict
+from logging import config as logging_config
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, TelegramAPIError
+from aiohttp import web
+from yarl import URL
+
+from settings import LOG_CONFIG, constants
+from . import server, utils
+from .webhook import SECRET_TOKEN_HEADER, WebhookReceiver, make_app
+
+
+log = getLogger(__name__)
+
+WORKER_HOST = '127.0.0.1'
+WORKER_PATH = '/update'
+
+
+def get_update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Id of the user who caused the update, e.g. the sender of a message or of a callback query."""
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return None
+
+
+def get_shard(update: Dict[str, Any], shards_num: int) -> int:
+    user_id = get_update_user_id(update)
+    return 0 if user_id is None else user_id % shards_num
+
+
+async def watch_parent(parent_pid: int, interval: float = constants.WORKER_PARENT_CHECK_SECONDS) -> None:
+    """Stop the process gracefully when its parent is gone, e.g. the front was killed.
+
+    The orphaned worker is reparented, so its parent pid changes.
+    """
+    while os.getppid() == parent_pid:
+        await asyncio.sleep(interval)
+    log.warning(f'Front process {parent_pid} is gone, stopping')
+    # the graceful exit of `web.run_app`
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def run_worker(index: int, count: int, port: int, secret: str, outbox_rate: Optional[float] = None,
+               outbox_chat_rate: Optional[float] = None, parent_pid: Optional[int] = None) -> None:
+    """Entry point of a worker process."""
+    logging_config.dictConfig(LOG_CONFIG)
+    if platform.system() != 'Windows':
+        import uvloop
+        uvloop.install()
+
+    server.create_app()
+    server.setup_shard(index, count, outbox_rate, outbox_chat_rate)
+    app = server.make_webhook_app(WORKER_PATH, secret, url='')
+    if parent_pid is not None:
+        async def start_watching_parent(_: web.Application):
+            app['parent_watcher'] = asyncio.create_task(watch_parent(parent_pid))
+
+        async def stop_watching_parent(_: web.Application):
+            app['parent_watcher'].cancel()
+
+        app.on_startup.append(start_watching_parent)
+        app.on_cleanup.append(stop_watching_parent)
+    web.run_app(app, host=WORKER_HOST, port=port, print=None, access_log=None)
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((WORKER_HOST, 0))
+        return sock.getsockname()[1]
+
+
+class WorkerPool:
+    """Worker processes, started and stopped with the `with` block."""
+
+    def __init__(self, workers_num: int, outbox_rate: Optional[float] = None, outbox_chat_rate: Optional[float] = None):
+        self.workers_num = workers_num
+        self.secret = secrets.token_urlsafe(16)
+        self.urls: List[str] = []
+        self._outbox_rate = outbox_rate
+        self._outbox_chat_rate = outbox_chat_rate
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        # spawn: the worker must not inherit the sqlite connection and the event loop of the front
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers_num):
+            port = _get_free_port()
+            process = context.Process(target=run_worker, name=f'worker-{index}', daemon=True,
+                                      args=(index, self.workers_num, port, self.secret, self._outbox_rate,
+                                            self._outbox_chat_rate, os.getpid()))
+            process.start()
+            self._processes.append(process)
+            self.urls.append(f'http://{WORKER_HOST}:{port}{WORKER_PATH}')
+
+    def stop(self, timeout: float = constants.OUTBOX_STOP_TIMEOUT_SECONDS + 1) -> None:
+        """Stop the workers gracefully, kill the ones which do not stop in time."""
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning(f'{process.name} did not stop in time, killing it')
+                process.kill()
+        self._processes.clear()
+        self.urls.clear()
+
+    def __enter__(self) -> 'WorkerPool':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class ShardRouter:
+    """Forwards updates to the workers of their users."""
+
+    def __init__(self, worker_urls: Sequence[str], secret: str):
+        self._worker_urls = tuple(worker_urls)
+        self._headers = {SECRET_TOKEN_HEADER: secret}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.routed = 0
+
+    async def start(self, timeout: float = constants.WORKERS_START_TIMEOUT_SECONDS) -> None:
+        """Wait for the workers to accept connections."""
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        deadline = time.monotonic() + timeout
+        for url in map(URL, self._worker_urls):
+            while True:
+                try:
+                    _, writer = await asyncio.open_connection(url.host, url.port)
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f'Worker {url} has not started in {timeout} seconds')
+                    await asyncio.sleep(0.1)
+                else:
+                    writer.close()
+                    break
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def route(self, update: Dict[str, Any]) -> None:
+        url = self._worker_urls[get_shard(update, len(self._worker_urls))]
+        try:
+            while True:
+                async with self._session.post(url, json=update, headers=self._headers) as response:
+                    if response.status != 503:
+                        break
+                # the worker is overloaded, hold the update here to slow down the front
+                await asyncio.sleep(constants.WORKER_RETRY_DELAY_SECONDS)
+        except aiohttp.ClientError:
+            log.exception(f'Failed to route update {update.get("update_id")} to {url}')
+            return
+
+        if response.status != 200:
+            log.error(f'Worker {url} answered {response.status} to update {update.get("update_id")}')
+        self.routed += 1
+
+    async def route_batch(self, updates: Sequence[Dict[str, Any]]) -> None:
+        """Route the updates to the workers concurrently, keeping the order of the updates of a worker."""
+        shard_updates = defaultdict(list)
+        for update in updates:
+            shard_updates[get_shard(update, len(self._worker_urls))].append(update)
+
+        async def route_in_order(updates_of_shard: List[Dict[str, Any]]):
+            for update in updates_of_shard:
+                await self.route(update)
+
+        await asyncio.gather(*map(route_in_order, shard_updates.values()))
+
+
+async def poll_updates(bot: Bot, router: ShardRouter, timeout: int = 20) -> None:
+    """Long polling front: skip the pending updates and route the new ones."""
+    updates = await bot.get_updates(offset=-1, timeout=0)
+    offset = updates[-1].update_id + 1 if updates else None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout)
+        except (NetworkError, TelegramAPIError):
+            log.exception('Failed to get updates')
+            await asyncio.sleep(1)
+            continue
+
+        if updates:
+            offset = updates[-1].update_id + 1
+            await router.route_batch([update.to_python() for update in updates])
+
+
+async def _run_polling_front(pool: WorkerPool) -> None:
+    router = ShardRouter(pool.urls, pool.secret)
+    bot = server.create_bot()
+    try:
+        await router.start()
+        log.info(f'Started {pool.workers_num} workers')
+        await poll_updates(bot, router)
+    finally:
+        await router.close()
+        await (await bot.get_session()).close()
+
+
+def run_polling_front(workers_num: int) -> None:
+    # stop the workers on SIGTERM too: killed, the front would leave them running and prompting
+    utils.exit_on_sigterm()
+    with WorkerPool(workers_num) as pool:
+        try:
+            asyncio.run(_run_polling_front(pool))
+        except KeyboardInterrupt:
+            pass
+
+
+def make_front_app(router: ShardRouter, path: str, secret: str, url: str) -> web.Application:
+    """Webhook front app; registers `url` as the bot webhook if given."""
+    receiver = WebhookReceiver(router.route, secret)
+    app = make_app(receiver, path)
+    bot = server.create_bot()
+
+    async def startup(_: web.Application):
+        await router.start()
+        if url:
+            await bot.set_webhook(url, secret_token=secret or None, drop_pending_updates=True,
+                                  max_connections=constants.WEBHOOK_MAX_CONNECTIONS)
+
+    async def shutdown(_: web.Application):
+        await receiver.drain(constants.OUTBOX_STOP_TIMEOUT_SECONDS)
+        await router.close()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def run_webhook_front(workers_num: int, host: str, port: int, path: str, secret: str, url: str) -> None:
+    with WorkerPool(workers_num) as pool:
+        app = make_front_app(ShardRouter(pool.urls, pool.secret), path, secret, url)
+        web.run_app(app, host=host, port=port, access_log=None)
@@ -0,0 +1,105 @@
+"""Timesheet statistics.
+
+Durations are summed up by sqlite with `GROUP BY category` queries, Python
+only computes percents of the resulting (a few) rows. Whole days of a period
+are read from the `daily_stats` rollups, only the partial first day of a
+rolling period is summed up from the raw timesheet.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple, Union
+
+from aiogram import types
+from dateutil.relativedelta import relativedelta
+
+from . import utils
+from .db_manager import AsyncDBManager, DoesNotExist
+
+# Calendar-aligned periods: from the start of the current day/week/month till now
+PERIOD_TODAY = 'today'
+PERIOD_WEEK = 'week'
+PERIOD_MONTH = 'month'
+PERIOD_SESSION = 'session'
+
+# A rolling period is relativedelta kwargs, e.g. {"days": 1}, otherwise one of the PERIOD_* constants
+Period = Union[Dict[str, int], str]
+CategoryStats = Dict[str, Union[str, float, timedelta]]
+
+
+def get_period_bounds(period: Period, now: datetime) -> Tuple[datetime, datetime]:
+    if isinstance(period, dict):
+        return now - relativedelta(**period), now
+
+    day_start = utils.get_day_start(now)
+    if period == PERIOD_TODAY:
+        start = day_start
+    elif period == PERIOD_WEEK:
+        start = day_start - timedelta(days=day_start.weekday())
+    elif period == PERIOD_MONTH:
+        start = day_start.replace(day=1)
+    else:
+        raise ValueError(f'Unknown stats period: {period!r}')
+
+    return start, now
+
+
+def get_first_whole_day_start(start: datetime) -> datetime:
+    day_start = utils.get_day_start(start)
+    return day_start if day_start == start else day_start + timedelta(days=1)
+
+
+async def get_category_durations(db: AsyncDBManager, u: types.User, start: datetime, finish: datetime
+                                 ) -> Tuple[Tuple[str, int], ...]:
+    """Sum up seconds of the user's activities by categories within [start, finish), finish is now."""
+    whole_days_start = get_first_whole_day_start(start)
+    category_seconds = dict(await db.get_daily_category_durations(u, whole_days_start))
+
+    if start < whole_days_start:
+        partial_day_end = min(whole_days_start, finish)
+        for category, seconds in await db.get_category_durations(u, start, partial_day_end):
+            category_seconds[category] = category_seconds.get(category, 0) + seconds
+
+    return tuple(sorted(category_seconds.items()))
+
+
+def calc_stats(category_durations: Iterable[Tuple[str, int]]) -> Tuple[CategoryStats, ...]:
+    category_durations = tuple(category_durations)
+    all_activities_seconds = sum(seconds for _, seconds in category_durations)
+
+    category_stats = tuple(
+        dict(category=category,
+             time=timedelta(seconds=seconds),
+             percent=seconds / all_activities_seconds * 100)
+        for category, seconds in category_durations
+    )
+    return category_stats
+
+
+def represent_stats(category_stats: Tuple[CategoryStats, ...]) -> str:
+    category_stat_template = '{category:<15} {time} ({percent:.2f}%)'
+    stats_repr = '\n'.join(category_stat_template.format(**stats)
+                           for stats in category_stats)
+    return stats_repr
+
+
+async def get_stats(db: AsyncDBManager, u: types.User, period: Period) -> str:
+    msg_title = 'За {stat_period} ваша статистика следующая:'
+
+    if period == PERIOD_SESSION:
+        session_id, *_ = await db.get_last_started_session(u)
+        category_durations = await db.get_session_category_durations(session_id)
+        stat_period = 'последнюю сессию'
+    else:
+        t0, t1 = get_period_bounds(period, datetime.now())
+        category_durations = await get_category_durations(db, u, t0, t1)
+        stat_period = f'{t0:%Y-%m-%d %H:%M:%S} - {t1:%Y-%m-%d %H:%M:%S}'
+
+    if not category_durations:
+        raise DoesNotExist()
+
+    # TODO: other representations
+    stats = calc_stats(category_durations)
+    stats_repr = represent_stats(stats)
+    stats_repr = f'{msg_title}\n`{stats_repr}`'
+    stats_repr = stats_repr.format(stat_period=stat_period)
+
+    return stats_repr
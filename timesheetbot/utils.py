@@ -1,6 +1,33 @@
-from datetime import datetime
+import signal
+import sys
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
 
 
 def parse_datetime(str_datetime: str) -> datetime:
     parsed = datetime.strptime(str_datetime.rsplit(".", 1)[0], "%Y-%m-%d %H:%M:%S")
     return parsed
+
+
+def get_day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def exit_on_sigterm() -> None:
+    """Turn SIGTERM (`docker stop`, systemd) into SystemExit, so `finally` blocks and shutdown hooks run.
+
+    By default SIGTERM kills the process on the spot.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+
+def split_by_days(start: int, finish: int) -> Iterator[Tuple[int, int]]:
+    """Split [start, finish) period of UNIX timestamps by local days.
+
+    Yield (UNIX timestamp of the day start, seconds of the period within the day).
+    """
+    while start < finish:
+        day_start = get_day_start(datetime.fromtimestamp(start))
+        next_day_start = int((day_start + timedelta(days=1)).timestamp())
+        yield int(day_start.timestamp()), min(finish, next_day_start) - start
+        start = next_day_start
@@ -0,0 +1,80 @@
+"""Webhook receiver of Telegram updates.
+
+The update is acknowledged as soon as it is accepted and is processed in the
+background. At most `max_in_flight` updates are processed at once: an update
+waits up to `queue_timeout` seconds for a free slot, otherwise it is answered
+with 503 and Telegram redelivers it later.
+"""
+import asyncio
+import hmac
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiohttp import web
+
+from settings import constants
+
+
+log = getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+UpdateFeeder = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class WebhookReceiver:
+
+    def __init__(self, feed_update: UpdateFeeder, secret: str = '',
+                 max_in_flight: int = constants.WEBHOOK_MAX_IN_FLIGHT,
+                 queue_timeout: float = constants.WEBHOOK_QUEUE_TIMEOUT_SECONDS):
+        self._feed_update = feed_update
+        self._secret = secret
+        self._queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight: Set[asyncio.Task] = set()
+        self.received = 0
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._secret and not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), self._secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self._queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            log.warning(f'Too many updates in flight, rejected update {update.get("update_id")}')
+            return web.Response(status=503)
+
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]) -> None:
+        try:
+            await self._feed_update(update)
+        except Exception:
+            log.exception(f'Update {update.get("update_id")} failed')
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float) -> None:
+        """Wait for the updates in flight to be processed."""
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=timeout)
+
+
+def make_app(receiver: WebhookReceiver, path: str) -> web.Application:
+    app = web.Application()
+    app.router.add_post(path, receiver.handle)
+    return app